@@ -24,14 +24,63 @@ class FirePred:
         self.viirs = ee.ImageCollection("NASA/VIIRS/002/VNP09GA")
         # VIIRS vegetation index
         self.viirs_veg_idx = ee.ImageCollection("NASA/VIIRS/002/VNP13A1")
+        # MODIS/VIIRS active fire detections
+        self.active_fire = ee.ImageCollection("FIRMS")
 
-    def compute_daily_features(self, start_time:str, end_time:str, geometry:ee.Geometry):
+    def compute_static_features(self, geometry:ee.Geometry):
+        """_summary_ Compute the features that never change: elevation and the terrain derivatives.
+
+        Args:
+            geometry (ee.Geometry): _description_
+
+        Returns:
+            ee.Image: _description_ Image with the slope, aspect and elevation bands, inside the given geometry.
+        """
+        elevation = self.srtm.select('elevation')
+        slope = ee.Terrain.slope(elevation)
+        aspect = ee.Terrain.aspect(elevation)
+        return ee.Image([slope, aspect, elevation]).clip(geometry)
+
+    def compute_annual_features(self, year:str, geometry:ee.Geometry):
+        """_summary_ Compute the features that change once per year: the MODIS land cover class.
+
+        Args:
+            year (str): _description_ Year as YYYY.
+            geometry (ee.Geometry): _description_
+
+        Returns:
+            ee.Image: _description_ Image with the land cover band, inside the given geometry.
+        """
+        igbp_land_cover = self.landcover.filterDate(year + '-01-01', year + '-12-31').filterBounds(
+            geometry).select('LC_Type1').median()
+        return igbp_land_cover.clip(geometry)
+
+    def compute_fire_activity(self, start_time:str, end_time:str, min_confidence=0):
+        """_summary_ Compute a mask of the active fire detections in the given time range.
+
+        Args:
+            start_time (str): _description_
+            end_time (str): _description_
+            min_confidence (int): _description_ Minimum FIRMS detection confidence (0-100).
+
+        Returns:
+            ee.Image: _description_ Image with the band "active fire", 1 where a fire was detected and 0 elsewhere.
+        """
+        no_fire = ee.Image.constant(0).toUint8().rename('confidence')
+        confidence = self.active_fire.filterDate(start_time, end_time).select('confidence') \
+            .merge(ee.ImageCollection([no_fire.selfMask()])).max()
+        return confidence.gte(min_confidence).unmask(0).rename('active fire')
+
+    def compute_daily_features(self, start_time:str, end_time:str, geometry:ee.Geometry, include_static=True):
         """_summary_ Compute the daily features in Google Earth Engine.
 
         Args:
             start_time (str): _description_
             end_time (str): _description_
             geometry (ee.Geometry): _description_
+            include_static (bool): _description_ Whether to include the static and annual bands (slope, aspect,
+                elevation, land cover). Without them the image only contains the time-varying bands, which
+                can be joined with `compute_static_features` and `compute_annual_features` later on.
 
         Returns:
             ee.ImageCollection: _description_ ImageCollection containing one image, 
@@ -85,10 +134,6 @@ class FirePred:
         else:
             forecast_rain = forecast_rain.reduce(ee.Reducer.last())
         forecast_rain.rename("forecast total precipitation")
-        # Elevation Data
-        elevation = self.srtm.select('elevation')
-        slope = ee.Terrain.slope(elevation)
-        aspect = ee.Terrain.aspect(elevation)
 
         # Drought Data
         # Only available every fifth day, but we can find the valid entry via time_start and time_end
@@ -96,8 +141,6 @@ class FirePred:
             .filter(ee.Filter.lte("system:time_start", today_timestamp)) \
             .filter(ee.Filter.gte("system:time_end", today_timestamp)) \
             .select('pdsi').median()
-        igbp_land_cover = self.landcover.filterDate(start_time[:4] + '-01-01', start_time[:4] + '-12-31').filterBounds(
-            geometry).select('LC_Type1').median()
 
         # Turn acq_time (String) into acq_hour (int)
         def add_acq_hour(feature):
@@ -114,11 +157,17 @@ class FirePred:
             ee.Reducer.last())
 
 
+        if include_static:
+            terrain = [self.compute_static_features(geometry)]
+            land_cover = [self.compute_annual_features(start_time[:4], geometry)]
+        else:
+            terrain = []
+            land_cover = []
+
         combined_img = ee.Image(
             [viirs_img, viirs_veg_idc, precipitation, wind_velocity, wind_direction, temperature_min, temperature_max,
-             energy_release_component, specific_humidity, slope, aspect,
-             elevation, drought_index, igbp_land_cover,
-             forecast_rain, forecast_wind_speed, forecast_wind_direction, forecast_temperature,
+             energy_release_component, specific_humidity] + terrain + [drought_index] + land_cover +
+            [forecast_rain, forecast_wind_speed, forecast_wind_direction, forecast_temperature,
              forecast_specific_humidity,
              ])
 
@@ -128,5 +177,27 @@ class FirePred:
         # Return an ImageCollection containing the clipped image
         return clipped_img
 
+    def compute_features_for_range(self, start_date:str, num_days:int, geometry:ee.Geometry, include_static=True):
+        """_summary_ Compute the daily features of several consecutive days as one image.
+
+        Args:
+            start_date (str): _description_ First day as YYYY-MM-DD.
+            num_days (int): _description_ Number of days.
+            geometry (ee.Geometry): _description_
+            include_static (bool): _description_ See `compute_daily_features`.
+
+        Returns:
+            ee.Image: _description_ Image with the bands of `compute_daily_features` for every day, one day after
+            the other, named {feature}_{date}.
+        """
+        first_day = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+        daily_images = []
+        for day in range(num_days):
+            date = (first_day + datetime.timedelta(days=day)).strftime('%Y-%m-%d')
+            daily_image = self.compute_daily_features(date + 'T00:00', date + 'T23:59', geometry, include_static)
+            daily_images.append(daily_image.rename(
+                daily_image.bandNames().map(lambda name: ee.String(name).cat('_' + date))))
+        return ee.Image(daily_images)
+
     def get_buffer(self, feature):
         return feature.buffer(375 / 2).bounds()
@@ -0,0 +1,348 @@
+'''
+End-to-end benchmark of extract_images.py against the local fake Earth Engine server.
+
+1. The fake server is started in this process with the given latency, bandwidth per connection, error rate and
+   throttling, and a seed that fixes the payloads, the injected errors and the retry jitter.
+2. extract_images.py runs in a child process over the first `--days` days of June 2024 and the first `--regions`
+   sub-regions of config/US_polygons.json (see benchmarks/offline_extract.py). The static and land cover layers of
+   the sub-regions are fetched as well. Every argument that this script does not know is passed on to
+   extract_images.py, e.g. --backend pixels, --cog, --days_per_request 7, --url_workers 10 or --workers 4.
+3. The tiles per second and MB per second of the run (from the run summary in events.jsonl), the CPU time and the
+   peak memory of the child process (including its worker processes), and the p50/p90 of every stage are
+   reported.
+4. The result is appended to a JSON lines file together with the commit, the scenario and the settings, and
+   compared with the last stored result of the same scenario, so the effect of a change to the concurrency, the
+   download chunk size or the output format shows up as a difference between two runs.
+
+With --kill_worker_after and --workers <n>, one worker process is killed that many seconds into the run (with
+leases of KILL_LEASE_SECONDS unless --lease_seconds is given). The benchmark then fails unless every job of the
+shared work queue is done, every tile is recorded in the manifest and no job was completed twice by the workers
+that finished; the killed worker is left out of the reported results.
+
+Usage:
+    python -m benchmarks.bench_extract [--days <n>] [--regions <n>] [--bandwidth <MB/s>] [--error_rate <0-1>]
+                                       [--chunk_size <bytes>] [--label <text>] [--kill_worker_after <seconds>]
+                                       [extract_images.py arguments]
+'''
+
+import argparse
+import glob
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+import extract_images
+from benchmarks.fake_earth_engine import FakeEarthEngineServer
+from pipeline.manifest import DONE as MANIFEST_DONE, JobManifest
+from pipeline.work_queue import DONE as QUEUE_DONE, open_work_queue
+
+YEAR = 2024
+START_MONTH = 6
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), "results.jsonl")
+# lease of the workers of a run with a killed worker, so that its jobs are taken over quickly
+KILL_LEASE_SECONDS = 5
+# results compared with the previous run, with True if larger is better
+COMPARED_RESULTS = {
+    "tiles_per_second": True,
+    "received_mb_per_second": True,
+    "run_seconds": False,
+    "cpu_seconds": False,
+    "peak_rss_mb": False,
+    "written_mb": False,
+}
+
+
+def write_regions_file(path, num_regions):
+    """Write the first `num_regions` sub-regions of the configured grid to a GeoJSON file."""
+    with open(extract_images.GEOJSON_FILE, 'r') as f:
+        sub_regions = json.load(f)
+    if num_regions > len(sub_regions['features']):
+        raise ValueError(f"The grid only has {len(sub_regions['features'])} sub-regions")
+    sub_regions['features'] = sub_regions['features'][:num_regions]
+    with open(path, 'w') as f:
+        json.dump(sub_regions, f)
+
+
+def git_commit():
+    """Short hash of the checked out commit, with a "-dirty" suffix if tracked files are modified."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"]).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def last_summary(event_log):
+    """Summary of the last run in an event log (see pipeline/metrics.py)."""
+    summary = None
+    with open(event_log, 'r') as f:
+        for line in f:
+            event = json.loads(line)
+            if "summary" in event:
+                summary = event["summary"]
+    if summary is None:
+        raise RuntimeError(f"The run wrote no summary to {event_log}")
+    return summary
+
+
+def worker_event_logs(output_dir, killed_pid=None):
+    """Event logs of a run, without the one of the worker that was killed."""
+    killed_log = os.path.join(output_dir, f"events_{socket.gethostname()}-{killed_pid}.jsonl")
+    event_logs = [event_log for event_log in glob.glob(os.path.join(output_dir, "events*.jsonl"))
+                  if event_log != killed_log]
+    if not event_logs:
+        raise RuntimeError(f"The run wrote no event log to {output_dir}")
+    return event_logs
+
+
+def run_summary(output_dir, killed_pid=None):
+    """Summary of the run in an output directory, merged over the event logs of the workers of a sharded run.
+
+    The elapsed time is that of the slowest worker, and the stage percentiles are the largest of any worker.
+    """
+    event_logs = worker_event_logs(output_dir, killed_pid)
+    summaries = [last_summary(event_log) for event_log in event_logs]
+    merged = {"elapsed": max(summary["elapsed"] for summary in summaries), "counters": {}, "stages": {}}
+    for summary in summaries:
+        for counter, value in summary["counters"].items():
+            merged["counters"][counter] = merged["counters"].get(counter, 0) + value
+        for stage, statistics in summary["stages"].items():
+            stage_statistics = merged["stages"].setdefault(stage, {"p50": 0.0, "p90": 0.0, "bytes": 0})
+            stage_statistics["p50"] = max(stage_statistics["p50"], statistics["p50"])
+            stage_statistics["p90"] = max(stage_statistics["p90"], statistics["p90"])
+            stage_statistics["bytes"] += statistics.get("bytes", 0)
+    return merged
+
+
+def written_tiles(output_dir):
+    """Number and total size in bytes of the GeoTIFFs in an output directory."""
+    count, size = 0, 0
+    for directory, _, filenames in os.walk(output_dir):
+        for filename in filenames:
+            if filename.endswith(".tif"):
+                count += 1
+                size += os.path.getsize(os.path.join(directory, filename))
+    return count, size
+
+
+def kill_worker(launcher):
+    """Kill the first worker process of a sharded run.
+
+    Returns:
+        int: Process id of the killed worker.
+    """
+    workers = subprocess.run(["pgrep", "-P", str(launcher.pid)], capture_output=True, text=True).stdout.split()
+    if not workers:
+        raise RuntimeError("No worker process is running, start extract_images.py with --workers or kill later")
+    pid = int(workers[0])
+    os.kill(pid, signal.SIGKILL)
+    return pid
+
+
+def check_exactly_once(output_dir, killed_pid):
+    """Raise unless every job of the shared work queue is done and was completed once by the workers that finished.
+
+    Returns:
+        int: Number of jobs in the queue.
+    """
+    work_queue = open_work_queue(os.path.join(output_dir, extract_images.QUEUE_FILE))
+    queue_counts = work_queue.counts()
+    work_queue.close()
+    total = sum(queue_counts.values())
+    if queue_counts != {QUEUE_DONE: total}:
+        raise RuntimeError(f"Not every job of the work queue is done: {queue_counts}")
+
+    manifest = JobManifest(os.path.join(output_dir, extract_images.MANIFEST_FILE))
+    manifest_counts = manifest.counts()
+    manifest.close()
+    tiles, _ = written_tiles(output_dir)
+    if manifest_counts != {MANIFEST_DONE: tiles}:
+        raise RuntimeError(f"The manifest does not record the {tiles} written tiles as done: {manifest_counts}")
+
+    completions = Counter()
+    for event_log in worker_event_logs(output_dir, killed_pid):
+        with open(event_log, 'r') as f:
+            for line in f:
+                event = json.loads(line)
+                if event.get("counter") == "done":
+                    completions[event["date"], event["region"]] += 1
+    repeated = {job: count for job, count in completions.items() if count > 1}
+    if repeated:
+        raise RuntimeError(f"Jobs completed more than once: {repeated}")
+    return total
+
+
+def run_extract(server, args, extract_args, work_dir):
+    """Run extract_images.py in a child process and measure it.
+
+    Returns:
+        dict: The results of the run.
+    """
+    regions_file = os.path.join(work_dir, "regions.json")
+    output_dir = os.path.join(work_dir, "output")
+    log_filename = os.path.join(work_dir, "extract.log")
+    write_regions_file(regions_file, args.regions)
+    command = [
+        sys.executable, "-m", "benchmarks.offline_extract", "--server", server.base_url,
+        "--regions_file", regions_file, "--days", str(args.days), "--chunk_size", str(args.chunk_size),
+        "--seed", str(args.seed), str(YEAR), "--start_month", str(START_MONTH), "--output_dir", output_dir,
+    ] + extract_args
+
+    start = time.perf_counter()
+    killed_pid = None
+    with open(log_filename, 'w') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        if args.kill_worker_after is not None:
+            time.sleep(args.kill_worker_after)
+            killed_pid = kill_worker(process)
+        # wait4 reports the CPU time and peak memory of the child and of the worker processes it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    process_seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        with open(log_filename, 'r') as log:
+            print(log.read()[-4000:])
+        raise RuntimeError(f"extract_images.py failed with exit code {process.returncode}")
+
+    summary = run_summary(output_dir, killed_pid)
+    queued_jobs = check_exactly_once(output_dir, killed_pid) if killed_pid is not None else None
+    tiles, written = written_tiles(output_dir)
+    received = sum(summary["stages"].get(stage, {}).get("bytes", 0) for stage in ("download", "pixels"))
+    cpu_seconds = usage.ru_utime + usage.ru_stime
+    return {
+        "tiles": tiles,
+        "jobs": summary["counters"].get("done", 0),
+        "failed": summary["counters"].get("failed", 0),
+        "retries": summary["counters"].get("retries", 0),
+        "killed_worker": killed_pid,
+        "queued_jobs": queued_jobs,
+        "run_seconds": summary["elapsed"],
+        "process_seconds": process_seconds,
+        "tiles_per_second": tiles / summary["elapsed"],
+        "received_mb": received / 1e6,
+        "received_mb_per_second": received / 1e6 / summary["elapsed"],
+        "written_mb": written / 1e6,
+        "cpu_seconds": cpu_seconds,
+        "cpu_cores": cpu_seconds / process_seconds,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": usage.ru_maxrss * 1024 / 1e6,
+        "server_errors": server.errors,
+        "server_throttled": server.throttled,
+        "stages": {stage: {"p50": statistics["p50"], "p90": statistics["p90"]}
+                   for stage, statistics in summary["stages"].items()},
+    }
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_results(record):
+    scenario, results = record["scenario"], record["results"]
+    bandwidth = f"{scenario['bandwidth']} MB/s" if scenario["bandwidth"] else "unlimited"
+    print(f"{scenario['regions']} regions x {scenario['days']} days, url latency {scenario['url_latency']}s, "
+          f"download latency {scenario['download_latency']}s, bandwidth {bandwidth} per connection, "
+          f"error rate {scenario['error_rate']:g}")
+    print(f"settings: chunk size {record['settings']['chunk_size']} bytes, "
+          f"arguments: {' '.join(record['settings']['extract_args']) or '(defaults)'}")
+    print(f"tiles: {results['tiles']} in {results['run_seconds']:.2f}s ({results['tiles_per_second']:.1f} tiles/s), "
+          f"{results['jobs']} jobs, {results['retries']} retries, {results['failed']} failed")
+    if results.get("killed_worker") is not None:
+        print(f"killed worker {results['killed_worker']}: all {results['queued_jobs']} queued jobs completed once")
+    print(f"received: {results['received_mb']:.1f} MB ({results['received_mb_per_second']:.1f} MB/s), "
+          f"written: {results['written_mb']:.1f} MB")
+    print(f"client CPU: {results['cpu_seconds']:.2f}s ({results['cpu_cores']:.2f} cores over "
+          f"{results['process_seconds']:.2f}s), peak memory: {results['peak_rss_mb']:.0f} MB")
+    print("stages: " + ", ".join(f"{stage} p50 {statistics['p50'] * 1000:.0f} ms"
+                                 for stage, statistics in results["stages"].items()))
+
+
+def print_comparison(previous, record):
+    """Print the change of the compared results since a previous run of the same scenario."""
+    print(f"compared with {previous['time']} ({previous['commit']}"
+          + (f", {previous['label']}" if previous.get('label') else "") + ")")
+    for setting, value in record["settings"].items():
+        if previous["settings"].get(setting) != value:
+            print(f"  {setting}: {previous['settings'].get(setting)} -> {value}")
+    for name, larger_is_better in COMPARED_RESULTS.items():
+        before, after = previous["results"][name], record["results"][name]
+        change = (after - before) / before * 100 if before else 0.0
+        verdict = ""
+        if abs(change) >= 5:
+            verdict = "better" if (change > 0) == larger_is_better else "worse"
+        print(f"  {name:24s} {before:10.2f} -> {after:10.2f} ({change:+.1f}%) {verdict}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=7, help="Number of fake days")
+    parser.add_argument("--regions", type=int, default=20, help="Number of sub-regions")
+    parser.add_argument("--url_latency", type=float, default=0.2, help="Latency of an Earth Engine request in seconds")
+    parser.add_argument("--download_latency", type=float, default=0.05,
+                        help="Latency of a download in seconds")
+    parser.add_argument("--bandwidth", type=float, default=20,
+                        help="Download bandwidth per connection in MB/s, 0 for unlimited")
+    parser.add_argument("--error_rate", type=float, default=0.01,
+                        help="Probability that a request is answered with HTTP 500")
+    parser.add_argument("--throttle_every", type=int, default=0,
+                        help="Answer every n-th request with 429 (0 disables)")
+    parser.add_argument("--max_concurrent", type=int,
+                        help="Requests in flight per endpoint before the fake server answers with 429")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the payloads, the errors and the retry jitter")
+    parser.add_argument("--chunk_size", type=int, default=extract_images.DOWNLOAD_CHUNK_SIZE,
+                        help="Bytes read from a download response at a time")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSON lines file the results are appended to")
+    parser.add_argument("--label", help="Description of the run stored with the results")
+    parser.add_argument("--kill_worker_after", type=float,
+                        help="Kill one worker process of a --workers run after this many seconds")
+    args, extract_args = parser.parse_known_args()
+    if args.kill_worker_after is not None:
+        if not any(argument.startswith("--workers") for argument in extract_args):
+            parser.error("--kill_worker_after needs --workers <n> with n > 1")
+        if not any(argument.startswith("--lease_seconds") for argument in extract_args):
+            extract_args += ["--lease_seconds", str(KILL_LEASE_SECONDS)]
+
+    scenario = {
+        "days": args.days, "regions": args.regions, "url_latency": args.url_latency,
+        "download_latency": args.download_latency, "bandwidth": args.bandwidth, "error_rate": args.error_rate,
+        "throttle_every": args.throttle_every, "max_concurrent": args.max_concurrent, "seed": args.seed,
+    }
+    if args.kill_worker_after is not None:
+        scenario["kill_worker_after"] = args.kill_worker_after
+    server = FakeEarthEngineServer(args.url_latency, args.download_latency, max_concurrent=args.max_concurrent,
+                                   throttle_every=args.throttle_every, error_rate=args.error_rate,
+                                   bandwidth=args.bandwidth * 1e6 if args.bandwidth else None, seed=args.seed)
+    with server, tempfile.TemporaryDirectory() as work_dir:
+        results = run_extract(server, args, extract_args, work_dir)
+
+    record = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "scenario": scenario,
+        "settings": {"chunk_size": args.chunk_size, "extract_args": extract_args},
+        "results": results,
+    }
+    print_results(record)
+    previous = [result for result in load_results(args.results) if result["scenario"] == scenario]
+    if previous:
+        print_comparison(previous[-1], record)
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == '__main__':
+    main()
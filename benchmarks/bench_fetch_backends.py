@@ -0,0 +1,54 @@
+'''
+Benchmark for the fetch backends in extract_images.py.
+
+Runs one day of jobs against the local fake Earth Engine server, once with the GeoTIFF backend (download URL,
+download to a temporary file, decode with rasterio) and once with the pixels backend (canned NPY arrays decoded
+directly into an array), and reports the wall time and the client CPU time of both.
+
+Usage:
+    python -m benchmarks.bench_fetch_backends [--regions <n>] [--size <pixels>] [--url_latency <seconds>]
+'''
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import extract_images
+from benchmarks.fake_earth_engine import FakeEarthEngineServer, FakeImage
+from pipeline.pixels import pixel_grid
+
+
+def run_day(server, num_regions, backend):
+    """Process one fake day with the given backend and return (wall time, CPU time) in seconds."""
+    extract_images.prepare_daily_image = lambda geometry, date_of_interest: FakeImage(
+        server.base_url, f"{date_of_interest}_{geometry}")
+    extract_images.compute_pixels = lambda image, grid: image.compute_pixels(grid)
+    grids = [pixel_grid([[[-120.5, 39.5], [-119.5, 39.5], [-119.5, 40.5], [-120.5, 40.5]]])] * num_regions
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start, start_cpu = time.perf_counter(), time.process_time()
+        jobs = extract_images.iter_jobs(list(range(num_regions)), ["2024-06-01"])
+        asyncio.run(extract_images.process_jobs(jobs, output_dir, backend=backend, grids=grids))
+        return time.perf_counter() - start, time.process_time() - start_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, default=60, help="Number of fake sub-regions to process")
+    parser.add_argument("--size", type=int, default=300, help="Width and height of the fake tiles in pixels")
+    parser.add_argument("--url_latency", type=float, default=0.05, help="Latency of an Earth Engine request in seconds")
+    parser.add_argument("--download_latency", type=float, default=0.05, help="Latency of a download in seconds")
+    args = parser.parse_args()
+
+    with FakeEarthEngineServer(args.url_latency, args.download_latency, height=args.size, width=args.size) as server:
+        results = {backend: run_day(server, args.regions, backend) for backend in sorted(extract_images.FETCH_BACKENDS)}
+
+    print(f"{args.regions} regions of {args.size}x{args.size} pixels")
+    for backend, (elapsed, cpu) in results.items():
+        print(f"{backend:8s} wall time: {elapsed:.2f}s ({args.regions / elapsed:.1f} tiles/s), "
+              f"client CPU: {cpu:.2f}s ({cpu / args.regions * 1000:.1f} ms/tile)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Benchmark for the adaptive rate limiting and retries in extract_images.py.
+
+Runs a batch of jobs against the local fake Earth Engine server that answers with HTTP 429 once more than
+`--max_concurrent` requests are in flight and additionally on every `--throttle_every`-th request. Reports the
+wall time, the number of throttled requests and how many tiles were lost.
+
+Usage:
+    python -m benchmarks.bench_rate_limit [--regions <n>] [--max_concurrent <n>] [--throttle_every <n>]
+'''
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import extract_images
+from benchmarks.fake_earth_engine import FakeEarthEngineServer, FakeImage
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, default=100, help="Number of fake sub-regions to process")
+    parser.add_argument("--max_concurrent", type=int, default=8,
+                        help="Requests in flight per endpoint before the fake server answers with 429")
+    parser.add_argument("--throttle_every", type=int, default=10,
+                        help="Answer every n-th request with 429 (0 disables)")
+    parser.add_argument("--url_latency", type=float, default=0.1, help="Latency of a download URL request in seconds")
+    parser.add_argument("--download_latency", type=float, default=0.05, help="Latency of a download in seconds")
+    args = parser.parse_args()
+
+    server = FakeEarthEngineServer(args.url_latency, args.download_latency,
+                                   max_concurrent=args.max_concurrent, throttle_every=args.throttle_every)
+    with server, tempfile.TemporaryDirectory() as output_dir:
+        extract_images.prepare_daily_image = lambda geometry, date_of_interest: FakeImage(
+            server.base_url, f"{date_of_interest}_{geometry}")
+
+        start = time.perf_counter()
+        jobs = extract_images.iter_jobs(list(range(args.regions)), ["2024-06-01"])
+        failures = asyncio.run(extract_images.process_jobs(jobs, output_dir))
+        elapsed = time.perf_counter() - start
+        written = len([name for name in os.listdir(output_dir) if name.endswith(".tif")])
+
+    print(f"{args.regions} regions against a server limited to {args.max_concurrent} concurrent requests "
+          f"and throttling every {args.throttle_every}th request")
+    print(f"wall time: {elapsed:.2f}s ({args.regions / elapsed:.1f} tiles/s)")
+    print(f"throttled responses: {server.throttled}")
+    print(f"tiles written: {written}, permanently failed: {len(failures)}")
+
+
+if __name__ == '__main__':
+    main()
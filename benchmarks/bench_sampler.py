@@ -0,0 +1,119 @@
+'''
+Benchmark for the patch sampler.
+
+Writes synthetic daily tiles with a few fire pixels and the static and land cover layers of every sub-region,
+ingests them into a cube, builds the fire index and then compares the throughput of the sampler (windowed reads of
+the cube in worker processes with prefetching) with the naive approach of reading the whole full stack GeoTIFF
+tiles of every time step and cutting the patch out of them. Both must return patches with all bands of the full
+stack.
+
+Usage:
+    python -m benchmarks.bench_sampler [--regions <n>] [--days <n>] [--size <pixels>] [--batches <n>]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+
+from pipeline.band_schema import write_band_metadata
+from pipeline.cube import ingest
+from pipeline.fire_index import FIRE_THRESHOLD, FireIndex, build_fire_index
+from pipeline.layers import (ANNUAL_BANDS, DAILY_BANDS, FULL_BANDS, STATIC_BANDS, STATIC_DIR, landcover_filename,
+                             read_full_stack, static_filename)
+from pipeline.sampler import PatchSampler
+
+YEAR = 2024
+
+
+def write_tile(filename, data, bands, transform):
+    with rasterio.open(filename, 'w', driver="GTiff", count=len(bands), height=data.shape[1], width=data.shape[2],
+                       dtype=data.dtype, crs="EPSG:4326", transform=transform) as dataset:
+        dataset.write(data)
+        write_band_metadata(dataset, bands)
+
+
+def write_tiles(output_dir, num_regions, num_days, size, rng):
+    """Write random int16 daily tiles, each with a small cluster of fire pixels in the first band, and the static
+    and land cover layers of every sub-region."""
+    start = datetime(YEAR, 6, 1)
+    os.makedirs(os.path.join(output_dir, STATIC_DIR), exist_ok=True)
+    for region in range(1, num_regions + 1):
+        transform = Affine(0.003, 0, -120 + region, 0, -0.003, 40)
+        for day in range(num_days):
+            data = rng.integers(0, 4000, (len(DAILY_BANDS), size, size), dtype="int16")
+            row, col = rng.integers(0, size - 3, 2)
+            data[0, row:row + 3, col:col + 3] = FIRE_THRESHOLD + 1000
+            date_of_interest = (start + timedelta(days=day)).strftime('%Y-%m-%d')
+            write_tile(os.path.join(output_dir, f"{date_of_interest}_{region}.tif"), data, DAILY_BANDS, transform)
+        write_tile(static_filename(output_dir, region),
+                   rng.integers(0, 4000, (len(STATIC_BANDS), size, size), dtype="int16"), STATIC_BANDS, transform)
+        write_tile(landcover_filename(output_dir, YEAR, region),
+                   rng.integers(1, 18, (1, size, size), dtype="uint8"), ANNUAL_BANDS, transform)
+
+
+def read_naive(output_dir, index, locations, patch_size, num_days):
+    """Read the patches by opening the whole tile of every time step, joined with its static layers."""
+    patches = []
+    for region, day, row, col in locations.tolist():
+        steps = []
+        for step in range(day - num_days + 1, day + 1):
+            filename = os.path.join(output_dir, f"{index.date(step)}_{region}.tif")
+            tile, _ = read_full_stack(filename)
+            padded = np.pad(tile, ((0, 0), (patch_size, patch_size), (patch_size, patch_size)))
+            steps.append(padded[:, row + patch_size:row + 2 * patch_size, col + patch_size:col + 2 * patch_size])
+        patches.append(np.stack(steps))
+    return np.stack(patches)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, default=8, help="Number of fake sub-regions")
+    parser.add_argument("--days", type=int, default=32, help="Number of fake days")
+    parser.add_argument("--size", type=int, default=300, help="Width and height of the fake tiles in pixels")
+    parser.add_argument("--patch_size", type=int, default=64, help="Width and height of the patches")
+    parser.add_argument("--num_days", type=int, default=5, help="Time steps of the patches")
+    parser.add_argument("--batch_size", type=int, default=16, help="Patches per batch")
+    parser.add_argument("--batches", type=int, default=50, help="Number of batches to read")
+    parser.add_argument("--workers", type=int, default=4, help="Number of sampler worker processes")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as output_dir:
+        write_tiles(output_dir, args.regions, args.days, args.size, rng)
+        cube_path = os.path.join(output_dir, "cube.zarr")
+        index_dir = os.path.join(output_dir, "fire_index")
+        ingest(output_dir, cube_path, args.workers)
+        start = time.perf_counter()
+        count = build_fire_index(cube_path, index_dir, workers=args.workers)
+        print(f"Indexed {count} fire pixels in {time.perf_counter() - start:.2f}s")
+
+        sampler = PatchSampler(cube_path, index_dir, args.patch_size, args.num_days, decoded=False,
+                               batch_size=args.batch_size, workers=args.workers, seed=0)
+        start = time.perf_counter()
+        patches = 0
+        for batch, locations in sampler.batches(args.batches):
+            if batch.shape[2] != len(FULL_BANDS):
+                raise RuntimeError(f"The sampler returned {batch.shape[2]} bands instead of {len(FULL_BANDS)}")
+            patches += len(batch)
+        elapsed = time.perf_counter() - start
+
+        locations = sampler.sample_locations(args.batch_size * 4)
+        start = time.perf_counter()
+        naive = read_naive(output_dir, FireIndex(index_dir), locations, args.patch_size, args.num_days)
+        naive_elapsed = time.perf_counter() - start
+        if naive.shape[2] != len(FULL_BANDS):
+            raise RuntimeError(f"The naive reader returned {naive.shape[2]} bands instead of {len(FULL_BANDS)}")
+
+    print(f"sampler: {patches / elapsed:.0f} patches/s ({patches} patches of {args.num_days}x{len(FULL_BANDS)}x"
+          f"{args.patch_size}x{args.patch_size}, {args.workers} workers)")
+    print(f"naive:   {len(naive) / naive_elapsed:.0f} patches/s (whole tiles, 1 process)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+Benchmark for the two-stage region pipeline in extract_images.py.
+
+Runs one day of jobs through `process_jobs` against the local fake Earth Engine server with injected latency, once
+with a single URL worker (equivalent to resolving the download URLs on the event loop, one after the other) and
+once with the default thread pool, and reports the speedup.
+
+Usage:
+    python -m benchmarks.bench_url_pipeline [--regions <n>] [--url_latency <seconds>] [--download_latency <seconds>]
+'''
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import extract_images
+from benchmarks.fake_earth_engine import FakeEarthEngineServer, FakeImage
+
+
+def run_day(server, num_regions, url_workers, download_workers):
+    """Process one fake day and return the wall time in seconds."""
+    extract_images.prepare_daily_image = lambda geometry, date_of_interest: FakeImage(
+        server.base_url, f"{date_of_interest}_{geometry}")
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        jobs = extract_images.iter_jobs(list(range(num_regions)), ["2024-06-01"])
+        asyncio.run(extract_images.process_jobs(
+            jobs, output_dir, url_workers=url_workers, download_workers=download_workers))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, default=60, help="Number of fake sub-regions to process")
+    parser.add_argument("--url_latency", type=float, default=0.2, help="Latency of a download URL request in seconds")
+    parser.add_argument("--download_latency", type=float, default=0.05, help="Latency of a download in seconds")
+    args = parser.parse_args()
+
+    with FakeEarthEngineServer(args.url_latency, args.download_latency) as server:
+        serial = run_day(server, args.regions, 1, extract_images.DOWNLOAD_LIMIT)
+        parallel = run_day(server, args.regions, extract_images.URL_REQUEST_LIMIT, extract_images.DOWNLOAD_LIMIT)
+
+    print(f"{args.regions} regions, url latency {args.url_latency}s, download latency {args.download_latency}s")
+    print(f"serial URL resolution:   {serial:.2f}s ({args.regions / serial:.1f} tiles/s)")
+    print(f"parallel URL resolution: {parallel:.2f}s ({args.regions / parallel:.1f} tiles/s)")
+    print(f"speedup: {serial / parallel:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
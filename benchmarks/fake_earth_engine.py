@@ -0,0 +1,285 @@
+'''
+Local stand-in for the Google Earth Engine endpoints used by extract_images.py.
+
+The server runs an aiohttp application on localhost in a background thread and exposes:
+
+1. GET /url/<name>       - plays the role of `ee.Image.getDownloadURL`, answers with a download URL after
+                           `url_latency` seconds.
+2. GET /download/<name>  - plays the role of the download URL, answers with a synthetic multi-band GeoTIFF
+                           after `download_latency` seconds.
+3. GET /pixels/<name>    - plays the role of `ee.data.computePixels`, answers with a canned NPY array with one
+                           field per band after `url_latency` seconds.
+
+The number of bands, the data type and the size of a payload can be chosen per request with the `bands`, `dtype`,
+`height` and `width` query parameters (the arguments of the server are the defaults), and the georeferencing of a
+GeoTIFF with `west`, `north` and `pixel_size`, so that the tiles of different sub-regions are placed where their
+polygons are. Payloads are generated once per combination with a fixed seed. With `bandwidth` the payloads are streamed
+at that many bytes per second per connection.
+
+The endpoints can fail like the real services: with `max_concurrent` requests in flight further requests are
+answered with HTTP 429, with `throttle_every` every n-th request is answered with HTTP 429, and `error_rate` is the
+probability of an HTTP 500. Whether a request fails is derived from the seed, the endpoint, the name and the
+number of earlier requests for that name, so the same attempts fail in every run whatever the order of the
+requests.
+
+`FakeImage` mimics the small part of `ee.Image` that the extractor uses and performs a blocking HTTP request
+in `getDownloadURL` and `compute_pixels`, just like the real client.
+'''
+
+import asyncio
+import io
+import random
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+import ee
+import numpy as np
+from aiohttp import web
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+
+# bytes written at a time when the bandwidth is limited
+STREAM_CHUNK_SIZE = 64 * 1024
+# upper left corner and pixel size of GeoTIFFs requested without georeferencing
+DEFAULT_WEST, DEFAULT_NORTH, DEFAULT_PIXEL_SIZE = -120.0, 40.0, 0.003
+
+
+def random_data(bands, height, width, dtype, seed=0):
+    """Random (bands, height, width) data in a plausible range of the data type."""
+    rng = np.random.default_rng(seed)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        high = min(np.iinfo(dtype).max, 10000)
+        return rng.integers(0, high, (bands, height, width), dtype=dtype, endpoint=True)
+    return rng.random((bands, height, width)).astype(dtype)
+
+
+def make_geotiff(bands=18, height=64, width=64, dtype="float32", seed=0, west=DEFAULT_WEST, north=DEFAULT_NORTH,
+                 pixel_size=DEFAULT_PIXEL_SIZE):
+    """Create the bytes of a synthetic GeoTIFF with random data on a grid with the given upper left corner and
+    pixel size in degrees."""
+    profile = {
+        "driver": "GTiff", "count": bands, "height": height, "width": width, "dtype": dtype,
+        "crs": "EPSG:4326", "transform": from_origin(west, north, pixel_size, pixel_size),
+    }
+    with MemoryFile() as memory_file:
+        with memory_file.open(**profile) as dataset:
+            dataset.write(random_data(bands, height, width, dtype, seed))
+        return memory_file.read()
+
+
+def make_npy(bands=18, height=64, width=64, dtype="float32", seed=0):
+    """Create the NPY bytes of a synthetic (height, width) array with one field per band, like computePixels."""
+    data = np.empty((height, width), dtype=[(f"b{band}", dtype) for band in range(bands)])
+    for name, band_data in zip(data.dtype.names, random_data(bands, height, width, dtype, seed)):
+        data[name] = band_data
+    buffer = io.BytesIO()
+    np.save(buffer, data)
+    return buffer.getvalue()
+
+
+class FakeEarthEngineServer:
+    def __init__(self, url_latency=0.2, download_latency=0.05, bands=18, height=64, width=64,
+                 max_concurrent=None, throttle_every=0, error_rate=0.0, bandwidth=None, seed=0):
+        """Serve synthetic payloads with injected latency, bandwidth limits and errors.
+
+        Args:
+            bands, height, width: Default shape of the payloads.
+            bandwidth (float): Bytes per second per connection of the downloads and pixels, unlimited if None.
+            error_rate (float): Probability that a request is answered with HTTP 500.
+            seed (int): Seed of the payloads and of the injected errors.
+        """
+        self.url_latency = url_latency
+        self.download_latency = download_latency
+        self.bands = bands
+        self.height = height
+        self.width = width
+        self.max_concurrent = max_concurrent
+        self.throttle_every = throttle_every
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.seed = seed
+        self.url_requests = 0
+        self.downloads = 0
+        self.pixel_requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.in_flight = {"url": 0, "download": 0, "pixels": 0}
+        self.base_url = None
+        self._attempts = Counter()
+        self._payloads = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def payload(self):
+        """GeoTIFF payload with the default shape."""
+        return self._payload(make_geotiff, self.bands, "float32", self.height, self.width)
+
+    @property
+    def pixels_payload(self):
+        """NPY payload with the default shape."""
+        return self._payload(make_npy, self.bands, "float32", self.height, self.width)
+
+    def _payload(self, make, bands, dtype, height, width, **georeference):
+        key = (make, bands, dtype, height, width, tuple(sorted(georeference.items())))
+        if key not in self._payloads:
+            self._payloads[key] = make(bands, height, width, dtype, self.seed, **georeference)
+        return self._payloads[key]
+
+    def _request_payload(self, request, make):
+        query = request.query
+        georeference = {}
+        if make is make_geotiff:
+            georeference = {name: float(query[name]) for name in ("west", "north", "pixel_size") if name in query}
+        return self._payload(make, int(query.get("bands", self.bands)), query.get("dtype", "float32"),
+                             int(query.get("height", self.height)), int(query.get("width", self.width)),
+                             **georeference)
+
+    def _should_throttle(self, stage, request_number):
+        if self.max_concurrent is not None and self.in_flight[stage] >= self.max_concurrent:
+            return True
+        return self.throttle_every > 0 and request_number % self.throttle_every == 0
+
+    def _should_fail(self, stage, name):
+        if self.error_rate <= 0:
+            return False
+        self._attempts[stage, name] += 1
+        attempt_rng = random.Random(f"{self.seed}:{stage}:{name}:{self._attempts[stage, name]}")
+        return attempt_rng.random() < self.error_rate
+
+    async def _serve(self, request, stage, request_number, latency, make_body, content_type):
+        if self._should_throttle(stage, request_number):
+            self.throttled += 1
+            return web.Response(status=429, text="Too many requests")
+        if self._should_fail(stage, request.match_info["name"]):
+            self.errors += 1
+            return web.Response(status=500, text="Internal error")
+        self.in_flight[stage] += 1
+        try:
+            await asyncio.sleep(latency)
+            body = make_body()
+            self.bytes_sent += len(body)
+            if self.bandwidth is None or stage == "url":
+                return web.Response(body=body, content_type=content_type)
+
+            response = web.StreamResponse(headers={"Content-Type": content_type})
+            response.content_length = len(body)
+            await response.prepare(request)
+            try:
+                for start in range(0, len(body), STREAM_CHUNK_SIZE):
+                    chunk = body[start:start + STREAM_CHUNK_SIZE]
+                    await response.write(chunk)
+                    await asyncio.sleep(len(chunk) / self.bandwidth)
+                await response.write_eof()
+            except ConnectionResetError:
+                # the client went away, e.g. a worker that was killed
+                pass
+            return response
+        finally:
+            self.in_flight[stage] -= 1
+
+    async def _handle_url(self, request):
+        self.url_requests += 1
+        download_url = f"{self.base_url}/download/{request.match_info['name']}"
+        if request.query_string:
+            download_url += f"?{request.query_string}"
+        return await self._serve(request, "url", self.url_requests, self.url_latency,
+                                 lambda: download_url.encode(), "text/plain")
+
+    async def _handle_download(self, request):
+        self.downloads += 1
+        return await self._serve(request, "download", self.downloads, self.download_latency,
+                                 lambda: self._request_payload(request, make_geotiff), "image/tiff")
+
+    async def _handle_pixels(self, request):
+        self.pixel_requests += 1
+        return await self._serve(request, "pixels", self.pixel_requests, self.url_latency,
+                                 lambda: self._request_payload(request, make_npy), "application/octet-stream")
+
+    def _make_app(self):
+        app = web.Application()
+        app.router.add_get("/url/{name}", self._handle_url)
+        app.router.add_get("/download/{name}", self._handle_download)
+        app.router.add_get("/pixels/{name}", self._handle_pixels)
+        return app
+
+    def start(self):
+        """Start the server on a free localhost port in a background thread."""
+        started = threading.Event()
+
+        async def run():
+            self._runner = web.AppRunner(self._make_app())
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.base_url = f"http://127.0.0.1:{port}"
+            started.set()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(run())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeImage:
+    """Minimal replacement for the `ee.Image` returned by `prepare_image`.
+
+    `bands`, `dtype`, `height` and `width` are sent to the server as the shape of the payload, and `west`, `north`
+    and `pixel_size` as the georeferencing of a GeoTIFF; the defaults of the server are used for the ones that are
+    None.
+    """
+
+    def __init__(self, base_url, name, bands=None, dtype=None, height=None, width=None, west=None, north=None,
+                 pixel_size=None):
+        self.base_url = base_url
+        self.name = name
+        self.bands = bands
+        self.dtype = dtype
+        self.height = height
+        self.width = width
+        self.west = west
+        self.north = north
+        self.pixel_size = pixel_size
+
+    def _get(self, endpoint):
+        query = {"bands": self.bands, "dtype": self.dtype, "height": self.height, "width": self.width,
+                 "west": self.west, "north": self.north, "pixel_size": self.pixel_size}
+        query = urllib.parse.urlencode({key: value for key, value in query.items() if value is not None})
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/{endpoint}/{self.name}?{query}") as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            # the real client surfaces quota and server errors as EEException
+            if e.code == 429:
+                raise ee.EEException(f"Too many concurrent aggregations. HTTP {e.code}")
+            raise ee.EEException(f"Internal error. HTTP {e.code}")
+
+    def getDownloadURL(self, params):
+        return self._get("url").decode()
+
+    def compute_pixels(self, grid):
+        """Stand-in for `ee.data.computePixels` with the NPY file format."""
+        return self._get("pixels")
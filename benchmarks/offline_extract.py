@@ -0,0 +1,86 @@
+'''
+Run extract_images.py end to end against the local fake Earth Engine server.
+
+Replaces the parts of `ee` that the extractor touches (initialization, geometries, image graphs, quantization and
+computePixels) with `FakeImage`s of the server, limits the run to the first `--days` days and to the sub-regions
+in `--regions_file`, and then calls `extract_images.main` with the remaining arguments. Every job requests a payload
+with the bands of its layer and days, in the data type the band schema (or Earth Engine) would produce, and the size and
+position of its sub-region at 375 m, so that the tiles of different sub-regions do not overlap. This is the process
+measured by benchmarks/bench_extract.py; --sparse is not supported, as the fire activity query has no stand-in.
+
+Usage:
+    python -m benchmarks.offline_extract --server <url> --regions_file <geojson> --days <n> [--chunk_size <bytes>]
+                                         [--seed <n>] <year> [extract_images.py arguments]
+'''
+
+import argparse
+import itertools
+import random
+import sys
+
+import ee
+
+import extract_images
+from benchmarks.fake_earth_engine import FakeImage
+from pipeline.band_schema import storage_dtype
+from pipeline.layers import LAYER_BANDS
+from pipeline.pixels import pixel_grid
+
+
+def job_image(base_url, job):
+    """`FakeImage` of a job with the bands and pixels of its layer, days and sub-region."""
+    grid = pixel_grid(job.geometry)
+    dimensions, affine = grid['dimensions'], grid['affineTransform']
+    name = f"{extract_images.manifest_key(job)}_{job.sub_region_number}_{job.layer}_{job.num_days}"
+    return FakeImage(base_url, name, len(LAYER_BANDS[job.layer]) * job.num_days, "float32",
+                     dimensions['height'], dimensions['width'], affine['translateX'], affine['translateY'],
+                     affine['scaleX'])
+
+
+def quantized_image(image, bands):
+    """The image with the data type that Earth Engine exports for the storage types of the bands."""
+    return FakeImage(image.base_url, image.name, image.bands, storage_dtype(bands), image.height, image.width,
+                     image.west, image.north, image.pixel_size)
+
+
+def install_fakes(base_url, days, regions_file, chunk_size=None, seed=0):
+    """Point the extractor at the fake server and limit the run to the first `days` days.
+
+    The worker processes of --workers run this script with the same options.
+    """
+    ee.Initialize = lambda *args, **kwargs: None
+    ee.ServiceAccountCredentials = lambda *args, **kwargs: None
+    # the geometries are kept as GeoJSON coordinates
+    ee.Geometry.Polygon = lambda coordinates: coordinates
+    extract_images.prepare_image = lambda job: job_image(base_url, job)
+    extract_images.quantize_image = quantized_image
+    extract_images.compute_pixels = lambda image, grid: image.compute_pixels(grid)
+    extract_images.GEOJSON_FILE = regions_file
+
+    iter_dates = extract_images.iter_dates
+    extract_images.iter_dates = lambda year, start_month, end_month: itertools.islice(
+        iter_dates(year, start_month, 12), days)
+    extract_images.WORKER_COMMAND = [sys.executable, "-m", "benchmarks.offline_extract", "--server", base_url,
+                                     "--regions_file", regions_file, "--days", str(days), "--seed", str(seed)]
+    if chunk_size is not None:
+        extract_images.DOWNLOAD_CHUNK_SIZE = chunk_size
+        extract_images.WORKER_COMMAND += ["--chunk_size", str(chunk_size)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", required=True, help="Base URL of the fake Earth Engine server")
+    parser.add_argument("--regions_file", required=True, help="GeoJSON feature collection of the sub-regions")
+    parser.add_argument("--days", type=int, required=True, help="Number of days from the start month")
+    parser.add_argument("--chunk_size", type=int, help="Bytes read from a download response at a time")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the retry jitter")
+    args, extract_args = parser.parse_known_args()
+
+    random.seed(args.seed)
+    install_fakes(args.server, args.days, args.regions_file, args.chunk_size, args.seed)
+    sys.argv = ["extract_images.py"] + extract_args
+    extract_images.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Spatiotemporal Cube Builder
+
+This script consolidates the daily GeoTIFFs written by extract_images.py into one chunked, compressed Zarr store
+indexed by (region, time, band, y, x), together with the static and land cover layers (see pipeline/cube.py).
+
+1. Finds the daily tiles <date>_<region>.tif and the static layers in the output directory.
+2. Grows the cube for new days and sub-regions.
+3. Writes the tiles that are not yet in the cube with a pool of worker processes, one per time chunk of a
+   sub-region at a time.
+
+Rerunning the script after a new extraction run only ingests the new days.
+
+Usage:
+    python build_cube.py <output_dir> [--cube <path>] [--workers <n>] [--time_chunk <days>]
+                         [--spatial_chunk <pixels>] [--overwrite]
+
+Reading a time window:
+    from pipeline.cube import TileCube
+    cube = TileCube("data/fire_images/cube.zarr")
+    window = cube.read(42, "2024-06-01", "2024-06-07", bands=["VIIRS band M11"], decoded=True)
+'''
+
+import argparse
+import os
+import time
+
+from pipeline.cube import SPATIAL_CHUNK, TIME_CHUNK, ingest
+
+# name of the cube inside the output directory
+CUBE_FILE = "cube.zarr"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consolidate the extracted tiles into a Zarr cube.")
+    parser.add_argument("output_dir", help="Output directory of extract_images.py")
+    parser.add_argument("--cube", help="Path of the Zarr store, default is cube.zarr in the output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of writer processes")
+    parser.add_argument("--time_chunk", type=int, default=TIME_CHUNK,
+                        help="Days per chunk, only used when the cube is created")
+    parser.add_argument("--spatial_chunk", type=int, default=SPATIAL_CHUNK,
+                        help="Pixels per chunk along y and x, only used when the cube is created")
+    parser.add_argument("--overwrite", action="store_true", help="Ingest tiles again that are already in the cube")
+    args = parser.parse_args()
+
+    cube_path = args.cube or os.path.join(args.output_dir, CUBE_FILE)
+    start = time.perf_counter()
+    count = ingest(args.output_dir, cube_path, args.workers, args.time_chunk, args.spatial_chunk, args.overwrite)
+    print(f"Ingested {count} tiles into {cube_path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''
+Fire Pixel Index Builder
+
+This script scans the cube written by build_cube.py once for active fire pixels and writes a compact index of their
+coordinates per (date, sub-region), which the patch sampler uses to serve training patches around active fire
+(see pipeline/fire_index.py and pipeline/sampler.py):
+
+1. Reads the fire band of every sub-region, one time chunk at a time, in a pool of worker processes.
+2. Writes the (date, sub-region) table and the pixel coordinates as .npy files to the index directory.
+
+Rerun the script after new days were ingested into the cube.
+
+Usage:
+    python build_fire_index.py <output_dir> [--cube <path>] [--index <path>] [--band <name>]
+                               [--threshold <value>] [--workers <n>]
+
+Sampling patches:
+    from pipeline.sampler import PatchSampler
+    sampler = PatchSampler("data/fire_images/cube.zarr", "data/fire_images/fire_index", patch_size=64, num_days=5)
+    for patches, locations in sampler.batches(100):
+        ...
+'''
+
+import argparse
+import os
+import time
+
+from build_cube import CUBE_FILE
+from pipeline.fire_index import FIRE_BAND, FIRE_THRESHOLD, build_fire_index
+
+# name of the index directory inside the output directory
+INDEX_DIR = "fire_index"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the active fire pixels of the cube.")
+    parser.add_argument("output_dir", help="Output directory of extract_images.py")
+    parser.add_argument("--cube", help="Path of the Zarr store, default is cube.zarr in the output directory")
+    parser.add_argument("--index", help="Index directory, default is fire_index in the output directory")
+    parser.add_argument("--band", default=FIRE_BAND, help="Band that identifies fire pixels")
+    parser.add_argument("--threshold", type=float, default=FIRE_THRESHOLD,
+                        help="Pixels where the band exceeds this value (in physical units) are fire pixels")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args()
+
+    cube_path = args.cube or os.path.join(args.output_dir, CUBE_FILE)
+    index_dir = args.index or os.path.join(args.output_dir, INDEX_DIR)
+    start = time.perf_counter()
+    count = build_fire_index(cube_path, index_dir, args.band, args.threshold, args.workers)
+    print(f"Indexed {count} fire pixels of {cube_path} into {index_dir} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Daily Mosaic Builder
+
+This script combines the sub-region tiles written by extract_images.py into one mosaic per day, so that areas
+crossing the edges of the 1 degree cells can be analysed and visualized with a single read (see
+pipeline/mosaic.py):
+
+1. Groups the daily tiles <date>_<region>.tif of the output directory by date.
+2. Writes a virtual mosaic <date>.vrt per day into the mosaics directory, referencing the tiles.
+3. With --materialize, also writes a single aligned, tiled and compressed GeoTIFF <date>.tif per day.
+
+The days are processed in parallel by a pool of worker processes.
+
+Usage:
+    python build_mosaics.py <output_dir> [--dates <YYYY-MM-DD> ...] [--materialize] [--workers <n>]
+                            [--compress {ZSTD,DEFLATE}]
+'''
+
+import argparse
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from pipeline.layers import find_tiles
+from pipeline.mosaic import build_day
+
+# directory inside the output directory containing the mosaics
+MOSAIC_DIR = "mosaics"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build daily mosaics of the extracted sub-region tiles.")
+    parser.add_argument("output_dir", help="Output directory of extract_images.py")
+    parser.add_argument("--dates", nargs="+", help="Only build the mosaics of these days")
+    parser.add_argument("--materialize", action="store_true", help="Also write each mosaic as a single GeoTIFF")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of days processed in parallel")
+    parser.add_argument("--compress", choices=["ZSTD", "DEFLATE"], default="ZSTD",
+                        help="Compression of the materialized mosaics")
+    args = parser.parse_args()
+
+    tiles_by_date = defaultdict(list)
+    for (date_of_interest, _), filename in sorted(find_tiles(args.output_dir).items()):
+        if args.dates is None or date_of_interest in args.dates:
+            tiles_by_date[date_of_interest].append(filename)
+
+    mosaic_dir = os.path.join(args.output_dir, MOSAIC_DIR)
+    os.makedirs(mosaic_dir, exist_ok=True)
+    print(f"Building mosaics of {len(tiles_by_date)} days in {mosaic_dir}")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            date_of_interest: executor.submit(build_day, date_of_interest, tile_files, mosaic_dir, args.materialize,
+                                              args.compress)
+            for date_of_interest, tile_files in tiles_by_date.items()
+        }
+        for date_of_interest, future in futures.items():
+            try:
+                print(f"{date_of_interest}: {', '.join(future.result())}")
+            except Exception as e:
+                print(f"Error building the mosaic of {date_of_interest}: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+Dataset Statistics
+
+This script computes the per-band normalization constants of the tiles written by extract_images.py in one
+parallel pass (see pipeline/stats.py) and writes them to a JSON sidecar in the output directory:
+
+1. Finds the daily tiles and the static and land cover layers that are not yet covered by the sidecar.
+2. Computes mergeable statistics (count, missing pixels, min, max, mean, std, quantile sketch and land cover
+   class histogram) of batches of files in a pool of worker processes and merges them.
+3. Writes the normalization constants ("bands") for the loaders, together with the mergeable state and the list of
+   covered files, so rerunning the script after new days were extracted only reads the new tiles.
+
+Usage:
+    python compute_statistics.py <output_dir> [--output <path>] [--workers <n>] [--batch_size <files>]
+                                 [--percentiles <p> ...] [--recompute]
+
+Reading the constants:
+    import json
+    bands = json.load(open("data/fire_images/statistics.json"))["bands"]
+    mean, std = bands["NDVI"]["mean"], bands["NDVI"]["std"]
+'''
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pipeline.layers import find_static_layers, find_tiles
+from pipeline.stats import (PERCENTILES, file_signature, load_sidecar, merge_statistics, new_statistics,
+                            statistics_of_files, write_sidecar)
+
+# name of the sidecar inside the output directory
+STATISTICS_FILE = "statistics.json"
+
+
+def find_files(output_dir):
+    """Daily tiles, static and land cover layers of an output directory, relative to it."""
+    static, landcover = find_static_layers(output_dir)
+    filenames = list(find_tiles(output_dir).values()) + list(static.values()) + list(landcover.values())
+    return sorted(os.path.relpath(filename, output_dir) for filename in filenames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the per-band statistics of the extracted tiles.")
+    parser.add_argument("output_dir", help="Output directory of extract_images.py")
+    parser.add_argument("--output", help="Path of the JSON sidecar, default is statistics.json in the output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--batch_size", type=int, default=32, help="Files per task of a worker")
+    parser.add_argument("--percentiles", nargs="+", type=float, default=list(PERCENTILES),
+                        help="Percentiles written to the sidecar")
+    parser.add_argument("--recompute", action="store_true", help="Ignore the existing sidecar and read all files")
+    args = parser.parse_args()
+
+    sidecar_path = args.output or os.path.join(args.output_dir, STATISTICS_FILE)
+    statistics, covered = (new_statistics(), {}) if args.recompute else load_sidecar(sidecar_path)
+    files = {name: file_signature(os.path.join(args.output_dir, name)) for name in find_files(args.output_dir)}
+    changed = [name for name, signature in covered.items() if files.get(name) != signature]
+    if changed:
+        # statistics cannot be subtracted, so rewritten or deleted files require a full pass
+        print(f"{len(changed)} files changed since the last run, recomputing all statistics")
+        statistics, covered = new_statistics(), {}
+    new_files = [name for name in files if name not in covered]
+    print(f"Computing statistics of {len(new_files)} new files ({len(covered)} already covered)")
+
+    start = time.perf_counter()
+    batches = [[os.path.join(args.output_dir, name) for name in new_files[index:index + args.batch_size]]
+               for index in range(0, len(new_files), args.batch_size)]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(statistics_of_files, batch) for batch in batches]
+        for completed, future in enumerate(as_completed(futures), start=1):
+            merge_statistics(statistics, future.result())
+            if completed % 100 == 0:
+                print(f"Merged {completed}/{len(batches)} batches")
+
+    covered.update({name: files[name] for name in new_files})
+    write_sidecar(sidecar_path, statistics, covered, args.percentiles)
+    print(f"Wrote the statistics of {len(covered)} files to {sidecar_path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,63 @@ This script processes satellite imagery using Google Earth Engine for US during
 2. Downloads images for specific dates and regions in GeoTIFF format.
 3. Uses asynchronous programming to efficiently handle multiple requests to Google Earth Engine.
 
+Every (date, sub-region) job of the requested time range is put on one shared queue that is drained by a
+fixed pool of workers, using a single event loop and HTTP session for the whole run. Each job goes through
+two stages with their own concurrency limits: the blocking Earth Engine calls (building the image and
+requesting its download URL) run in a bounded thread pool, and the downloads run concurrently on the
+aiohttp event loop.
+
+The number of requests in flight in each stage adapts to the responses (AIMD): it grows while requests
+succeed and is halved when Earth Engine or the download server throttles. Failed jobs are retried with
+exponential backoff and jitter, and jobs that still fail are listed in a summary at the end of the run.
+
+Images are written atomically (to a temporary file that is renamed once complete) and every job is recorded
+in a SQLite manifest in the output directory. With --resume only jobs that are missing or failed are scheduled.
+
+The daily images only contain the time-varying bands. Elevation, slope and aspect are downloaded once per
+sub-region and the land cover once per sub-region and year into the `static` directory of the output directory
+(see pipeline/layers.py, which also joins them back into the full stack). With --inline_static the daily images
+contain all 22 bands instead.
+
+Unless --keep_float is given, every band is converted to a scaled integer in Earth Engine before the download
+(see pipeline/band_schema.py) and the band names, scales and offsets are written into the GeoTIFFs.
+
+With --sparse the active fire pixels of every sub-region are counted first with one small query per day, and
+only the tiles with fire activity (plus --spatial_buffer neighboring tiles and --temporal_buffer preceding days)
+are downloaded. The selection is recorded in fire_selection.json in the output directory (see
+pipeline/fire_activity.py).
+
+With --days_per_request <n> the daily images of up to n consecutive days of one sub-region are computed as one
+Earth Engine image and fetched in one download, which is then split into the usual per-day files.
+
+Jobs are fetched by one of two backends (--backend): `geotiff` requests a GeoTIFF download URL and downloads the
+file, `pixels` computes the pixels on a fixed grid with ee.data.computePixels and decodes the NPY payload
+directly into an array (see pipeline/pixels.py).
+
+With --cog every written tile is rewritten as a Cloud-Optimized GeoTIFF (internal tiles, compression, band
+descriptions and overviews, see pipeline/cog.py) in a process pool, so the conversion does not block the event
+loop.
+
+With --queue (or --workers <n>) the run is sharded: the jobs are enqueued in a shared work queue (by default
+queue.sqlite in the output directory, see pipeline/work_queue.py) and leased by any number of worker processes,
+on one machine or several with the same command. A worker renews its leases while it runs, and the jobs of a
+worker that crashed are leased by the others once its leases expire. --workers <n> starts n worker processes
+on this machine, and --credentials assigns every worker its own service account and rate limits, so that the
+throughput grows with the number of quotas.
+
+Every stage of every job (graph build, URL request, time to first byte, download, disk writes, ...) is timed
+(see pipeline/metrics.py): a progress line with the throughput and the ETA is printed every --progress_interval
+seconds, every measurement is appended to events.jsonl in the output directory, and a summary with the latency
+percentiles of every stage is printed at the end of the run.
+
 Usage:
-    python script_name.py <year> [--start_month <1-12>] [--end_month <1-12>] [--output_dir <output_directory>] 
+    python script_name.py <year> [--start_month <1-12>] [--end_month <1-12>] [--output_dir <output_directory>]
+                                 [--url_workers <n>] [--download_workers <n>] [--max_retries <n>] [--resume]
+                                 [--inline_static] [--keep_float] [--sparse [--min_fire_confidence <0-100>]
+                                 [--spatial_buffer <tiles>] [--temporal_buffer <days>]] [--days_per_request <n>]
+                                 [--backend {geotiff,pixels}] [--cog [--cog_compression {ZSTD,DEFLATE}]]
+                                 [--progress_interval <seconds>] [--queue <path>] [--workers <n>]
+                                 [--credentials <accounts.json>] [--lease_seconds <seconds>]
 
 Example:
     python script_name.py 2024 --start_month 6 --end_month 8 --output_dir data/fire_images 
@@ -21,84 +76,741 @@ Ensure you have the necessary Google Earth Engine credentials and .env file conf
 import os
 import ee
 import json
+import hashlib
+import rasterio
 from DataClasses.satellites.FirePred import FirePred
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import argparse
 import asyncio
 import aiohttp
-
-# limit for Google Earth Engine http requests
-REQUEST_LIMIT = 30
+import functools
+import itertools
+import socket
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pipeline.band_schema import quantize_image, write_band_metadata
+from pipeline.cog import COMPRESSIONS, convert_to_cog
+from pipeline.fire_activity import query_fire_activity, select_tiles, write_selection
+from pipeline.grid import TileIndex
+from pipeline.layers import (DAILY, FULL, LANDCOVER, LAYER_BANDS, STATIC, STATIC_DIR, landcover_filename,
+                             static_filename)
+from pipeline.manifest import JobManifest
+from pipeline.metrics import RunMetrics
+from pipeline.pixels import compute_pixels, decode_pixels, pixel_grid, write_geotiff
+from pipeline.rate_limit import AdaptiveLimiter, backoff_delay, is_retriable_error
+from pipeline.work_queue import MAX_ATTEMPTS, open_work_queue
+
+# upper limit for concurrent Google Earth Engine download URL requests (size of the thread pool)
+URL_REQUEST_LIMIT = 30
+# upper limit for concurrent image downloads
+DOWNLOAD_LIMIT = 30
+# bytes read from a download response at a time
+DOWNLOAD_CHUNK_SIZE = 1024
+# number of times a failed job is retried before it is given up
+MAX_RETRIES = 5
 # config file containing the feature collection of sub regions in US
 GEOJSON_FILE = "config/US_polygons.json"
-
-def prepare_daily_image(geometry, date_of_interest: str, time_stamp_start="00:00", time_stamp_end="23:59"):
+# name of the job manifest inside the output directory
+MANIFEST_FILE = "manifest.sqlite"
+# name of the record of the sparse tile selection inside the output directory
+SELECTION_FILE = "fire_selection.json"
+# name of the JSON lines log of the stage timings inside the output directory
+EVENT_LOG_FILE = "events.jsonl"
+# seconds between two progress lines
+PROGRESS_INTERVAL = 10
+# name of the shared work queue of sharded runs inside the output directory
+QUEUE_FILE = "queue.sqlite"
+# seconds a worker holds a leased job before another worker may take it over; leases are renewed while it runs
+LEASE_SECONDS = 300
+# number of jobs leased from the shared queue at a time
+LEASE_BATCH_SIZE = 8
+# seconds between two polls of the shared queue while the remaining jobs are leased by other workers
+QUEUE_POLL_INTERVAL = 2
+# command that runs a worker process of --workers, followed by the arguments of the worker
+WORKER_COMMAND = [sys.executable, os.path.abspath(__file__)]
+
+# names of the fetch backends
+GEOTIFF_BACKEND = "geotiff"
+PIXELS_BACKEND = "pixels"
+
+# a single unit of work: one layer of one sub-region on `num_days` consecutive days starting at `date_of_interest`.
+# Static jobs have no date, land cover jobs use the year as date.
+Job = namedtuple("Job", ["date_of_interest", "sub_region_number", "geometry", "layer", "num_days"],
+                 defaults=(DAILY, 1))
+
+# everything a fetch backend needs to process jobs: the Earth Engine thread pool, the limiters of the two stages,
+# the HTTP session, the output directory, whether to quantize the bands, the pixel grid of every sub-region and
+# the process pool and compression of the COG conversion (None if tiles are kept as downloaded) and the
+# `RunMetrics` of the run
+FetchContext = namedtuple("FetchContext", ["url_executor", "url_limiter", "download_limiter", "session",
+                                           "output_dir", "quantize", "grids", "cog_executor", "cog_compression",
+                                           "metrics", "database_executor"], defaults=(None, None))
+
+@functools.lru_cache(maxsize=None)
+def get_satellite_client():
+    """FirePred client shared by all jobs, created on first use (after Earth Engine has been initialized)."""
+    return FirePred()
+
+def prepare_daily_image(geometry, date_of_interest: str, time_stamp_start="00:00", time_stamp_end="23:59",
+                        include_static=False):
     """Prepare a daily image collection from the FirePred satellite client."""
-    satellite_client = FirePred()
+    satellite_client = get_satellite_client()
     img = satellite_client.compute_daily_features(
         date_of_interest + 'T' + time_stamp_start,
         date_of_interest + 'T' + time_stamp_end,
-        geometry
+        geometry,
+        include_static=include_static
     )
     return img
 
-async def download_image(session, url, output_filename):
+def prepare_image(job):
+    """Prepare the image of any layer of a job."""
+    if job.layer == STATIC:
+        return get_satellite_client().compute_static_features(job.geometry)
+    if job.layer == LANDCOVER:
+        return get_satellite_client().compute_annual_features(job.date_of_interest, job.geometry)
+    if job.num_days > 1:
+        return get_satellite_client().compute_features_for_range(job.date_of_interest, job.num_days, job.geometry,
+                                                                 include_static=job.layer == FULL)
+    if job.layer == FULL:
+        return prepare_daily_image(job.geometry, job.date_of_interest, include_static=True)
+    return prepare_daily_image(job.geometry, job.date_of_interest)
+
+def tile_filename(output_dir, date_of_interest, sub_region_number):
+    """Path of the GeoTIFF for one sub-region on one day."""
+    return f"{output_dir}/{date_of_interest}_{sub_region_number}.tif"
+
+def job_filename(output_dir, job):
+    """Path of the GeoTIFF of a job. Multi-day jobs are downloaded to a temporary stack file that is split."""
+    if job.layer == STATIC:
+        return static_filename(output_dir, job.sub_region_number)
+    if job.layer == LANDCOVER:
+        return landcover_filename(output_dir, job.date_of_interest, job.sub_region_number)
+    if job.num_days > 1:
+        return f"{output_dir}/{job.date_of_interest}_{job.sub_region_number}_{job.num_days}days.tif"
+    return tile_filename(output_dir, job.date_of_interest, job.sub_region_number)
+
+def job_dates(job):
+    """Every date covered by a daily job."""
+    first_day = datetime.strptime(job.date_of_interest, '%Y-%m-%d')
+    return [(first_day + timedelta(days=day)).strftime('%Y-%m-%d') for day in range(job.num_days)]
+
+def manifest_key(job):
+    """Date column under which a job is recorded in the manifest."""
+    if job.layer == STATIC:
+        return STATIC
+    if job.layer == LANDCOVER:
+        return f"{LANDCOVER}-{job.date_of_interest}"
+    return job.date_of_interest
+
+def manifest_keys(job):
+    """Date columns of every output of a job, one per day for multi-day jobs."""
+    if job.num_days > 1:
+        return job_dates(job)
+    return [manifest_key(job)]
+
+def job_labels(job):
+    """Labels of the metrics events of a job."""
+    return {"date": manifest_key(job), "region": job.sub_region_number}
+
+def is_job_complete(manifest, job):
+    """Check whether all outputs of a job are recorded as complete in the manifest."""
+    return all(manifest.is_complete(key, job.sub_region_number) for key in manifest_keys(job))
+
+def job_task(job):
+    """(key, payload) of a job in the shared work queue. The geometry is looked up by the sub-region number."""
+    payload = {"date": job.date_of_interest, "region": job.sub_region_number, "layer": job.layer,
+               "num_days": job.num_days}
+    return f"{manifest_key(job)}/{job.sub_region_number}", json.dumps(payload)
+
+def task_job(payload, region_geometries):
+    """Job of a payload of the shared work queue."""
+    task = json.loads(payload)
+    return Job(task["date"], task["region"], region_geometries[task["region"] - 1], task["layer"], task["num_days"])
+
+def file_checksum(filename, chunk_size=1 << 20):
+    """SHA-256 checksum of a file."""
+    checksum = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+def finish_download(temp_filename, output_filename, size, checksum, bands=None):
+    """Validate a downloaded GeoTIFF, write the band schema into it if `bands` is given and rename it to
+    `output_filename`.
+
+    `size` and `checksum` are those of the streamed bytes; they are taken again if the band schema was written.
+
+    Returns:
+        tuple: (size in bytes, SHA-256 checksum, band count) of the written file.
+    """
+    if bands is None:
+        with rasterio.open(temp_filename) as tif_image:
+            band_count = tif_image.count
+    else:
+        with rasterio.open(temp_filename, 'r+') as tif_image:
+            band_count = tif_image.count
+            if band_count != len(bands):
+                raise ValueError(f"Expected {len(bands)} bands, but the download has {band_count}")
+            write_band_metadata(tif_image, bands)
+        size = os.path.getsize(temp_filename)
+        checksum = file_checksum(temp_filename)
+    os.replace(temp_filename, output_filename)
+    return size, checksum, band_count
+
+async def download_image(session, url, output_filename, bands=None, metrics=None, labels=None):
     """
     Asynchronously download an image from the given URL and save it to a local file.
+
+    The image is streamed to a temporary file, validated and only then renamed to `output_filename`, so an
+    interrupted download never leaves a truncated file under the final name. If `bands` is given, the names,
+    scales and offsets of these bands are written into the file (and the checksum is taken afterwards). The time
+    to first byte, the download, the disk writes and the final write step are recorded in `metrics`.
+
+    Returns:
+        tuple: (size in bytes, SHA-256 checksum, band count) of the written file.
     """
+    metrics = metrics or RunMetrics()
+    labels = labels or {}
+    temp_filename = output_filename + ".part"
+    stream_checksum = hashlib.sha256()
+    size = 0
 
+    request_start = time.perf_counter()
     async with session.get(url) as response:
-        if response.status == 200:
-            with open(output_filename, 'wb') as f:
+        metrics.record("ttfb", time.perf_counter() - request_start, **labels)
+        if response.status != 200:
+            print(f"Failed to download image. HTTP status code: {response.status}")
+            response.raise_for_status()
+
+        try:
+            download_start = time.perf_counter()
+            write_seconds = 0.0
+            with open(temp_filename, 'wb') as f:
                 while True:
-                    chunk = await response.content.read(1024)
+                    chunk = await response.content.read(DOWNLOAD_CHUNK_SIZE)
                     if not chunk:
                         break
+                    stream_checksum.update(chunk)
+                    size += len(chunk)
+                    write_start = time.perf_counter()
                     f.write(chunk)
-            print(f"Image successfully downloaded to {output_filename}")
+                    write_seconds += time.perf_counter() - write_start
+            metrics.record("download", time.perf_counter() - download_start, size, **labels)
+            metrics.record("disk_write", write_seconds, size, **labels)
+
+            write_start = time.perf_counter()
+            # opening the file and hashing it again are blocking, so they run in a thread like split_days
+            size, checksum, band_count = await asyncio.get_running_loop().run_in_executor(
+                None, finish_download, temp_filename, output_filename, size, stream_checksum.hexdigest(), bands)
+            metrics.record("write", time.perf_counter() - write_start, **labels)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
+    return size, checksum, band_count
+
+def split_days(stack_filename, job, output_dir, bands=None):
+    """Split the download of a multi-day job into one GeoTIFF per day and remove it.
+
+    Every daily file is written to a temporary file and renamed once complete. If `bands` is given, the band
+    schema is written into every daily file.
+
+    Returns:
+        list: (date, filename, size in bytes, SHA-256 checksum, band count) of every written file.
+    """
+    bands_per_day = len(LAYER_BANDS[job.layer])
+    outputs = []
+    try:
+        with rasterio.open(stack_filename) as stack:
+            if stack.count != bands_per_day * job.num_days:
+                raise ValueError(f"Expected {bands_per_day * job.num_days} bands, but the download has "
+                                 f"{stack.count}")
+            profile = stack.profile
+            profile.update(count=bands_per_day)
+            for day, date_of_interest in enumerate(job_dates(job)):
+                output_filename = tile_filename(output_dir, date_of_interest, job.sub_region_number)
+                temp_filename = output_filename + ".part"
+                first_band = day * bands_per_day + 1
+                try:
+                    with rasterio.open(temp_filename, 'w', **profile) as daily_image:
+                        daily_image.write(stack.read(list(range(first_band, first_band + bands_per_day))))
+                        if bands is not None:
+                            write_band_metadata(daily_image, bands)
+                    os.replace(temp_filename, output_filename)
+                except BaseException:
+                    if os.path.exists(temp_filename):
+                        os.remove(temp_filename)
+                    raise
+                outputs.append((date_of_interest, output_filename, os.path.getsize(output_filename),
+                                file_checksum(output_filename), bands_per_day))
+    finally:
+        os.remove(stack_filename)
+    return outputs
+
+def resolve_download_url(job, quantize=False, metrics=None):
+    """Build the feature image of a job and request its GeoTIFF download URL.
+
+    With `quantize` the bands are converted to the integer types of the band schema in Earth Engine. Both steps
+    are blocking round-trips to Google Earth Engine, so this is run in a thread pool. They are recorded as the
+    `graph` and `url` stages in `metrics`.
+    """
+    metrics = metrics or RunMetrics()
+    with metrics.stage("graph", **job_labels(job)):
+        feature_image = prepare_image(job)
+        if quantize:
+            feature_image = quantize_image(feature_image, LAYER_BANDS[job.layer] * job.num_days)
+
+    with metrics.stage("url", **job_labels(job)):
+        return feature_image.getDownloadURL({
+            'scale': 375,
+            # 'crs': 'ESPG:32610',
+            'region': job.geometry,
+            'format': 'GeoTIFF',  # Specify GeoTIFF format
+            'maxPixels': 1e13  # Increase max pixels if needed
+        })
+
+async def fetch_geotiff(context, job):
+    """Fetch backend that requests a GeoTIFF download URL and downloads the file.
+
+    The download URL is resolved in the URL thread pool so that it does not block the event loop, and the
+    download runs on the event loop. The download of a multi-day job is split into one file per day.
+
+    Returns:
+        list: (manifest key, filename, size in bytes, SHA-256 checksum, band count) of every written file.
+    """
+    loop = asyncio.get_running_loop()
+    metrics = context.metrics or RunMetrics()
+    labels = job_labels(job)
+    # Dynamically generate the output filename based on the current date
+    output_filename = job_filename(context.output_dir, job)
+    bands = LAYER_BANDS[job.layer] if context.quantize else None
+
+    wait_start = time.perf_counter()
+    async with context.url_limiter:
+        metrics.record("url_wait", time.perf_counter() - wait_start, **labels)
+        download_url = await loop.run_in_executor(
+            context.url_executor, resolve_download_url, job, context.quantize, metrics
+        )
+
+    wait_start = time.perf_counter()
+    async with context.download_limiter:
+        metrics.record("download_wait", time.perf_counter() - wait_start, **labels)
+        if job.num_days > 1:
+            await download_image(context.session, download_url, output_filename, metrics=metrics, labels=labels)
         else:
-            print(f"Failed to download image. HTTP status code: {response.status}")
+            size, checksum, band_count = await download_image(context.session, download_url, output_filename,
+                                                               bands, metrics, labels)
 
-async def process_region_async(semaphore, sub_region_polygon, date_of_interest, session, output_dir, sub_region_number):
-    """Asynchronously process a single region on Google Earth Engine with semaphore-controlled concurrency."""
-    async with semaphore:
+    if job.num_days > 1:
+        with metrics.stage("write", **labels):
+            return await loop.run_in_executor(None, split_days, output_filename, job, context.output_dir, bands)
+    return [(manifest_key(job), output_filename, size, checksum, band_count)]
+
+def request_pixels(job, grid, quantize=False, metrics=None):
+    """Build the feature image of a job and compute its pixels on `grid` as an NPY payload.
+
+    Both steps are blocking round-trips to Google Earth Engine, so this is run in a thread pool. They are
+    recorded as the `graph` and `pixels` stages in `metrics`.
+    """
+    metrics = metrics or RunMetrics()
+    with metrics.stage("graph", **job_labels(job)):
+        feature_image = prepare_image(job)
+        if quantize:
+            feature_image = quantize_image(feature_image, LAYER_BANDS[job.layer] * job.num_days)
+    start = time.perf_counter()
+    payload = compute_pixels(feature_image, grid)
+    metrics.record("pixels", time.perf_counter() - start, len(payload), **job_labels(job))
+    return payload
+
+def write_pixels(payload, job, output_dir, grid, bands=None):
+    """Decode an NPY payload and write one GeoTIFF per day (or one for static layers) of the job.
+
+    Returns:
+        list: (manifest key, filename, size in bytes, SHA-256 checksum, band count) of every written file.
+    """
+    data = decode_pixels(payload)
+    bands_per_day = len(LAYER_BANDS[job.layer])
+    if data.shape[0] != bands_per_day * job.num_days:
+        raise ValueError(f"Expected {bands_per_day * job.num_days} bands, but the payload has {data.shape[0]}")
+
+    if job.num_days > 1:
+        files = [(date_of_interest, tile_filename(output_dir, date_of_interest, job.sub_region_number))
+                 for date_of_interest in job_dates(job)]
+    else:
+        files = [(manifest_key(job), job_filename(output_dir, job))]
+
+    outputs = []
+    for day, (key, filename) in enumerate(files):
+        write_geotiff(filename, data[day * bands_per_day:(day + 1) * bands_per_day], grid, bands)
+        outputs.append((key, filename, os.path.getsize(filename), file_checksum(filename), bands_per_day))
+    return outputs
+
+async def fetch_pixels(context, job):
+    """Fetch backend that computes the pixels on the grid of the sub-region with computePixels.
+
+    There is no download URL, download or GeoTIFF decoding: the NPY payload is decoded directly into an array
+    and written to the output files.
+
+    Returns:
+        list: (manifest key, filename, size in bytes, SHA-256 checksum, band count) of every written file.
+    """
+    loop = asyncio.get_running_loop()
+    metrics = context.metrics or RunMetrics()
+    labels = job_labels(job)
+    grid = context.grids[job.sub_region_number - 1]
+    bands = LAYER_BANDS[job.layer] if context.quantize else None
+
+    wait_start = time.perf_counter()
+    async with context.url_limiter:
+        metrics.record("url_wait", time.perf_counter() - wait_start, **labels)
+        payload = await loop.run_in_executor(context.url_executor, request_pixels, job, grid, context.quantize,
+                                             metrics)
+    with metrics.stage("write", **labels):
+        return await loop.run_in_executor(None, write_pixels, payload, job, context.output_dir, grid, bands)
+
+def convert_outputs_to_cog(outputs, bands, compress):
+    """Convert the written files of a job to COGs. Runs in a worker process.
+
+    Returns:
+        list: The outputs with the size and checksum of the converted files.
+    """
+    converted = []
+    for key, filename, _, _, band_count in outputs:
+        convert_to_cog(filename, bands, compress)
+        converted.append((key, filename, os.path.getsize(filename), file_checksum(filename), band_count))
+    return converted
+
+# fetch backends by name, each takes (context, job) and returns the written files
+FETCH_BACKENDS = {
+    GEOTIFF_BACKEND: fetch_geotiff,
+    PIXELS_BACKEND: fetch_pixels,
+}
+
+def record_done(manifest, job, outputs):
+    """Record the written files of a job in the manifest."""
+    for done_key, filename, size, checksum, band_count in outputs:
+        manifest.mark_done(done_key, job.sub_region_number, filename, size, checksum, band_count)
+
+def record_failed(manifest, job, error):
+    """Record every output of a job as failed in the manifest."""
+    for failed_key in manifest_keys(job):
+        manifest.mark_failed(failed_key, job.sub_region_number, error)
+
+async def process_region_async(context, job, manifest=None, max_retries=MAX_RETRIES, backend=GEOTIFF_BACKEND):
+    """Asynchronously process a single region on Google Earth Engine.
+
+    The job is fetched with one of the `FETCH_BACKENDS`. The Earth Engine requests and the downloads are limited
+    by their own `AdaptiveLimiter` in `context`. Retriable errors are retried up to `max_retries` times with
+    exponential backoff. The outcome is recorded in `manifest` if one is given. With `context.quantize` the
+    image is fetched as scaled integers and the band schema is written into the files. With `context.cog_executor`
+    the written files are converted to COGs in that process pool. The stages, retries and the outcome are recorded
+    in `context.metrics`. The manifest is written in `context.database_executor`, so waiting for its lock does not
+    block the event loop.
+
+    Returns:
+        Exception: The error of a job that failed permanently, None on success.
+    """
+    loop = asyncio.get_running_loop()
+    metrics = context.metrics or RunMetrics()
+    labels = job_labels(job)
+    fetch = FETCH_BACKENDS[backend]
+    key = manifest_key(job)
+    job_start = time.perf_counter()
+
+    for attempt in range(max_retries + 1):
         try:
-            feature_image = prepare_daily_image(sub_region_polygon, date_of_interest)
-
-            download_url = feature_image.getDownloadURL({
-                'scale': 375,
-                # 'crs': 'ESPG:32610',
-                'region': sub_region_polygon,
-                'format': 'GeoTIFF',  # Specify GeoTIFF format
-                'maxPixels': 1e13  # Increase max pixels if needed
-            })
-
-            # Dynamically generate the output filename based on the current date
-            output_filename = f"{output_dir}/{date_of_interest}_{sub_region_number}.tif"
-            
-            print(f"Downloading image {output_filename} from: {download_url}")
-            await download_image(session, download_url, output_filename)
+            outputs = await fetch(context, job)
+            if context.cog_executor is not None:
+                with metrics.stage("cog", **labels):
+                    outputs = await loop.run_in_executor(context.cog_executor, convert_outputs_to_cog, outputs,
+                                                         LAYER_BANDS[job.layer], context.cog_compression)
 
         except Exception as e:
-            print(f"Error processing region {sub_region_number} for date {date_of_interest}: {e}")
+            if attempt < max_retries and is_retriable_error(e):
+                delay = backoff_delay(attempt)
+                metrics.increment("retries", error=str(e), **labels)
+                print(f"Retrying region {job.sub_region_number} for {key} in {delay:.1f}s "
+                      f"(attempt {attempt + 1}/{max_retries}): {e}")
+                await asyncio.sleep(delay)
+                continue
+
+            print(f"Error processing region {job.sub_region_number} for {key}: {e}")
+            if manifest is not None:
+                await loop.run_in_executor(context.database_executor, record_failed, manifest, job, e)
+            metrics.record("job", time.perf_counter() - job_start, status="failed", attempts=attempt + 1, **labels)
+            metrics.increment("failed", error=str(e), **labels)
+            return e
+
+        if manifest is not None:
+            await loop.run_in_executor(context.database_executor, record_done, manifest, job, outputs)
+        metrics.record("job", time.perf_counter() - job_start, sum(output[2] for output in outputs), status="done",
+                       attempts=attempt + 1, **labels)
+        metrics.increment("done", **labels)
         return None
 
 
-async def process_day(region_geometries, date_of_interest, output_dir):
-    """Asynchronously process all regions for a single day."""
-    semaphore = asyncio.Semaphore(REQUEST_LIMIT)  # Limit concurrent requests to 30
-    async with aiohttp.ClientSession() as session:
+def iter_dates(year, start_month, end_month):
+    """Yield every day from the first day of `start_month` to the last day of `end_month` as YYYY-MM-DD."""
+    current_date = datetime(year, start_month, 1)
+    end_date = (datetime(year, end_month, 1) + timedelta(days=32)).replace(day=1)
+    while current_date < end_date:
+        yield current_date.strftime('%Y-%m-%d')
+        current_date += timedelta(days=1)
 
-        print(f"Processing data for all regions for {date_of_interest}.")
+def iter_jobs(region_geometries, dates, layer=DAILY, selection=None, days_per_request=1):
+    """Yield a job for every sub-region on every date, or only for the sub-regions selected on each date.
 
-        # Create tasks for all sub-regions
-        tasks = [
-            process_region_async(semaphore, geometry, date_of_interest, session, output_dir, sub_region_number)
-            for sub_region_number, geometry in enumerate(region_geometries, start=1)
-        ]
+    With `days_per_request` > 1 the consecutive `dates` are grouped into windows of that many days, and each
+    job covers one sub-region on a run of consecutive selected days within a window.
+    """
+    for window_start in range(0, len(dates), days_per_request):
+        window = dates[window_start:window_start + days_per_request]
+        for sub_region_number, geometry in enumerate(region_geometries, start=1):
+            run = []
+            for date_of_interest in window + [None]:
+                if date_of_interest is not None and (
+                        selection is None or sub_region_number in selection[date_of_interest]):
+                    run.append(date_of_interest)
+                elif run:
+                    yield Job(run[0], sub_region_number, geometry, layer, len(run))
+                    run = []
+
+def iter_static_jobs(region_geometries, years):
+    """Yield a static layer job for every sub-region and a land cover job for every sub-region and year."""
+    for sub_region_number, geometry in enumerate(region_geometries, start=1):
+        yield Job(None, sub_region_number, geometry, STATIC)
+    for year in years:
+        for sub_region_number, geometry in enumerate(region_geometries, start=1):
+            yield Job(str(year), sub_region_number, geometry, LANDCOVER)
+
+def query_fire_activity_with_retries(date_of_interest, region_geometries, min_confidence, max_retries):
+    """Run the fire activity query of one day, retrying transient errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return query_fire_activity(get_satellite_client(), date_of_interest, region_geometries, min_confidence)
+        except Exception as e:
+            if attempt < max_retries and is_retriable_error(e):
+                time.sleep(backoff_delay(attempt))
+                continue
+            raise
 
-        await asyncio.gather(*tasks, return_exceptions=True)
+def load_fire_activity(dates, region_geometries, manifest, min_confidence=0, grid="", workers=URL_REQUEST_LIMIT,
+                       max_retries=MAX_RETRIES):
+    """Return the active fire pixels of every sub-region on every date as {date: {sub-region number: count}}.
+
+    Dates that are already recorded in the manifest for the same `min_confidence` and `grid` (the checksum of the
+    sub-region GeoJSON) are not queried again. The remaining days are queried concurrently in a thread pool.
+    """
+    activity = {date_of_interest: manifest.get_activity(date_of_interest, min_confidence, grid)
+                for date_of_interest in dates}
+    missing = [date_of_interest for date_of_interest, counts in activity.items() if counts is None]
+    print(f"Querying fire activity for {len(missing)} days")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda date_of_interest: query_fire_activity_with_retries(
+                date_of_interest, region_geometries, min_confidence, max_retries),
+            missing)
+        for date_of_interest, counts in zip(missing, results):
+            manifest.record_activity(date_of_interest, counts, min_confidence, grid)
+            activity[date_of_interest] = counts
+    return activity
+
+async def region_worker(queue, failures, context, manifest, max_retries, backend, work_queue=None, worker_id=None,
+                        slots=None):
+    """Take jobs from the queue and process them until cancelled, collecting permanently failed jobs.
+
+    Jobs leased from a shared `work_queue` are marked done or failed there as well, in the database executor of
+    `context`, and their slot in `slots` (see `lease_jobs`) is released.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await queue.get()
+        try:
+            error = await process_region_async(context, job, manifest, max_retries, backend)
+            if error is not None:
+                failures.append((job, error))
+            if work_queue is not None:
+                key, _ = job_task(job)
+                if error is None:
+                    await loop.run_in_executor(context.database_executor, work_queue.complete, key, worker_id)
+                else:
+                    await loop.run_in_executor(context.database_executor, work_queue.fail, key, worker_id, error)
+        finally:
+            if slots is not None:
+                slots.release()
+            queue.task_done()
+
+async def lease_jobs(work_queue, worker_id, region_geometries, slots, database_executor, lease_seconds=LEASE_SECONDS,
+                     batch_size=LEASE_BATCH_SIZE, poll_interval=QUEUE_POLL_INTERVAL):
+    """Yield the jobs leased from the shared work queue until no job is pending or leased by any worker.
+
+    `slots` is a semaphore with one slot per fetch worker of this process. A job holds a slot from its lease until
+    the caller has finished it (see `region_worker`), so only the idle workers lease jobs, up to `batch_size` at
+    a time, and the jobs that are not started yet stay available to the other processes. While the remaining
+    jobs are leased by other workers, the queue is polled: if one of them crashes, its leases expire and its jobs
+    are leased here. The queue is accessed in `database_executor`, a single thread that owns the SQLite
+    connections of the process, so that waiting for the lock of the queue does not block the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await slots.acquire()
+        count = 1
+        while count < batch_size and not slots.locked():
+            await slots.acquire()
+            count += 1
+        tasks = await loop.run_in_executor(database_executor, work_queue.lease, worker_id, count, lease_seconds)
+        for _ in range(count - len(tasks)):
+            slots.release()
+        for _, payload in tasks:
+            yield task_job(payload, region_geometries)
+        if not tasks:
+            remaining = await loop.run_in_executor(database_executor,
+                                                   functools.partial(work_queue.remaining, exclude_worker=worker_id))
+            if remaining == 0:
+                return
+            await asyncio.sleep(min(poll_interval, lease_seconds / 4))
+
+async def renew_leases(work_queue, worker_id, database_executor, lease_seconds=LEASE_SECONDS):
+    """Renew the leases of this worker three times per lease period until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        await loop.run_in_executor(database_executor, work_queue.renew, worker_id, lease_seconds)
+
+async def report_progress(metrics, queue, url_limiter, download_limiter, interval=PROGRESS_INTERVAL):
+    """Print the progress of the run every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        metrics.set_gauge("queue", queue.qsize())
+        metrics.set_gauge("url limit", round(url_limiter.limit, 1))
+        metrics.set_gauge("urls in flight", url_limiter.in_flight)
+        metrics.set_gauge("download limit", round(download_limiter.limit, 1))
+        metrics.set_gauge("downloads in flight", download_limiter.in_flight)
+        print(f"[progress] {metrics.progress()}", flush=True)
+        metrics.flush()
+
+async def process_jobs(jobs, output_dir, url_workers=URL_REQUEST_LIMIT, download_workers=DOWNLOAD_LIMIT,
+                       manifest=None, max_retries=MAX_RETRIES, quantize=False, backend=GEOTIFF_BACKEND, grids=None,
+                       cog_compression=None, cog_workers=None, metrics=None, progress_interval=PROGRESS_INTERVAL,
+                       work_queue=None, worker_id=None, lease_seconds=LEASE_SECONDS, slots=None,
+                       database_executor=None):
+    """Asynchronously process all jobs with one HTTP session and a fixed pool of workers.
+
+    There is no barrier between days: a worker picks up the next job, whatever its date, as soon as it is free.
+    The queue is bounded, so `jobs` can be a lazy (or asynchronous) iterator over a long time range. Jobs leased
+    from a shared `work_queue` (see `lease_jobs`) are marked done or failed there and release their slot in
+    `slots`, and the leases of `worker_id` are renewed while the jobs are processed. `url_workers` and
+    `download_workers` are the upper limits of the adaptive concurrency of the two stages. The pixels backend
+    needs the pixel grid of every sub-region in `grids`. With `cog_compression` the tiles are converted to COGs
+    with that compression in a pool of `cog_workers` processes. The stages of every job are recorded in
+    `metrics`, the progress is printed every `progress_interval` seconds and a summary at the end. The manifest
+    and the work queue are only accessed in `database_executor`, a single-thread executor (one is created if
+    None), so their blocking SQLite calls do not stall the event loop.
+
+    Returns:
+        list: (job, error) for every job that failed permanently.
+    """
+    metrics = metrics or RunMetrics()
+    num_workers = url_workers + download_workers
+    queue = asyncio.Queue(maxsize=2 * num_workers)
+    failures = []
+    url_limiter = AdaptiveLimiter(url_workers)
+    download_limiter = AdaptiveLimiter(download_workers)
+
+    cog_executor = ProcessPoolExecutor(max_workers=cog_workers) if cog_compression else None
+    own_database_executor = database_executor is None
+    if own_database_executor:
+        database_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+    try:
+        with ThreadPoolExecutor(max_workers=url_workers) as url_executor:
+            connector = aiohttp.TCPConnector(limit=download_workers)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                context = FetchContext(url_executor, url_limiter, download_limiter, session, output_dir, quantize,
+                                       grids, cog_executor, cog_compression, metrics, database_executor)
+                workers = [
+                    asyncio.create_task(region_worker(queue, failures, context, manifest, max_retries, backend,
+                                                      work_queue, worker_id, slots))
+                    for _ in range(num_workers)
+                ]
+                workers.append(asyncio.create_task(
+                    report_progress(metrics, queue, url_limiter, download_limiter, progress_interval)))
+                if work_queue is not None:
+                    workers.append(asyncio.create_task(
+                        renew_leases(work_queue, worker_id, database_executor, lease_seconds)))
+
+                try:
+                    if hasattr(jobs, "__aiter__"):
+                        async for job in jobs:
+                            await queue.put(job)
+                    else:
+                        for job in jobs:
+                            await queue.put(job)
+                    await queue.join()
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        # the COG processes and the database thread are stopped whether or not the run failed
+        if cog_executor is not None:
+            cog_executor.shutdown()
+        if own_database_executor:
+            database_executor.shutdown()
+
+    print(f"Final concurrency: {url_limiter.limit:.1f} URL requests ({url_limiter.throttled} throttled), "
+          f"{download_limiter.limit:.1f} downloads ({download_limiter.throttled} throttled)")
+    metrics.print_summary()
+    metrics.flush()
+    return failures
+
+def load_account(credentials_file, worker_index):
+    """Service account of a worker from a JSON list of accounts, assigned round-robin by the worker index."""
+    with open(credentials_file, 'r') as f:
+        accounts = json.load(f)
+    return accounts[worker_index % len(accounts)]
+
+def without_option(argv, option):
+    """Command line arguments without an option and its value."""
+    arguments = []
+    skip_value = False
+    for argument in argv:
+        if skip_value:
+            skip_value = False
+        elif argument == option:
+            skip_value = True
+        elif not argument.startswith(option + "="):
+            arguments.append(argument)
+    return arguments
+
+def launch_workers(num_workers, argv):
+    """Run `num_workers` worker processes with the command line arguments of this run and wait for them.
+
+    Every worker leases jobs from the shared work queue and gets its index, which selects its service account.
+
+    Returns:
+        list: Exit code of every worker.
+    """
+    argv = without_option(argv, "--workers")
+    processes = [subprocess.Popen(WORKER_COMMAND + argv + ["--worker_index", str(index)])
+                 for index in range(num_workers)]
+    return [process.wait() for process in processes]
+
+def print_failure_summary(failures):
+    """Print the jobs that failed permanently."""
+    if not failures:
+        print("All jobs completed successfully.")
+        return
+    print(f"{len(failures)} jobs failed permanently:")
+    failures = sorted(failures, key=lambda failure: (manifest_key(failure[0]), failure[0].sub_region_number))
+    for job, error in failures:
+        print(f"  {manifest_key(job)} region {job.sub_region_number}: {error}")
 
 
 
@@ -109,7 +821,55 @@ def main():
     parser.add_argument("--output_dir", default="data", help="output directory for storing the downloaded images")
     parser.add_argument("--end_month", type=int, default=12, help="Ending month (inclusive), default is December")
     parser.add_argument("--start_month", type=int, default=1, help="Starting month (inclusive), default is January")
+    parser.add_argument("--url_workers", type=int, default=URL_REQUEST_LIMIT,
+                        help="Maximum number of concurrent Earth Engine download URL requests")
+    parser.add_argument("--download_workers", type=int, default=DOWNLOAD_LIMIT,
+                        help="Maximum number of concurrent image downloads")
+    parser.add_argument("--max_retries", type=int, default=MAX_RETRIES,
+                        help="Number of retries for jobs that fail with a transient error")
+    parser.add_argument("--resume", action="store_true",
+                        help="Only process jobs that are not recorded as complete in the manifest")
+    parser.add_argument("--keep_float", action="store_true",
+                        help="Download the bands in the data type chosen by Earth Engine instead of the compact "
+                             "integer types of the band schema")
+    parser.add_argument("--inline_static", action="store_true",
+                        help="Include the static and land cover bands in every daily image instead of "
+                             "downloading them once per sub-region")
+    parser.add_argument("--backend", choices=sorted(FETCH_BACKENDS), default=GEOTIFF_BACKEND,
+                        help="Fetch GeoTIFF downloads, or compute the pixels directly as NumPy arrays")
+    parser.add_argument("--cog", action="store_true",
+                        help="Rewrite every tile as a Cloud-Optimized GeoTIFF with overviews")
+    parser.add_argument("--cog_compression", choices=COMPRESSIONS, default="ZSTD",
+                        help="Compression of the Cloud-Optimized GeoTIFFs")
+    parser.add_argument("--days_per_request", type=int, default=1,
+                        help="Number of consecutive days of a sub-region fetched in one request")
+    parser.add_argument("--sparse", action="store_true",
+                        help="Only download the tiles with active fires (and their spatial and temporal buffer)")
+    parser.add_argument("--min_fire_confidence", type=int, default=0,
+                        help="Minimum FIRMS confidence (0-100) of a fire detection in sparse mode")
+    parser.add_argument("--spatial_buffer", type=int, default=0,
+                        help="In sparse mode, also download the tiles within this many tiles of an active tile")
+    parser.add_argument("--temporal_buffer", type=int, default=0,
+                        help="In sparse mode, also download this many days before a day with fire activity")
+    parser.add_argument("--progress_interval", type=float, default=PROGRESS_INTERVAL,
+                        help="Seconds between two progress lines")
+    parser.add_argument("--queue",
+                        help="Shared work queue of a sharded run (SQLite path or scheme://location), default "
+                             f"{QUEUE_FILE} in the output directory if --workers is given")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes that lease jobs from the shared work queue")
+    parser.add_argument("--credentials",
+                        help="JSON list of service accounts (service_account, key_file and optionally "
+                             "url_workers and download_workers), assigned to the workers round-robin")
+    parser.add_argument("--lease_seconds", type=float, default=LEASE_SECONDS,
+                        help="Seconds after which the jobs of a worker that stopped renewing are leased again")
+    parser.add_argument("--max_lease_attempts", type=int, default=MAX_ATTEMPTS,
+                        help="Number of times a job is leased before it is given up")
+    parser.add_argument("--worker_index", type=int, help=argparse.SUPPRESS)
     args = parser.parse_args()
+    if not 1 <= args.start_month <= args.end_month <= 12:
+        parser.error(f"--start_month {args.start_month} and --end_month {args.end_month} must be months from 1 to 12 "
+                     "with the start not after the end")
 
     # Initialize the time range
     year = args.year
@@ -118,10 +878,16 @@ def main():
 
     output_dir = args.output_dir
 
-    # Load Google Earth Engine credentials
+    # Load Google Earth Engine credentials, and the rate limits of the service account of a sharded worker
     load_dotenv()
     key_file = os.getenv("GEE_KEY_FILEPATH")
     service_account = os.getenv("GEE_SERVICE_ACCOUNT")
+    url_workers, download_workers = args.url_workers, args.download_workers
+    if args.credentials:
+        account = load_account(args.credentials, args.worker_index or 0)
+        service_account, key_file = account["service_account"], account["key_file"]
+        url_workers = account.get("url_workers", url_workers)
+        download_workers = account.get("download_workers", download_workers)
 
     # Initialize Earth Engine
     credentials = ee.ServiceAccountCredentials(service_account, key_file)
@@ -132,31 +898,112 @@ def main():
         sub_regions = json.load(f)
 
     region_geometries = []
+    region_grids = []
     # Iterate through the polygons and create ee.Geometry.Polygon objects
     for i, sub_region in enumerate(sub_regions['features']):  
         try:
             coordinates = sub_region['geometry']['coordinates']
             region_geometries.append(ee.Geometry.Polygon(coordinates))
+            region_grids.append(pixel_grid(coordinates))
         except KeyError as e:
             print(f"Skipping sub-region {i} due to missing key: {e}")
         except ee.EEException as e:
             print(f"Skipping invalid geometry for sub-region {i}: {e}")
 
-    # Process each day in the time range
-    for month in range(start_month, end_month + 1):
-        month_start = datetime(year, month, 1)
-        next_month = (month_start + timedelta(days=32)).replace(day=1)
-        month_end = next_month - timedelta(days=1)
-
-        print(f"Processing data for {year}-{month:02d}")
-
-        current_date = month_start
-        while current_date <= month_end:
-            date_of_interest = current_date.strftime('%Y-%m-%d')
-            print(f"Processing data for {date_of_interest}")
-            asyncio.run(process_day(region_geometries, date_of_interest, output_dir))
-            current_date += timedelta(days=1)
-
+    os.makedirs(os.path.join(output_dir, STATIC_DIR), exist_ok=True)
+    manifest = JobManifest(os.path.join(output_dir, MANIFEST_FILE))
+    sharded = args.queue is not None or args.workers > 1 or args.worker_index is not None
+    work_queue = open_work_queue(args.queue or os.path.join(output_dir, QUEUE_FILE), args.max_lease_attempts) \
+        if sharded else None
+
+    # Schedule every (date, sub-region) job in the time range, unless this is a worker of a sharded run whose
+    # jobs were enqueued by its launcher
+    if args.worker_index is None:
+        dates = list(iter_dates(year, start_month, end_month))
+        print(f"Processing {len(region_geometries)} sub-regions for {len(dates)} days "
+              f"from {dates[0]} to {dates[-1]}")
+        selection = None
+        selected_regions = set(range(1, len(region_geometries) + 1))
+        if args.sparse:
+            # the cached counts are only valid for the sub-regions they were counted for
+            grid = file_checksum(GEOJSON_FILE)
+            activity = load_fire_activity(dates, region_geometries, manifest, args.min_fire_confidence, grid,
+                                          url_workers, args.max_retries)
+            selection = select_tiles(activity, dates, TileIndex.from_geojson(GEOJSON_FILE), args.spatial_buffer,
+                                     args.temporal_buffer)
+            parameters = {
+                "year": year, "start_month": start_month, "end_month": end_month,
+                "min_fire_confidence": args.min_fire_confidence, "grid": grid,
+                "spatial_buffer": args.spatial_buffer, "temporal_buffer": args.temporal_buffer,
+            }
+            write_selection(os.path.join(output_dir, SELECTION_FILE), parameters, activity, selection)
+            selected_regions = set(itertools.chain.from_iterable(selection.values()))
+            print(f"Selected {sum(len(regions) for regions in selection.values())} of "
+                  f"{len(dates) * len(region_geometries)} tiles with fire activity")
+
+        layer = FULL if args.inline_static else DAILY
+        static_jobs = []
+        if not args.inline_static:
+            # the static layers are shared between runs, so they are only downloaded if they are missing
+            static_jobs = [job for job in iter_static_jobs(region_geometries, [year])
+                           if job.sub_region_number in selected_regions
+                           and not is_job_complete(manifest, job)]
+            print(f"Downloading {len(static_jobs)} missing static and land cover layers")
+
+        def schedule_jobs():
+            jobs = iter_jobs(region_geometries, dates, layer, selection, args.days_per_request)
+            if args.resume or sharded:
+                jobs = (job for job in jobs if not is_job_complete(manifest, job))
+            return itertools.chain(static_jobs, jobs)
+
+        if sharded:
+            # jobs that are already in the queue are kept, so every machine of a run can enqueue the same range
+            enqueued = work_queue.enqueue(job_task(job) for job in schedule_jobs())
+            print(f"Enqueued {enqueued} jobs in {work_queue.path}: {work_queue.counts()}")
+
+    if args.workers > 1 and args.worker_index is None:
+        exit_codes = launch_workers(args.workers, sys.argv[1:])
+        print(f"Workers exited with {exit_codes}")
+        print(f"Job states in {work_queue.path}: {work_queue.counts()}")
+        work_queue.close()
+        manifest.close()
+        return
+
+    if sharded:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        print(f"Worker {worker_id} leasing jobs from {work_queue.path}")
+        # one slot per fetch worker, so that jobs are only leased when a worker is idle
+        slots = asyncio.Semaphore(url_workers + download_workers)
+        # the queue and the manifest are accessed in one thread, off the event loop
+        database_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        jobs = lease_jobs(work_queue, worker_id, region_geometries, slots, database_executor, args.lease_seconds)
+        # the total is shared by all workers, so there is no ETA
+        metrics = RunMetrics(os.path.join(output_dir, f"events_{worker_id}.jsonl"))
+    else:
+        worker_id, slots, database_executor = None, None, None
+        # the jobs are generated once and counted for the ETA; a job is a few references, so the list stays small
+        jobs = list(schedule_jobs())
+        metrics = RunMetrics(os.path.join(output_dir, EVENT_LOG_FILE), total_jobs=len(jobs))
+    failures = asyncio.run(process_jobs(jobs, output_dir, url_workers=url_workers,
+                                        download_workers=download_workers, manifest=manifest,
+                                        max_retries=args.max_retries, quantize=not args.keep_float,
+                                        backend=args.backend, grids=region_grids,
+                                        cog_compression=args.cog_compression if args.cog else None,
+                                        metrics=metrics, progress_interval=args.progress_interval,
+                                        work_queue=work_queue, worker_id=worker_id,
+                                        lease_seconds=args.lease_seconds, slots=slots,
+                                        database_executor=database_executor))
+    if database_executor is not None:
+        database_executor.shutdown()
+    metrics.close()
+
+    print_failure_summary(failures)
+
+    print(f"Job states in {manifest.path}: {manifest.counts()}")
+    if work_queue is not None:
+        print(f"Job states in {work_queue.path}: {work_queue.counts()}")
+        work_queue.close()
+    manifest.close()
 
 if __name__ == '__main__':
     main()
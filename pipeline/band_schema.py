@@ -0,0 +1,108 @@
+'''
+Storage schema of the FirePred bands.
+
+Every band is stored as a scaled integer: `stored = round((value - offset) / scale)` and `value = stored * scale +
+offset`. Earth Engine exports all bands of a GeoTIFF with one common data type, so the schema keeps every band
+within int16 (land cover fits into uint8, which int16 contains) instead of the float64 that the mixed float and
+integer sources are otherwise promoted to.
+
+The quantization runs server-side in Earth Engine before the download URL is requested. Masked pixels are
+unmasked to the fill value of the exported type (its smallest value, which valid pixels never take), so they stay
+missing in the GeoTIFF and NPY outputs. The band names, scales, offsets and that nodata value are written into the
+GeoTIFF so that readers (see `decode` and pipeline/layers.py) can restore the physical values.
+'''
+
+from collections import namedtuple
+
+import ee
+import numpy as np
+
+BandSpec = namedtuple("BandSpec", ["dtype", "scale", "offset"])
+
+BAND_SCHEMA = {
+    # VIIRS surface reflectance and vegetation indices are integer digital numbers in the source products
+    "VIIRS band M11": BandSpec("int16", 1, 0),
+    "VIIRS band I2": BandSpec("int16", 1, 0),
+    "VIIRS band I1": BandSpec("int16", 1, 0),
+    "NDVI": BandSpec("int16", 1, 0),
+    "EVI2": BandSpec("int16", 1, 0),
+    # GRIDMET: mm, m/s, degrees, K, index, kg/kg
+    "Total precipitation": BandSpec("int16", 0.1, 0),
+    "Wind speed": BandSpec("int16", 0.01, 0),
+    "Wind direction": BandSpec("int16", 0.1, 0),
+    "Minimum temperature": BandSpec("int16", 0.01, 273.15),
+    "Maximum temperature": BandSpec("int16", 0.01, 273.15),
+    "Energy release component": BandSpec("int16", 0.1, 0),
+    "Specific humidity": BandSpec("int16", 0.00001, 0),
+    # terrain: degrees and m
+    "Slope": BandSpec("int16", 0.01, 0),
+    "Aspect": BandSpec("int16", 0.1, 0),
+    "Elevation": BandSpec("int16", 1, 0),
+    "Palmer drought severity index": BandSpec("int16", 0.01, 0),
+    "Landcover class": BandSpec("uint8", 1, 0),
+    # GFS forecasts: kg/m^2, m/s, degrees, degrees Celsius, kg/kg
+    "Forecast total precipitation": BandSpec("int16", 0.1, 0),
+    "Forecast wind speed": BandSpec("int16", 0.01, 0),
+    "Forecast wind direction": BandSpec("int16", 0.01, 0),
+    "Forecast temperature": BandSpec("int16", 0.01, 0),
+    "Forecast specific humidity": BandSpec("int16", 0.00001, 0),
+}
+
+# Earth Engine cast for every storage type (the ee.Image methods only exist after ee.Initialize)
+EE_CASTS = {
+    "int16": "toInt16",
+    "uint8": "toUint8",
+}
+
+
+def storage_dtype(bands):
+    """Data type of an export of the bands: the smallest type that holds the storage types of all of them."""
+    return np.result_type(*{BAND_SCHEMA[band].dtype for band in bands}).name
+
+
+def quantize_image(image, bands):
+    """Convert the bands of an Earth Engine image to their storage type.
+
+    Args:
+        image (ee.Image): Image with the bands in the order of `bands`.
+        bands (list): FirePred band names of the image.
+
+    Returns:
+        ee.Image: Image with every band scaled, rounded and cast to the `storage_dtype` of the bands, with masked
+        pixels set to its fill value.
+    """
+    dtype = storage_dtype(bands)
+    info = np.iinfo(dtype)
+    missing = fill_value(dtype)
+    quantized = []
+    for index, band in enumerate(bands):
+        spec = BAND_SCHEMA[band]
+        encoded = image.select(index).subtract(spec.offset).divide(spec.scale).round()
+        # keep the fill value for the masked pixels
+        encoded = encoded.clamp(missing + 1, info.max).unmask(missing)
+        quantized.append(getattr(encoded, EE_CASTS[dtype])())
+    return ee.Image(quantized)
+
+
+def write_band_metadata(dataset, bands):
+    """Write the band names, scales, offsets and nodata value into a dataset opened in w or r+ mode."""
+    for index, band in enumerate(bands, start=1):
+        dataset.set_band_description(index, band)
+    dataset.scales = [BAND_SCHEMA[band].scale for band in bands]
+    dataset.offsets = [BAND_SCHEMA[band].offset for band in bands]
+    dataset.nodata = fill_value(dataset.dtypes[0])
+
+
+def fill_value(dtype):
+    """Value of missing pixels and padding: NaN for floats, the smallest value for integers."""
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return np.nan
+    return np.iinfo(dtype).min
+
+
+def decode(data, scales, offsets):
+    """Restore the physical values of an array of shape (bands, height, width) as float32."""
+    scales = np.asarray(scales, dtype="float32")[:, None, None]
+    offsets = np.asarray(offsets, dtype="float32")[:, None, None]
+    return data.astype("float32") * scales + offsets
@@ -0,0 +1,75 @@
+'''
+Cloud-Optimized GeoTIFF conversion of the downloaded tiles.
+
+Earth Engine returns stripped, uncompressed GeoTIFFs without overviews, so every read of a patch or a thumbnail
+decodes the whole file. `convert_to_cog` rewrites a tile with internal 256x256 tiles, DEFLATE or ZSTD
+compression with a predictor, the FirePred band names as band descriptions and overviews. Overviews are
+resampled with nearest neighbour, so land cover classes and fire pixels stay valid.
+
+With GDAL >= 3.1 the COG driver is used; older versions write a tiled GeoTIFF with internal overviews, which
+rasterio and GDAL read the same way.
+'''
+
+import os
+
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.env import GDALVersion
+
+COMPRESSIONS = ("ZSTD", "DEFLATE")
+BLOCK_SIZE = 256
+# smallest overview size in pixels
+MIN_OVERVIEW_SIZE = BLOCK_SIZE // 4
+
+
+def overview_factors(width, height, min_size=MIN_OVERVIEW_SIZE):
+    """Decimation factors 2, 4, 8, ... until the overview is smaller than `min_size` pixels."""
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= min_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def _set_band_descriptions(filename, bands):
+    with rasterio.open(filename, 'r+') as dataset:
+        if dataset.count != len(bands):
+            raise ValueError(f"Expected {len(bands)} bands in {filename}, but found {dataset.count}")
+        if list(dataset.descriptions) != list(bands):
+            for index, band in enumerate(bands, start=1):
+                dataset.set_band_description(index, band)
+
+
+def convert_to_cog(filename, bands=None, compress="ZSTD"):
+    """Rewrite a GeoTIFF in place as a Cloud-Optimized GeoTIFF.
+
+    Args:
+        filename (str): GeoTIFF to convert, replaced atomically once the conversion is complete.
+        bands (list): Band names written as band descriptions, if given.
+        compress (str): One of `COMPRESSIONS`.
+    """
+    if compress not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression {compress}, expected one of {COMPRESSIONS}")
+    if bands is not None:
+        _set_band_descriptions(filename, bands)
+
+    temp_filename = filename + ".cog.part"
+    try:
+        if GDALVersion.runtime().at_least("3.1"):
+            rasterio.shutil.copy(filename, temp_filename, driver="COG", compress=compress, predictor="YES",
+                                 blocksize=BLOCK_SIZE, overview_resampling="NEAREST", bigtiff="IF_SAFER")
+        else:
+            with rasterio.open(filename, 'r+') as dataset:
+                dataset.build_overviews(overview_factors(dataset.width, dataset.height), Resampling.nearest)
+                predictor = 3 if dataset.dtypes[0].startswith("float") else 2
+            with rasterio.Env(GDAL_TIFF_OVR_BLOCKSIZE=BLOCK_SIZE):
+                rasterio.shutil.copy(filename, temp_filename, driver="GTiff", tiled=True, blockxsize=BLOCK_SIZE,
+                                     blockysize=BLOCK_SIZE, compress=compress, predictor=predictor,
+                                     copy_src_overviews=True, bigtiff="IF_SAFER")
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
@@ -0,0 +1,331 @@
+'''
+Spatiotemporal cube of the extracted tiles.
+
+Consolidates the per-tile daily GeoTIFFs `<date>_<region>.tif` of an output directory into one chunked,
+compressed Zarr store, so that a time window of a sub-region is read from a few chunks instead of dozens of files:
+
+    daily      (region, time, band, y, x)  daily bands, one time step per day from the `start_date` attribute
+    ingested   (region, time)              whether the tile of a day has been ingested
+    static     (region, band, y, x)        slope, aspect and elevation (see pipeline/layers.py)
+    landcover  (region, year, y, x)        land cover, one year per step from the `first_year` attribute
+
+Sub-region n is stored at region index n - 1. Tiles are written to the upper left corner of the y/x extent and
+the remainder is filled with the fill value. Chunks span one region, `time_chunk` days, all bands and
+`spatial_chunk` pixels, and are compressed with Blosc/zstd.
+
+Ingestion is incremental: the time and region axes grow when new days or sub-regions appear, and tiles that are
+already ingested are skipped. Every chunk along the time axis of a region is written by exactly one worker
+process, so the workers never write to the same chunk.
+'''
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import rasterio
+import zarr
+from numcodecs import Blosc
+
+from pipeline.band_schema import decode, fill_value
+from pipeline.layers import find_static_layers, find_tiles
+
+DAILY_ARRAY = "daily"
+INGESTED_ARRAY = "ingested"
+STATIC_ARRAY = "static"
+LANDCOVER_ARRAY = "landcover"
+
+# days per chunk along the time axis, sized for reading time windows of one sub-region
+TIME_CHUNK = 16
+# pixels per chunk along y and x
+SPATIAL_CHUNK = 128
+COMPRESSOR = Blosc(cname="zstd", clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+def _create_array(group, name, shape, chunks, dtype):
+    return group.create_dataset(name, shape=shape, chunks=chunks, dtype=dtype, compressor=COMPRESSOR,
+                                fill_value=fill_value(dtype))
+
+
+def _grow(array, axis, size):
+    """Grow the given axis of a Zarr array to at least `size`."""
+    if array.shape[axis] < size:
+        shape = list(array.shape)
+        shape[axis] = size
+        array.resize(*shape)
+
+
+def _describe(filename):
+    with rasterio.open(filename) as dataset:
+        return {
+            "count": dataset.count, "dtype": dataset.dtypes[0], "height": dataset.height, "width": dataset.width,
+            "transform": list(dataset.transform)[:6], "crs": str(dataset.crs),
+            "bands": list(dataset.descriptions), "scales": list(dataset.scales), "offsets": list(dataset.offsets),
+        }
+
+
+def _read_tile(filename, count, dtype, height, width):
+    with rasterio.open(filename) as dataset:
+        if dataset.count != count or dataset.dtypes[0] != dtype:
+            raise ValueError(f"{filename} has {dataset.count} bands of {dataset.dtypes[0]}, "
+                             f"but the cube stores {count} bands of {dtype}")
+        if dataset.height > height or dataset.width > width:
+            raise ValueError(f"{filename} is larger than the {height}x{width} pixels of the cube")
+        return dataset.read()
+
+
+def _write_time_chunk(path, region_index, first_day, tiles):
+    """Write the tiles of one sub-region within one time chunk. Runs in a worker process.
+
+    Args:
+        tiles (list): (time index, filename) of the tiles, all within the chunk starting at `first_day`.
+    """
+    group = zarr.open_group(path, mode="r+")
+    daily, ingested = group[DAILY_ARRAY], group[INGESTED_ARRAY]
+    _, _, count, height, width = daily.shape
+    last_day = max(time_index for time_index, _ in tiles) + 1
+
+    # read the chunk first, so that days ingested by an earlier run are kept
+    block = daily[region_index, first_day:last_day]
+    for time_index, filename in tiles:
+        data = _read_tile(filename, count, str(daily.dtype), height, width)
+        block[time_index - first_day] = fill_value(daily.dtype)
+        block[time_index - first_day, :, :data.shape[1], :data.shape[2]] = data
+    daily[region_index, first_day:last_day] = block
+
+    ingested_block = ingested[region_index, first_day:last_day]
+    for time_index, _ in tiles:
+        ingested_block[time_index - first_day] = True
+    ingested[region_index, first_day:last_day] = ingested_block
+    return len(tiles)
+
+
+def _pad(data, shape, dtype):
+    """Place `data` in the upper left corner of an array of `shape` filled with the fill value."""
+    tile = np.full(shape, fill_value(dtype), dtype=dtype)
+    tile[..., :data.shape[-2], :data.shape[-1]] = data
+    return tile
+
+
+def _initialize(group, tiles, region_tiles, time_chunk, spatial_chunk):
+    """Create the daily arrays with the bands and data type of the first tile, large enough for the tiles of
+    every sub-region in `region_tiles` ({region: filename})."""
+    first_date, _ = min(tiles)
+    description = _describe(tiles[min(tiles)])
+    descriptions = [_describe(filename) for filename in region_tiles.values()]
+    height = max(region_description["height"] for region_description in descriptions)
+    width = max(region_description["width"] for region_description in descriptions)
+    shape = (0, 0, description["count"], height, width)
+    chunks = (1, time_chunk, description["count"], spatial_chunk, spatial_chunk)
+    _create_array(group, DAILY_ARRAY, shape, chunks, description["dtype"])
+    group.create_dataset(INGESTED_ARRAY, shape=(0, 0), chunks=(1, time_chunk), dtype=bool, fill_value=False)
+    group.attrs.update({
+        "start_date": first_date, "crs": description["crs"], "bands": description["bands"],
+        "scales": description["scales"], "offsets": description["offsets"], "transforms": {}, "tile_shapes": {},
+    })
+
+
+def _register_regions(group, filenames):
+    """Record the transform and tile shape of sub-regions seen for the first time, given as {region: filename}."""
+    transforms, tile_shapes = group.attrs["transforms"], group.attrs["tile_shapes"]
+    for region, filename in filenames.items():
+        if str(region) not in transforms:
+            description = _describe(filename)
+            transforms[str(region)] = description["transform"]
+            tile_shapes[str(region)] = [description["height"], description["width"]]
+    group.attrs.update({"transforms": transforms, "tile_shapes": tile_shapes})
+
+
+def _ingest_static_layers(group, static, landcover, spatial_chunk):
+    """Write the static and land cover layers, which are small enough to be written by this process."""
+    _, _, _, height, width = group[DAILY_ARRAY].shape
+    num_regions = group[DAILY_ARRAY].shape[0]
+
+    if static:
+        if STATIC_ARRAY not in group:
+            description = _describe(next(iter(static.values())))
+            array = _create_array(group, STATIC_ARRAY, (0, description["count"], height, width),
+                                  (1, description["count"], spatial_chunk, spatial_chunk), description["dtype"])
+            array.attrs.update({"bands": description["bands"], "scales": description["scales"],
+                                "offsets": description["offsets"]})
+        array = group[STATIC_ARRAY]
+        _grow(array, 0, num_regions)
+        for region, filename in static.items():
+            data = _read_tile(filename, array.shape[1], str(array.dtype), height, width)
+            array[region - 1] = _pad(data, array.shape[1:], array.dtype)
+
+    if landcover:
+        if LANDCOVER_ARRAY not in group:
+            description = _describe(next(iter(landcover.values())))
+            array = _create_array(group, LANDCOVER_ARRAY, (0, 0, height, width),
+                                  (1, 1, spatial_chunk, spatial_chunk), description["dtype"])
+            array.attrs.update({"first_year": min(year for year, _ in landcover), "bands": description["bands"],
+                                "scales": description["scales"], "offsets": description["offsets"]})
+        array = group[LANDCOVER_ARRAY]
+        first_year = array.attrs["first_year"]
+        if min(year for year, _ in landcover) < first_year:
+            raise ValueError(f"The cube starts in {first_year}, land cover of earlier years cannot be added")
+        _grow(array, 0, num_regions)
+        _grow(array, 1, max(year for year, _ in landcover) - first_year + 1)
+        for (year, region), filename in landcover.items():
+            data = _read_tile(filename, 1, str(array.dtype), height, width)
+            array[region - 1, year - first_year] = _pad(data[0], array.shape[2:], array.dtype)
+
+
+def ingest(output_dir, path, workers=None, time_chunk=TIME_CHUNK, spatial_chunk=SPATIAL_CHUNK, overwrite=False):
+    """Ingest the tiles of an output directory into the cube at `path`, creating it if it does not exist.
+
+    Tiles that are already ingested are skipped unless `overwrite` is set. The chunk sizes only apply when the
+    cube is created.
+
+    Returns:
+        int: Number of ingested daily tiles.
+    """
+    tiles = find_tiles(output_dir)
+    if not tiles:
+        raise ValueError(f"No daily tiles found in {output_dir}")
+    static, landcover = find_static_layers(output_dir)
+
+    # one tile of every sub-region, to record its grid
+    region_tiles = {region: filename for (_, region), filename in sorted(tiles.items(), reverse=True)}
+
+    group = zarr.open_group(path, mode="a")
+    if DAILY_ARRAY not in group:
+        _initialize(group, tiles, region_tiles, time_chunk, spatial_chunk)
+    daily, ingested = group[DAILY_ARRAY], group[INGESTED_ARRAY]
+    time_chunk = daily.chunks[1]
+
+    start_date = datetime.strptime(group.attrs["start_date"], '%Y-%m-%d')
+    time_indices = {date: (datetime.strptime(date, '%Y-%m-%d') - start_date).days for date, _ in tiles}
+    if min(time_indices.values()) < 0:
+        raise ValueError(f"The cube starts on {group.attrs['start_date']}, earlier days cannot be added")
+
+    num_regions = max(region for _, region in tiles)
+    num_days = max(time_indices.values()) + 1
+    for array in (daily, ingested):
+        _grow(array, 0, num_regions)
+        _grow(array, 1, num_days)
+    _register_regions(group, region_tiles)
+
+    already_ingested = ingested[:]
+    units = defaultdict(list)
+    for (date, region), filename in sorted(tiles.items()):
+        time_index = time_indices[date]
+        if overwrite or not already_ingested[region - 1, time_index]:
+            units[(region - 1, time_index // time_chunk * time_chunk)].append((time_index, filename))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_write_time_chunk, path, region_index, first_day, unit_tiles)
+                   for (region_index, first_day), unit_tiles in units.items()]
+        count = sum(future.result() for future in futures)
+
+    _ingest_static_layers(group, static, landcover, spatial_chunk)
+    return count
+
+
+class TileCube:
+    def __init__(self, path):
+        """Open the cube at `path` for reading."""
+        self.path = path
+        self.group = zarr.open_group(path, mode="r")
+        self.daily = self.group[DAILY_ARRAY]
+        self.start_date = datetime.strptime(self.group.attrs["start_date"], '%Y-%m-%d')
+        self.bands = self.group.attrs["bands"]
+
+    @property
+    def dates(self):
+        """Date of every step of the time axis as YYYY-MM-DD."""
+        return [(self.start_date + timedelta(days=day)).strftime('%Y-%m-%d') for day in range(self.daily.shape[1])]
+
+    def time_index(self, date):
+        """Index of a date (YYYY-MM-DD) on the time axis."""
+        return (datetime.strptime(date, '%Y-%m-%d') - self.start_date).days
+
+    def transform(self, region):
+        """Affine transform (as six coefficients) of the tiles of a sub-region."""
+        return self.group.attrs["transforms"][str(region)]
+
+    def _crop(self, data, region, row=0, col=0):
+        height, width = self.group.attrs["tile_shapes"][str(region)]
+        return data[..., :max(0, height - row), :max(0, width - col)]
+
+    def tile_shape(self, region):
+        """(height, width) of the tiles of a sub-region."""
+        return tuple(self.group.attrs["tile_shapes"][str(region)])
+
+    def _band_indices(self, bands):
+        if bands is None:
+            return slice(None)
+        return [self.bands.index(band) if isinstance(band, str) else band for band in bands]
+
+    def available(self, region, start_date, end_date):
+        """Whether the tile of each day from `start_date` to `end_date` (inclusive) has been ingested."""
+        return self.group[INGESTED_ARRAY][region - 1, self.time_index(start_date):self.time_index(end_date) + 1]
+
+    def read(self, region, start_date, end_date, bands=None, decoded=False, window=None):
+        """Read the daily tiles of a sub-region from `start_date` to `end_date` (inclusive).
+
+        Args:
+            region (int): Sub-region number.
+            bands (list): Band names or indices to read, defaults to all bands.
+            decoded (bool): Apply the scales and offsets of the band schema and return float32 values, with
+                missing pixels as NaN.
+            window (tuple): (row, col, height, width) to read only a part of the tiles, which only decompresses
+                the chunks it overlaps. The result is cut at the edges of the tiles.
+
+        Returns:
+            np.ndarray: Array of shape (time, band, y, x).
+        """
+        band_indices = self._band_indices(bands)
+        row, col, (rows, cols) = self._window(window)
+        selection = (region - 1, slice(self.time_index(start_date), self.time_index(end_date) + 1), band_indices,
+                     rows, cols)
+        data = self._crop(self.daily.get_orthogonal_selection(selection), region, row, col)
+        if not decoded:
+            return data
+        scales = np.asarray(self.group.attrs["scales"])[band_indices]
+        offsets = np.asarray(self.group.attrs["offsets"])[band_indices]
+        return self._decode(data, scales, offsets, self.daily.fill_value)
+
+    @property
+    def static_bands(self):
+        """Bands of the static layers, empty if the cube has none."""
+        return self.group[STATIC_ARRAY].attrs["bands"] if STATIC_ARRAY in self.group else []
+
+    @property
+    def landcover_years(self):
+        """Years of the land cover layers, empty if the cube has none."""
+        if LANDCOVER_ARRAY not in self.group:
+            return range(0)
+        array = self.group[LANDCOVER_ARRAY]
+        return range(array.attrs["first_year"], array.attrs["first_year"] + array.shape[1])
+
+    @staticmethod
+    def _window(window):
+        row, col, height, width = window or (0, 0, None, None)
+        return row, col, (slice(row, None if height is None else row + height),
+                          slice(col, None if width is None else col + width))
+
+    def read_static(self, region, decoded=False, window=None):
+        """Read the static layers (band, y, x) of a sub-region, or of a (row, col, height, width) window."""
+        array = self.group[STATIC_ARRAY]
+        row, col, (rows, cols) = self._window(window)
+        data = self._crop(array[region - 1, :, rows, cols], region, row, col)
+        if not decoded:
+            return data
+        return self._decode(data, array.attrs["scales"], array.attrs["offsets"], array.fill_value)
+
+    def read_landcover(self, region, year, decoded=False, window=None):
+        """Read the land cover class (y, x) of a sub-region in a year, or of a (row, col, height, width) window."""
+        array = self.group[LANDCOVER_ARRAY]
+        row, col, (rows, cols) = self._window(window)
+        data = self._crop(array[region - 1, year - array.attrs["first_year"], rows, cols], region, row, col)
+        if not decoded:
+            return data
+        return self._decode(data[None], array.attrs["scales"], array.attrs["offsets"], array.fill_value)[0]
+
+    @staticmethod
+    def _decode(data, scales, offsets, missing):
+        decoded = decode(data, scales, offsets)
+        if not np.isnan(missing):
+            decoded[data == missing] = np.nan
+        return decoded
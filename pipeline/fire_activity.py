@@ -0,0 +1,90 @@
+'''
+Fire activity query and tile selection for the sparse extraction mode.
+
+Most sub-regions have no fire on most days. Instead of downloading every tile every day, the sparse mode first
+counts the active fire pixels (FIRMS detections) of every sub-region with one small `reduceRegions` query per day,
+and then only schedules the tiles with activity, together with their neighbors within `spatial_buffer` grid cells
+(found with the `TileIndex` of the sub-region grid) and the `temporal_buffer` preceding days. The query results,
+the parameters and the selection are written to a JSON file, so that the same dataset can be reproduced.
+'''
+
+import json
+from datetime import datetime, timedelta
+
+import ee
+
+# resolution of the FIRMS product in meters
+FIRE_ACTIVITY_SCALE = 1000
+
+
+def query_fire_activity(satellite_client, date_of_interest, region_geometries, min_confidence=0):
+    """Count the active fire pixels of every sub-region on one day with a FirePred `satellite_client`.
+
+    This is a single blocking round-trip to Google Earth Engine that only returns one number per sub-region.
+
+    Returns:
+        dict: {sub-region number: number of active fire pixels}
+    """
+    activity_image = satellite_client.compute_fire_activity(
+        date_of_interest + 'T00:00', date_of_interest + 'T23:59', min_confidence)
+    regions = ee.FeatureCollection([
+        ee.Feature(geometry, {'region': sub_region_number})
+        for sub_region_number, geometry in enumerate(region_geometries, start=1)
+    ])
+    counts = activity_image.reduceRegions(
+        collection=regions,
+        reducer=ee.Reducer.sum().setOutputs(['active_pixels']),
+        scale=FIRE_ACTIVITY_SCALE,
+    ).select(['region', 'active_pixels'], None, False).getInfo()
+
+    active_pixels = {}
+    for feature in counts['features']:
+        properties = feature['properties']
+        active_pixels[properties['region']] = int(round(properties.get('active_pixels') or 0))
+    return active_pixels
+
+
+def select_tiles(activity, dates, tile_index, spatial_buffer=0, temporal_buffer=0):
+    """Select the (date, sub-region) tiles to download.
+
+    Args:
+        activity (dict): {date: {sub-region number: active fire pixels}} for every date in `dates`.
+        dates (list): Dates of the run in order.
+        tile_index (TileIndex): Index of the sub-region grid, see `TileIndex.from_geojson`.
+        spatial_buffer (int): Also select the neighbors within this many grid cells of an active tile.
+        temporal_buffer (int): Also select the tiles on this many days before an active day.
+
+    Returns:
+        dict: {date: sorted list of selected sub-region numbers} for every date in `dates`.
+    """
+    region_neighbors = {}
+    selected = {date_of_interest: set() for date_of_interest in dates}
+    for date_of_interest in dates:
+        active_regions = [region for region, count in activity[date_of_interest].items() if count > 0]
+        day = datetime.strptime(date_of_interest, '%Y-%m-%d')
+        for days_before in range(temporal_buffer + 1):
+            buffered_date = (day - timedelta(days=days_before)).strftime('%Y-%m-%d')
+            if buffered_date not in selected:
+                continue
+            for region in active_regions:
+                if region not in region_neighbors:
+                    region_neighbors[region] = tile_index.neighbors(region, spatial_buffer)
+                selected[buffered_date].update(region_neighbors[region])
+    return {date_of_interest: sorted(regions) for date_of_interest, regions in selected.items()}
+
+
+def write_selection(path, parameters, activity, selection):
+    """Write the parameters, the active fire pixels of the active tiles and the selected tiles to a JSON file."""
+    record = {
+        "parameters": parameters,
+        "days": {
+            date_of_interest: {
+                "active_pixels": {str(region): count for region, count in sorted(activity[date_of_interest].items())
+                                  if count > 0},
+                "selected": regions,
+            }
+            for date_of_interest, regions in selection.items()
+        },
+    }
+    with open(path, 'w') as f:
+        json.dump(record, f, indent=1)
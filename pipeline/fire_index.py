@@ -0,0 +1,157 @@
+'''
+Index of the active fire pixels of the cube.
+
+Sampling training patches around active fire would otherwise scan every tile for fire pixels again and again.
+`build_fire_index` scans the cube once, one worker process per sub-region, and writes a compact array-backed table
+to a directory:
+
+    tiles.npy      one row per (day, region) with fire: day, region, start, count (sorted by day and region)
+    pixels.npy     row and column of every fire pixel, int16, grouped by tile in the order of `tiles.npy`
+    metadata.json  start date of the day numbers, the band and the threshold that define a fire pixel
+
+A fire pixel is a pixel whose `band` exceeds `threshold` (in physical units). The tiles contain no FIRMS band, so
+the default is a threshold on the VIIRS M11 (2.25 um) reflectance, which saturates over active fire; both are
+options of the index.
+
+`FireIndex` opens the pixel table memory-mapped, so sampling touches only the selected rows.
+'''
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from pipeline.cube import INGESTED_ARRAY, TileCube
+
+FIRE_BAND = "VIIRS band M11"
+FIRE_THRESHOLD = 5000
+
+TILE_DTYPE = np.dtype([("day", "int32"), ("region", "int32"), ("start", "int64"), ("count", "int32")])
+PIXEL_DTYPE = np.dtype([("row", "int16"), ("col", "int16")])
+
+TILES_FILE = "tiles.npy"
+PIXELS_FILE = "pixels.npy"
+METADATA_FILE = "metadata.json"
+
+
+def _scan_region(cube_path, region, band, threshold):
+    """Fire pixels of one sub-region on every day of the cube. Runs in a worker process.
+
+    Returns:
+        tuple: (days, rows, cols) arrays of the fire pixels, sorted by day, row and column.
+    """
+    cube = TileCube(cube_path)
+    band_index = cube.bands.index(band)
+    scale, offset = cube.group.attrs["scales"][band_index], cube.group.attrs["offsets"][band_index]
+    # compare the stored values, so the chunks are not decoded
+    stored_threshold = (threshold - offset) / scale
+    ingested = cube.group[INGESTED_ARRAY][region - 1]
+    time_chunk = cube.daily.chunks[1]
+    height, width = cube.tile_shape(region)
+
+    days, rows, cols = [], [], []
+    for first_day in range(0, cube.daily.shape[1], time_chunk):
+        last_day = min(first_day + time_chunk, cube.daily.shape[1])
+        if not ingested[first_day:last_day].any():
+            continue
+        data = cube.daily[region - 1, first_day:last_day, band_index, :height, :width]
+        fire = data > stored_threshold
+        fire &= ingested[first_day:last_day, None, None]
+        if not np.issubdtype(data.dtype, np.floating):
+            fire &= data != cube.daily.fill_value
+        day, row, col = np.nonzero(fire)
+        days.append(day + first_day)
+        rows.append(row)
+        cols.append(col)
+    if not days:
+        return np.empty(0, "int32"), np.empty(0, "int16"), np.empty(0, "int16")
+    return np.concatenate(days).astype("int32"), np.concatenate(rows).astype("int16"), \
+        np.concatenate(cols).astype("int16")
+
+
+def _save(path, array):
+    temp_filename = path + ".part"
+    with open(temp_filename, 'wb') as f:
+        np.save(f, array)
+    os.replace(temp_filename, path)
+
+
+def build_fire_index(cube_path, index_dir, band=FIRE_BAND, threshold=FIRE_THRESHOLD, workers=None):
+    """Scan the cube for fire pixels and write the index to `index_dir`.
+
+    Returns:
+        int: Number of fire pixels.
+    """
+    cube = TileCube(cube_path)
+    regions = [int(region) for region in cube.group.attrs["tile_shapes"]]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {region: executor.submit(_scan_region, cube_path, region, band, threshold) for region in regions}
+        results = {region: future.result() for region, future in futures.items()}
+
+    # group the pixels by (day, region)
+    days = np.concatenate([results[region][0] for region in regions] + [np.empty(0, "int32")])
+    tile_regions = np.concatenate([np.full(len(results[region][0]), region, dtype="int32") for region in regions]
+                                  + [np.empty(0, "int32")])
+    order = np.lexsort((tile_regions, days))
+    pixels = np.empty(len(days), dtype=PIXEL_DTYPE)
+    pixels["row"] = np.concatenate([results[region][1] for region in regions] + [np.empty(0, "int16")])[order]
+    pixels["col"] = np.concatenate([results[region][2] for region in regions] + [np.empty(0, "int16")])[order]
+    days, tile_regions = days[order], tile_regions[order]
+
+    keys = days.astype(np.int64) << 32 | tile_regions
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, np.int64)
+    tiles = np.empty(len(starts), dtype=TILE_DTYPE)
+    tiles["day"], tiles["region"], tiles["start"] = days[starts], tile_regions[starts], starts
+    tiles["count"] = np.diff(np.r_[starts, len(keys)])
+
+    os.makedirs(index_dir, exist_ok=True)
+    _save(os.path.join(index_dir, PIXELS_FILE), pixels)
+    _save(os.path.join(index_dir, TILES_FILE), tiles)
+    metadata = {"start_date": cube.group.attrs["start_date"], "band": band, "threshold": threshold}
+    with open(os.path.join(index_dir, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f)
+    return len(pixels)
+
+
+class FireIndex:
+    def __init__(self, index_dir):
+        """Open an index written by `build_fire_index`; the pixel table is memory-mapped."""
+        with open(os.path.join(index_dir, METADATA_FILE), 'r') as f:
+            self.metadata = json.load(f)
+        self.start_date = datetime.strptime(self.metadata["start_date"], '%Y-%m-%d')
+        self.tiles = np.load(os.path.join(index_dir, TILES_FILE))
+        self.pixels = np.load(os.path.join(index_dir, PIXELS_FILE), mmap_mode='r')
+        self._keys = self.tiles["day"].astype(np.int64) << 32 | self.tiles["region"]
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def date(self, day):
+        """Date (YYYY-MM-DD) of a day number of the index."""
+        return (self.start_date + timedelta(days=int(day))).strftime('%Y-%m-%d')
+
+    def day(self, date):
+        """Day number of a date (YYYY-MM-DD)."""
+        return (datetime.strptime(date, '%Y-%m-%d') - self.start_date).days
+
+    def tile_pixels(self, date, region):
+        """(rows, cols) of the fire pixels of one tile, empty if it has none."""
+        key = np.int64(self.day(date)) << 32 | region
+        position = np.searchsorted(self._keys, key)
+        if position == len(self._keys) or self._keys[position] != key:
+            return np.empty(0, "int16"), np.empty(0, "int16")
+        start, count = self.tiles["start"][position], self.tiles["count"][position]
+        pixels = self.pixels[start:start + count]
+        return np.asarray(pixels["row"]), np.asarray(pixels["col"])
+
+    def pixel_coordinates(self, pixel_indices):
+        """(rows, cols) of fire pixels given by their position in the pixel table."""
+        pixel_indices = np.asarray(pixel_indices)
+        order = np.argsort(pixel_indices)
+        # read the memory-mapped rows in increasing order, then restore the requested order
+        pixels = np.empty(len(pixel_indices), dtype=PIXEL_DTYPE)
+        pixels[order] = self.pixels[pixel_indices[order]]
+        return pixels["row"].astype(np.int64), pixels["col"].astype(np.int64)
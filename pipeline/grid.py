@@ -0,0 +1,235 @@
+'''
+Local generation and indexing of the sub-region grid.
+
+The grid is a regular grid of square cells in any CRS (EPSG:4326 by default, with 1 degree cells). Only the cells
+that intersect the US boundary are kept; they are numbered in row-major order from the south-west corner, and
+their position in the resulting GeoJSON defines the sub-region numbers used by extract_images.py.
+
+1. `TileGrid` computes the cell bounds with numpy and the intersection with the boundary with Shapely (vectorized
+   with Shapely 2, with a prepared geometry otherwise), without any Earth Engine round-trip.
+2. Cells can be enlarged by a margin (in CRS units) so that neighbouring tiles overlap.
+3. `TileIndex` maps a longitude/latitude (e.g. a fire detection) to the sub-region numbers of the tiles containing
+   it, and a sub-region to its neighbors within a number of cells. As the grid is regular, both lookups are
+   arithmetic on the row and column of the cell and dictionary lookups.
+
+Like in Earth Engine, the edges of the boundary are geodesics: they are densified along great circles before the
+intersection test, so the selected cells are the same as with a server-side `intersects`.
+
+Cell polygons are written in longitude/latitude as GeoJSON requires; edges of cells in a projected CRS are
+densified so that their shape is kept.
+'''
+
+import json
+import math
+
+import numpy as np
+import shapely
+from pyproj import Geod, Transformer
+from shapely.geometry import Polygon, box
+from shapely.ops import transform as transform_geometry
+from shapely.prepared import prep
+
+GEOGRAPHIC_CRS = "EPSG:4326"
+# bounds of the default 1 degree grid, extended beyond the US boundary
+US_GRID_BOUNDS = (-126.0, 24.0, -65.0, 50.0)
+# maximum distance in meters between the points of the densified geodesic boundary
+GEODESIC_SPACING = 10000
+# points per cell edge of projected cells in the GeoJSON
+DENSIFY_POINTS = 16
+
+US_BOUNDARY_VERTICES = [
+    (-125.1803892906456, 35.26328285844432),
+    (-117.08916345892665, 33.2311514593429),
+    (-114.35640058749676, 32.92199940444295),
+    (-110.88773544819885, 31.612036247094473),
+    (-108.91086200144109, 31.7082477979397),
+    (-106.80030780089378, 32.42079476218232),
+    (-103.63413436750255, 29.786401496314422),
+    (-101.87558377066483, 30.622527701868453),
+    (-99.40039768482492, 28.04018292597704),
+    (-98.69085295525215, 26.724810345780593),
+    (-96.42355704777482, 26.216515704595633),
+    (-80.68508661702214, 24.546812350183075),
+    (-75.56173032587596, 26.814533788629998),
+    (-67.1540159827795, 44.40095539443753),
+    (-68.07548734644243, 46.981170472447374),
+    (-69.17500995805074, 46.98158998130476),
+    (-70.7598785138901, 44.87172183866657),
+    (-74.84994741250935, 44.748084983808),
+    (-77.62168256782745, 43.005725611950055),
+    (-82.45987924104175, 41.41068867019324),
+    (-83.38318501671864, 42.09979904377044),
+    (-82.5905167831457, 45.06163491639556),
+    (-84.83301910769038, 46.83552648258547),
+    (-88.26350848510909, 48.143646480291835),
+    (-90.06706251069104, 47.553445811024204),
+    (-95.03745451438925, 48.9881557770297),
+    (-98.45773319567587, 48.94699366043251),
+    (-101.7018751401119, 48.98284560308372),
+    (-108.43164852530356, 48.81973606668503),
+    (-115.07339190755627, 48.93699058308441),
+    (-121.82530604190744, 48.9830983403776),
+    (-122.22085227110232, 48.63535795404536),
+    (-124.59504332589562, 47.695726563030405),
+    (-125.1803892906456, 35.26328285844432),
+]
+
+
+def geodesic_polygon(vertices, spacing=GEODESIC_SPACING):
+    """Polygon with geodesic edges between longitude/latitude vertices, densified every `spacing` meters."""
+    geod = Geod(ellps="WGS84")
+    points = []
+    for (lng, lat), (next_lng, next_lat) in zip(vertices[:-1], vertices[1:]):
+        distance = geod.inv(lng, lat, next_lng, next_lat)[2]
+        points.append((lng, lat))
+        points.extend(geod.npts(lng, lat, next_lng, next_lat, int(distance // spacing)))
+    points.append(vertices[-1])
+    return Polygon(points)
+
+
+US_BOUNDARY = geodesic_polygon(US_BOUNDARY_VERTICES)
+
+
+def _transformer(source_crs, target_crs):
+    return Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+
+class TileGrid:
+    """Regular grid of `cell_size` cells covering `bounds` (west, south, east, north) in `crs`.
+
+    Cell ids are row-major indexes from the south-west corner: `row * columns + column`.
+    """
+
+    def __init__(self, bounds=US_GRID_BOUNDS, cell_size=1.0, crs=GEOGRAPHIC_CRS, margin=0.0):
+        west, south, east, north = bounds
+        self.crs = crs
+        self.cell_size = cell_size
+        self.margin = margin
+        self.columns = math.ceil(round((east - west) / cell_size, 9))
+        self.rows = math.ceil(round((north - south) / cell_size, 9))
+        self.bounds = (west, south, west + self.columns * cell_size, south + self.rows * cell_size)
+
+    @classmethod
+    def covering(cls, boundary=US_BOUNDARY, cell_size=1.0, crs=GEOGRAPHIC_CRS, margin=0.0):
+        """Grid aligned to multiples of `cell_size` covering a longitude/latitude boundary in `crs`."""
+        west, south, east, north = cls.project(boundary, crs).bounds
+        west, south = math.floor(west / cell_size) * cell_size, math.floor(south / cell_size) * cell_size
+        return cls((west, south, east, north), cell_size, crs, margin)
+
+    @staticmethod
+    def project(geometry, crs):
+        """Transform a longitude/latitude geometry to `crs`."""
+        if crs == GEOGRAPHIC_CRS:
+            return geometry
+        return transform_geometry(_transformer(GEOGRAPHIC_CRS, crs).transform, geometry)
+
+    def cell_bounds(self, cell_ids=None, with_margin=True):
+        """Bounds of the cells as an (n, 4) array of (west, south, east, north), all cells by default."""
+        if cell_ids is None:
+            cell_ids = np.arange(self.rows * self.columns)
+        rows, columns = np.divmod(np.asarray(cell_ids), self.columns)
+        west = self.bounds[0] + columns * self.cell_size
+        south = self.bounds[1] + rows * self.cell_size
+        margin = self.margin if with_margin else 0.0
+        return np.stack([west - margin, south - margin, west + self.cell_size + margin,
+                         south + self.cell_size + margin], axis=-1)
+
+    def intersecting(self, boundary=US_BOUNDARY):
+        """Ids of the cells (without margin) that intersect a longitude/latitude boundary, in increasing order."""
+        boundary = self.project(boundary, self.crs)
+        bounds = self.cell_bounds(with_margin=False)
+        # cells outside of the bounding box of the boundary cannot intersect it
+        west, south, east, north = boundary.bounds
+        candidates = np.flatnonzero((bounds[:, 0] <= east) & (bounds[:, 2] >= west) &
+                                    (bounds[:, 1] <= north) & (bounds[:, 3] >= south))
+        if hasattr(shapely, "prepare"):
+            shapely.prepare(boundary)
+            cells = shapely.box(*bounds[candidates].T)
+            return candidates[shapely.intersects(boundary, cells)]
+        prepared = prep(boundary)
+        return np.array([cell_id for cell_id in candidates if prepared.intersects(box(*bounds[cell_id]))],
+                        dtype=candidates.dtype)
+
+    def cell_rings(self, cell_ids):
+        """Longitude/latitude exterior rings of the cells, including the margin, as an (n, points, 2) array.
+
+        Rings start at the south-west corner and run counter-clockwise. Edges of projected cells are densified
+        with `DENSIFY_POINTS` points, and all points are transformed with a single call.
+        """
+        west, south, east, north = (column[:, None] for column in self.cell_bounds(cell_ids).T)
+        if self.crs == GEOGRAPHIC_CRS:
+            xs = np.hstack([west, east, east, west, west])
+            ys = np.hstack([south, south, north, north, south])
+            return np.stack([xs, ys], axis=-1)
+        steps = np.linspace(0, 1, DENSIFY_POINTS, endpoint=False)
+        xs = np.hstack([west + (east - west) * steps, np.broadcast_to(east, (len(east), DENSIFY_POINTS)),
+                        east - (east - west) * steps, np.broadcast_to(west, (len(west), DENSIFY_POINTS)), west])
+        ys = np.hstack([np.broadcast_to(south, (len(south), DENSIFY_POINTS)), south + (north - south) * steps,
+                        np.broadcast_to(north, (len(north), DENSIFY_POINTS)), north - (north - south) * steps, south])
+        longitudes, latitudes = _transformer(self.crs, GEOGRAPHIC_CRS).transform(xs, ys)
+        return np.stack([longitudes, latitudes], axis=-1)
+
+    def parameters(self):
+        return {"bounds": list(self.bounds), "cell_size": self.cell_size, "crs": self.crs, "margin": self.margin}
+
+    def to_geojson(self, cell_ids):
+        """FeatureCollection of the cells in the format of config/US_polygons.json, with the grid parameters."""
+        return {
+            "type": "FeatureCollection",
+            "columns": {"intersects": "Boolean", "system:index": "String"},
+            "grid": self.parameters(),
+            "features": [
+                {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]}, "id": str(cell_id),
+                 "properties": {"intersects": True}}
+                for cell_id, ring in zip(np.asarray(cell_ids).tolist(), self.cell_rings(cell_ids).tolist())
+            ],
+        }
+
+
+class TileIndex:
+    """Maps locations to the sub-region numbers (1-based positions in the GeoJSON) of the tiles containing them."""
+
+    def __init__(self, grid, cell_ids):
+        self.grid = grid
+        self.cell_ids = [int(cell_id) for cell_id in cell_ids]
+        self.regions = {cell_id: number for number, cell_id in enumerate(self.cell_ids, start=1)}
+        self._to_grid = None if grid.crs == GEOGRAPHIC_CRS else _transformer(GEOGRAPHIC_CRS, grid.crs)
+
+    @classmethod
+    def from_geojson(cls, path):
+        """Load the index of a GeoJSON written by create_US_polygons.py.
+
+        Files without grid parameters are assumed to use the default 1 degree grid.
+        """
+        with open(path, 'r') as f:
+            sub_regions = json.load(f)
+        parameters = sub_regions.get("grid", {})
+        grid = TileGrid(tuple(parameters.get("bounds", US_GRID_BOUNDS)), parameters.get("cell_size", 1.0),
+                        parameters.get("crs", GEOGRAPHIC_CRS), parameters.get("margin", 0.0))
+        return cls(grid, [int(feature["id"]) for feature in sub_regions["features"]])
+
+    def _numbers(self, first_row, last_row, first_column, last_column):
+        grid = self.grid
+        numbers = []
+        for row in range(max(first_row, 0), min(last_row, grid.rows - 1) + 1):
+            for column in range(max(first_column, 0), min(last_column, grid.columns - 1) + 1):
+                number = self.regions.get(row * grid.columns + column)
+                if number is not None:
+                    numbers.append(number)
+        return sorted(numbers)
+
+    def neighbors(self, number, buffer=0):
+        """Sorted sub-region numbers of the tiles within `buffer` cells of a sub-region, including itself."""
+        row, column = divmod(self.cell_ids[number - 1], self.grid.columns)
+        return self._numbers(row - buffer, row + buffer, column - buffer, column + buffer)
+
+    def lookup(self, longitude, latitude):
+        """Sorted sub-region numbers of the tiles (including their margin) that contain a point."""
+        x, y = (longitude, latitude) if self._to_grid is None else self._to_grid.transform(longitude, latitude)
+        grid = self.grid
+        west, south = grid.bounds[:2]
+        first_column = math.floor((x - west - grid.margin) / grid.cell_size)
+        last_column = math.floor((x - west + grid.margin) / grid.cell_size)
+        first_row = math.floor((y - south - grid.margin) / grid.cell_size)
+        last_row = math.floor((y - south + grid.margin) / grid.cell_size)
+        return self._numbers(first_row, last_row, first_column, last_column)
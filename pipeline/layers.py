@@ -0,0 +1,164 @@
+'''
+Static and annual layer store for the FirePred images.
+
+Elevation, slope and aspect never change and the MODIS land cover changes once per year, so they are not part of
+the daily images. They are downloaded once per sub-region (and once per year for the land cover) into the
+`static` directory next to the daily images:
+
+    <output_dir>/<date>_<region>.tif                 time-varying bands only
+    <output_dir>/static/static_<region>.tif          slope, aspect, elevation
+    <output_dir>/static/landcover_<year>_<region>.tif  land cover class
+
+`read_full_stack` joins a daily image with its static layers into the original 22-band stack and optionally
+decodes the scaled integers of pipeline/band_schema.py, with missing pixels (the nodata value) as NaN.
+'''
+
+import os
+import re
+
+import numpy as np
+import rasterio
+
+from pipeline.band_schema import decode
+
+# layer of a job: the daily image without static bands, the daily image with all 22 bands, and the static layers
+DAILY = "daily"
+FULL = "full"
+STATIC = "static"
+LANDCOVER = "landcover"
+
+# directory inside the output directory containing the static and annual layers
+STATIC_DIR = "static"
+# name of a daily image
+TILE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})_(\d+)\.tif$")
+# names of the static and land cover layers
+STATIC_PATTERN = re.compile(r"^static_(\d+)\.tif$")
+LANDCOVER_PATTERN = re.compile(r"^landcover_(\d{4})_(\d+)\.tif$")
+
+# band order of the full FirePred stack
+FULL_BANDS = [
+    "VIIRS band M11", "VIIRS band I2", "VIIRS band I1", "NDVI", "EVI2",
+    "Total precipitation", "Wind speed", "Wind direction",
+    "Minimum temperature", "Maximum temperature", "Energy release component",
+    "Specific humidity", "Slope", "Aspect", "Elevation",
+    "Palmer drought severity index", "Landcover class",
+    "Forecast total precipitation", "Forecast wind speed",
+    "Forecast wind direction", "Forecast temperature",
+    "Forecast specific humidity"
+]
+STATIC_BANDS = ["Slope", "Aspect", "Elevation"]
+ANNUAL_BANDS = ["Landcover class"]
+DAILY_BANDS = [band for band in FULL_BANDS if band not in STATIC_BANDS + ANNUAL_BANDS]
+# bands of the image downloaded for each layer
+LAYER_BANDS = {
+    DAILY: DAILY_BANDS,
+    FULL: FULL_BANDS,
+    STATIC: STATIC_BANDS,
+    LANDCOVER: ANNUAL_BANDS,
+}
+
+
+def static_filename(output_dir, sub_region_number):
+    """Path of the GeoTIFF with the static bands of one sub-region."""
+    return os.path.join(output_dir, STATIC_DIR, f"static_{sub_region_number}.tif")
+
+
+def landcover_filename(output_dir, year, sub_region_number):
+    """Path of the GeoTIFF with the land cover of one sub-region in one year."""
+    return os.path.join(output_dir, STATIC_DIR, f"landcover_{year}_{sub_region_number}.tif")
+
+
+def parse_tile_filename(filename):
+    """Return (date, sub-region number) of a daily GeoTIFF named <date>_<region>.tif."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    date_of_interest, sub_region_number = stem.rsplit("_", 1)
+    return date_of_interest, int(sub_region_number)
+
+
+def find_tiles(output_dir):
+    """Find the daily tiles of an output directory.
+
+    Returns:
+        dict: {(date, sub-region number): filename}
+    """
+    tiles = {}
+    for name in os.listdir(output_dir):
+        match = TILE_PATTERN.match(name)
+        if match:
+            tiles[(match.group(1), int(match.group(2)))] = os.path.join(output_dir, name)
+    return tiles
+
+
+def find_static_layers(output_dir):
+    """Find the static and land cover layers of an output directory.
+
+    Returns:
+        tuple: ({sub-region number: filename}, {(year, sub-region number): filename})
+    """
+    static, landcover = {}, {}
+    static_dir = os.path.join(output_dir, STATIC_DIR)
+    if not os.path.isdir(static_dir):
+        return static, landcover
+    for name in os.listdir(static_dir):
+        match = STATIC_PATTERN.match(name)
+        if match:
+            static[int(match.group(1))] = os.path.join(static_dir, name)
+        match = LANDCOVER_PATTERN.match(name)
+        if match:
+            landcover[(int(match.group(1)), int(match.group(2)))] = os.path.join(static_dir, name)
+    return static, landcover
+
+
+def _read(dataset, decoded):
+    data = dataset.read()
+    if not decoded:
+        return data
+    decoded_data = decode(data, dataset.scales, dataset.offsets)
+    if dataset.nodata is not None and not np.isnan(dataset.nodata):
+        decoded_data[data == dataset.nodata] = np.nan
+    return decoded_data
+
+
+def _read_bands(filename, names, shape, transform, decoded):
+    with rasterio.open(filename) as dataset:
+        if dataset.count != len(names):
+            raise ValueError(f"Expected {len(names)} bands in {filename}, but found {dataset.count}")
+        if (dataset.height, dataset.width) != shape or dataset.transform != transform:
+            raise ValueError(f"{filename} is not aligned with the daily image")
+        return dict(zip(names, _read(dataset, decoded)))
+
+
+def read_full_stack(daily_filename, output_dir=None, decoded=False):
+    """Read a daily image and join it with the static layers of its sub-region.
+
+    Images that already contain all 22 bands are not joined.
+
+    Args:
+        daily_filename (str): Path of the daily GeoTIFF.
+        output_dir (str): Directory containing the `static` directory, defaults to the directory of the daily image.
+        decoded (bool): Apply the scales and offsets stored in the files and return float32 values, with missing
+            pixels as NaN.
+
+    Returns:
+        tuple: (array of shape (22, height, width) in the order of `FULL_BANDS`, rasterio profile of the daily image)
+    """
+    with rasterio.open(daily_filename) as dataset:
+        profile = dataset.profile
+        data = _read(dataset, decoded)
+    if data.shape[0] == len(FULL_BANDS):
+        return data, profile
+    if data.shape[0] != len(DAILY_BANDS):
+        raise ValueError(f"Expected {len(DAILY_BANDS)} or {len(FULL_BANDS)} bands in {daily_filename}, "
+                         f"but found {data.shape[0]}")
+
+    if output_dir is None:
+        output_dir = os.path.dirname(daily_filename)
+    date_of_interest, sub_region_number = parse_tile_filename(daily_filename)
+    shape = (profile["height"], profile["width"])
+
+    bands = dict(zip(DAILY_BANDS, data))
+    bands.update(_read_bands(static_filename(output_dir, sub_region_number), STATIC_BANDS,
+                             shape, profile["transform"], decoded))
+    bands.update(_read_bands(landcover_filename(output_dir, date_of_interest[:4], sub_region_number), ANNUAL_BANDS,
+                             shape, profile["transform"], decoded))
+    return np.stack([bands[band] for band in FULL_BANDS]).astype(data.dtype, copy=False), profile
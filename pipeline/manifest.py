@@ -0,0 +1,124 @@
+'''
+Persistent job manifest for the image extraction.
+
+Records the state of every (date, sub-region) job in a small SQLite database next to the downloaded images,
+together with the byte size, SHA-256 checksum and band count of the written file. This allows an interrupted
+extraction to be resumed by only scheduling jobs that are missing or failed.
+
+For the sparse extraction mode it also caches the number of active fire pixels per (date, sub-region), minimum
+detection confidence and sub-region grid, so that the daily activity query does not have to be repeated when a run
+is resumed, and a run with a different confidence threshold or a regenerated grid queries the counts again.
+'''
+
+import os
+import sqlite3
+import time
+
+DONE = "done"
+FAILED = "failed"
+
+
+class JobManifest:
+    def __init__(self, path):
+        """Open (or create) the manifest database at `path`."""
+        self.path = path
+        # the workers of a sharded run write to the same manifest, so wait for their locks; the extraction uses the
+        # connection from one thread at a time, but not from the thread that opened it
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # WAL needs shared memory on one host, a rollback journal also works on a shared filesystem
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                date TEXT NOT NULL,
+                region INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                filename TEXT,
+                size INTEGER,
+                checksum TEXT,
+                band_count INTEGER,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (date, region)
+            )"""
+        )
+        activity_columns = [row[1] for row in self.connection.execute("PRAGMA table_info(activity)")]
+        if activity_columns and not {"min_confidence", "grid"} <= set(activity_columns):
+            # the counts of older manifests do not record their threshold and grid, so they are queried again
+            self.connection.execute("DROP TABLE activity")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS activity (
+                date TEXT NOT NULL,
+                region INTEGER NOT NULL,
+                min_confidence INTEGER NOT NULL,
+                grid TEXT NOT NULL,
+                active_pixels INTEGER NOT NULL,
+                PRIMARY KEY (date, region, min_confidence, grid)
+            )"""
+        )
+        self.connection.commit()
+
+    def _upsert(self, date, region, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(["date", "region"] + list(fields))
+        placeholders = ", ".join("?" * (len(fields) + 2))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in fields)
+        self.connection.execute(
+            f"INSERT INTO jobs ({columns}) VALUES ({placeholders}) "
+            f"ON CONFLICT (date, region) DO UPDATE SET {updates}",
+            [date, region] + list(fields.values()),
+        )
+        self.connection.commit()
+
+    def mark_done(self, date, region, filename, size, checksum, band_count):
+        """Record a successfully written file for the job."""
+        self._upsert(date, region, state=DONE, filename=filename, size=size, checksum=checksum,
+                     band_count=band_count, error=None)
+
+    def mark_failed(self, date, region, error):
+        """Record that the job failed with the given error message."""
+        self._upsert(date, region, state=FAILED, error=str(error))
+
+    def get(self, date, region):
+        """Return the manifest entry of a job as a dict, or None if the job was never recorded."""
+        cursor = self.connection.execute("SELECT * FROM jobs WHERE date = ? AND region = ?", (date, region))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def is_complete(self, date, region):
+        """Check whether the job is done and its file still exists with the recorded size."""
+        entry = self.get(date, region)
+        if entry is None or entry["state"] != DONE:
+            return False
+        try:
+            return os.path.getsize(entry["filename"]) == entry["size"]
+        except OSError:
+            return False
+
+    def record_activity(self, date, active_pixels, min_confidence=0, grid=""):
+        """Record the number of active fire pixels of every sub-region on a date, given as {region: count}, counted
+        with the minimum detection confidence `min_confidence` over the sub-regions of `grid` (an identifier of
+        the sub-region polygons, e.g. the checksum of their GeoJSON)."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO activity (date, region, min_confidence, grid, active_pixels) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(date, region, min_confidence, grid, count) for region, count in active_pixels.items()],
+        )
+        self.connection.commit()
+
+    def get_activity(self, date, min_confidence=0, grid=""):
+        """Return the active fire pixels of a date recorded with `min_confidence` and `grid` as {region: count}, or
+        None if they were never recorded."""
+        rows = self.connection.execute(
+            "SELECT region, active_pixels FROM activity WHERE date = ? AND min_confidence = ? AND grid = ?",
+            (date, min_confidence, grid)).fetchall()
+        return dict(rows) if rows else None
+
+    def counts(self):
+        """Return the number of jobs per state."""
+        return dict(self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,162 @@
+'''
+Instrumentation of extraction runs.
+
+`RunMetrics` collects the duration of every stage of every job, counters and gauges, so that a slow run can be
+attributed to Earth Engine, the network or the disk:
+
+    graph          building the feature image of a job (client side, see `prepare_image`)
+    url            requesting the GeoTIFF download URL (Earth Engine computes the image)
+    pixels         computing the pixels with computePixels (pixels backend), with the bytes received
+    url_wait       waiting for a free slot of the Earth Engine limiter
+    download_wait  waiting for a free slot of the download limiter
+    ttfb           from sending the download request to the response headers
+    download       streaming the response body, with the bytes received
+    disk_write     writing the received chunks to disk, with the bytes written
+    write          writing tiles after the fetch: band metadata, splitting multi-day stacks, NPY payloads
+    cog            converting the tiles of a job to COGs
+    job            the whole job including retries
+
+Every measurement is appended as one JSON line to the event log (if one is given). `progress` returns a one-line
+status with the throughput and the ETA, and `summary` the latency percentiles of every stage. Stages run in the
+URL thread pool as well as on the event loop, so updates are protected by a lock.
+'''
+
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+# stages whose bytes are received from Earth Engine
+RECEIVE_STAGES = ("download", "pixels")
+
+
+def format_duration(seconds):
+    """Format seconds as e.g. 1h02m03s."""
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class RunMetrics:
+    def __init__(self, event_log=None, total_jobs=None):
+        """Collect the metrics of a run.
+
+        Args:
+            event_log (str): Path of a JSON lines file the events are appended to, no log if None.
+            total_jobs (int): Number of jobs of the run, for the ETA.
+        """
+        self.total_jobs = total_jobs
+        self.start = time.perf_counter()
+        self.durations = defaultdict(list)
+        self.bytes = Counter()
+        self.counters = Counter()
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._log = open(event_log, 'a') if event_log else None
+
+    def _write_event(self, event):
+        if self._log is not None:
+            event["time"] = round(time.time(), 3)
+            self._log.write(json.dumps(event) + "\n")
+
+    def record(self, stage, seconds, nbytes=None, **labels):
+        """Record the duration (and the bytes transferred) of one stage of a job."""
+        with self._lock:
+            self.durations[stage].append(seconds)
+            event = {"stage": stage, "seconds": round(seconds, 6)}
+            if nbytes is not None:
+                self.bytes[stage] += nbytes
+                event["bytes"] = nbytes
+            event.update(labels)
+            self._write_event(event)
+
+    @contextmanager
+    def stage(self, stage, **labels):
+        """Time the enclosed block as `stage`; failed blocks are not recorded."""
+        start = time.perf_counter()
+        yield
+        self.record(stage, time.perf_counter() - start, **labels)
+
+    def increment(self, counter, value=1, **labels):
+        """Increment a counter, e.g. retries, and log the event."""
+        with self._lock:
+            self.counters[counter] += value
+            self._write_event({"counter": counter, "value": value, **labels})
+
+    def set_gauge(self, name, value):
+        """Set a sampled value such as the queue depth."""
+        self.gauges[name] = value
+
+    def progress(self):
+        """One-line status: completed jobs, throughput, ETA, download rate and gauges."""
+        elapsed = time.perf_counter() - self.start
+        completed = self.counters["done"] + self.counters["failed"]
+        rate = completed / elapsed if elapsed > 0 else 0.0
+        parts = [f"{completed}" + (f"/{self.total_jobs}" if self.total_jobs else "") + " jobs"]
+        if self.total_jobs:
+            parts[0] += f" ({100 * completed / self.total_jobs:.1f}%)"
+        parts.append(f"{rate:.2f} jobs/s")
+        if self.total_jobs and rate > 0:
+            parts.append(f"ETA {format_duration((self.total_jobs - completed) / rate)}")
+        received = sum(self.bytes[stage] for stage in RECEIVE_STAGES)
+        parts.append(f"{received / elapsed / 1e6 if elapsed > 0 else 0:.1f} MB/s")
+        parts.append(f"retries {self.counters['retries']}, failed {self.counters['failed']}")
+        parts.extend(f"{name} {value:g}" for name, value in sorted(self.gauges.items()))
+        return ", ".join(parts)
+
+    def summary(self):
+        """Count, total and latency percentiles (in seconds) of every stage, and the counters.
+
+        Returns:
+            dict: {"elapsed": seconds, "counters": {...}, "stages": {stage: {...}}}
+        """
+        stages = {}
+        with self._lock:
+            for stage, durations in sorted(self.durations.items()):
+                durations = np.asarray(durations)
+                statistics = {"count": len(durations), "total": float(durations.sum())}
+                statistics.update({f"p{percentile}": float(value) for percentile, value in
+                                   zip(PERCENTILES, np.percentile(durations, PERCENTILES))})
+                statistics["max"] = float(durations.max())
+                if self.bytes[stage]:
+                    statistics["bytes"] = self.bytes[stage]
+                    statistics["MB/s"] = self.bytes[stage] / max(statistics["total"], 1e-9) / 1e6
+                stages[stage] = statistics
+            return {"elapsed": time.perf_counter() - self.start, "counters": dict(self.counters),
+                    "stages": stages}
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Run summary after {format_duration(summary['elapsed'])}: "
+              + ", ".join(f"{counter} {value}" for counter, value in sorted(summary["counters"].items())))
+        print(f"  {'stage':14s} {'count':>7s} {'total s':>9s} " +
+              " ".join(f"{'p' + str(percentile) + ' s':>8s}" for percentile in PERCENTILES) + f" {'max s':>8s}")
+        for stage, statistics in summary["stages"].items():
+            line = (f"  {stage:14s} {statistics['count']:7d} {statistics['total']:9.1f} " +
+                    " ".join(f"{statistics['p' + str(percentile)]:8.3f}" for percentile in PERCENTILES) +
+                    f" {statistics['max']:8.3f}")
+            if "bytes" in statistics:
+                line += f"  {statistics['bytes'] / 1e6:.1f} MB at {statistics['MB/s']:.1f} MB/s"
+            print(line)
+        with self._lock:
+            self._write_event({"summary": summary})
+
+    def flush(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.flush()
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
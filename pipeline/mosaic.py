@@ -0,0 +1,192 @@
+'''
+Daily mosaics of the sub-region tiles.
+
+Every 1 degree sub-region is exported with its own transform, so an area that crosses a cell edge spans several
+files. This module combines the tiles of one day on a common grid with the pixel size of the tiles:
+
+1. `write_vrt` writes a GDAL virtual mosaic (VRT) that references the tiles, which costs a few kilobytes and
+   can be opened like a single raster by rasterio, GDAL and QGIS.
+2. `materialize` writes one tiled, compressed GeoTIFF. It streams over the mosaic in chunks of whole blocks;
+   for every chunk only the overlapping windows of the tiles are read and reprojected (nearest neighbour) onto
+   the common grid, and every block is written once. Memory does not grow with the size of the mosaic.
+
+Pixels outside of all tiles (and masked pixels) are set to the fill value of the data type.
+'''
+
+import math
+import os
+from collections import namedtuple
+from xml.etree import ElementTree
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.warp import reproject
+from rasterio.windows import Window, bounds as window_bounds
+
+from pipeline.band_schema import fill_value
+
+# GDAL names of the data types of the tiles
+GDAL_DATA_TYPES = {
+    "uint8": "Byte", "int8": "Int8", "uint16": "UInt16", "int16": "Int16", "uint32": "UInt32", "int32": "Int32",
+    "float32": "Float32", "float64": "Float64",
+}
+BLOCK_SIZE = 256
+# number of blocks along x written at once by `materialize`
+CHUNK_BLOCKS = 8
+
+MosaicGrid = namedtuple("MosaicGrid", ["transform", "width", "height", "crs", "count", "dtype", "nodata",
+                                       "descriptions", "scales", "offsets"])
+
+
+def mosaic_grid(tile_files):
+    """Common grid of the tiles: the union of their bounds with the finest pixel size of the tiles."""
+    west, south, east, north = math.inf, math.inf, -math.inf, -math.inf
+    pixel_size = math.inf
+    for tile_file in tile_files:
+        with rasterio.open(tile_file) as tile:
+            west, south = min(west, tile.bounds.left), min(south, tile.bounds.bottom)
+            east, north = max(east, tile.bounds.right), max(north, tile.bounds.top)
+            pixel_size = min(pixel_size, tile.res[0], tile.res[1])
+    with rasterio.open(tile_files[0]) as tile:
+        return MosaicGrid(
+            transform=Affine(pixel_size, 0, west, 0, -pixel_size, north),
+            width=math.ceil(round((east - west) / pixel_size, 6)),
+            height=math.ceil(round((north - south) / pixel_size, 6)),
+            crs=tile.crs, count=tile.count, dtype=tile.dtypes[0], nodata=fill_value(tile.dtypes[0]),
+            descriptions=list(tile.descriptions), scales=list(tile.scales), offsets=list(tile.offsets),
+        )
+
+
+def _format_nodata(value):
+    return "nan" if isinstance(value, float) and math.isnan(value) else repr(value)
+
+
+def write_vrt(vrt_filename, tile_files, grid):
+    """Write a virtual mosaic of the tiles on `grid`. The tiles are referenced relative to the VRT file."""
+    dataset = ElementTree.Element("VRTDataset", rasterXSize=str(grid.width), rasterYSize=str(grid.height))
+    ElementTree.SubElement(dataset, "SRS").text = grid.crs.to_wkt()
+    ElementTree.SubElement(dataset, "GeoTransform").text = ", ".join(repr(value) for value in grid.transform.to_gdal())
+
+    bands = []
+    for index in range(grid.count):
+        band = ElementTree.SubElement(dataset, "VRTRasterBand", dataType=GDAL_DATA_TYPES[grid.dtype],
+                                      band=str(index + 1))
+        if grid.descriptions[index]:
+            ElementTree.SubElement(band, "Description").text = grid.descriptions[index]
+        ElementTree.SubElement(band, "NoDataValue").text = _format_nodata(grid.nodata)
+        ElementTree.SubElement(band, "Offset").text = repr(grid.offsets[index])
+        ElementTree.SubElement(band, "Scale").text = repr(grid.scales[index])
+        bands.append(band)
+
+    vrt_dir = os.path.dirname(os.path.abspath(vrt_filename))
+    for tile_file in tile_files:
+        with rasterio.open(tile_file) as tile:
+            if tile.count != grid.count:
+                raise ValueError(f"{tile_file} has {tile.count} bands, but the mosaic has {grid.count}")
+            x_off = (tile.bounds.left - grid.transform.c) / grid.transform.a
+            y_off = (tile.bounds.top - grid.transform.f) / grid.transform.e
+            x_size = tile.width * tile.res[0] / grid.transform.a
+            y_size = tile.height * tile.res[1] / -grid.transform.e
+            for index, band in enumerate(bands, start=1):
+                source = ElementTree.SubElement(band, "ComplexSource")
+                ElementTree.SubElement(source, "SourceFilename", relativeToVRT="1").text = \
+                    os.path.relpath(os.path.abspath(tile_file), vrt_dir)
+                ElementTree.SubElement(source, "SourceBand").text = str(index)
+                ElementTree.SubElement(source, "SrcRect", xOff="0", yOff="0", xSize=str(tile.width),
+                                       ySize=str(tile.height))
+                ElementTree.SubElement(source, "DstRect", xOff=repr(x_off), yOff=repr(y_off), xSize=repr(x_size),
+                                       ySize=repr(y_size))
+                if tile.nodata is not None:
+                    ElementTree.SubElement(source, "NODATA").text = _format_nodata(tile.nodata)
+
+    temp_filename = vrt_filename + ".part"
+    ElementTree.ElementTree(dataset).write(temp_filename)
+    os.replace(temp_filename, vrt_filename)
+
+
+def _intersects(first, second):
+    return first[0] < second[2] and second[0] < first[2] and first[1] < second[3] and second[1] < first[3]
+
+
+def _source_window(tile, bounds):
+    """Window of a tile covering `bounds`, with a margin of one pixel, or None if they do not overlap."""
+    left, bottom, right, top = bounds
+    col_start, row_start = ~tile.transform * (left, top)
+    col_stop, row_stop = ~tile.transform * (right, bottom)
+    col_start, row_start = max(0, math.floor(col_start) - 1), max(0, math.floor(row_start) - 1)
+    col_stop, row_stop = min(tile.width, math.ceil(col_stop) + 1), min(tile.height, math.ceil(row_stop) + 1)
+    if col_stop <= col_start or row_stop <= row_start:
+        return None
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def materialize(output_filename, tile_files, grid, compress="ZSTD"):
+    """Write the tiles on `grid` into one tiled, compressed GeoTIFF, streaming over chunks of blocks."""
+    profile = {
+        "driver": "GTiff", "width": grid.width, "height": grid.height, "count": grid.count, "dtype": grid.dtype,
+        "crs": grid.crs, "transform": grid.transform, "nodata": grid.nodata, "tiled": True,
+        "blockxsize": BLOCK_SIZE, "blockysize": BLOCK_SIZE, "compress": compress, "bigtiff": "IF_SAFER",
+        # blocks without any tile are not written and read as nodata
+        "sparse_ok": True,
+    }
+    tile_bounds = []
+    for tile_file in tile_files:
+        with rasterio.open(tile_file) as tile:
+            tile_bounds.append((tile_file, tuple(tile.bounds)))
+
+    temp_filename = output_filename + ".part"
+    try:
+        with rasterio.open(temp_filename, 'w', **profile) as mosaic:
+            chunk_width = BLOCK_SIZE * CHUNK_BLOCKS
+            for row in range(0, grid.height, BLOCK_SIZE):
+                for col in range(0, grid.width, chunk_width):
+                    window = Window(col, row, min(chunk_width, grid.width - col), min(BLOCK_SIZE, grid.height - row))
+                    chunk_bounds = window_bounds(window, grid.transform)
+                    overlapping = [tile_file for tile_file, bounds in tile_bounds if _intersects(bounds, chunk_bounds)]
+                    if not overlapping:
+                        continue
+
+                    destination = np.full((grid.count, window.height, window.width), grid.nodata, dtype=grid.dtype)
+                    for tile_file in overlapping:
+                        with rasterio.open(tile_file) as tile:
+                            source_window = _source_window(tile, chunk_bounds)
+                            if source_window is None:
+                                continue
+                            reproject(
+                                source=tile.read(window=source_window), destination=destination,
+                                src_transform=tile.window_transform(source_window), src_crs=tile.crs,
+                                src_nodata=tile.nodata, dst_transform=mosaic.window_transform(window),
+                                dst_crs=grid.crs, dst_nodata=grid.nodata, resampling=Resampling.nearest,
+                                init_dest_nodata=False,
+                            )
+                    mosaic.write(destination, window=window)
+
+            for index in range(grid.count):
+                if grid.descriptions[index]:
+                    mosaic.set_band_description(index + 1, grid.descriptions[index])
+            mosaic.scales = grid.scales
+            mosaic.offsets = grid.offsets
+        os.replace(temp_filename, output_filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def build_day(date_of_interest, tile_files, mosaic_dir, materialized=False, compress="ZSTD"):
+    """Build the VRT (and optionally the GeoTIFF) mosaic of one day. Runs in a worker process.
+
+    Returns:
+        list: Paths of the written mosaics.
+    """
+    grid = mosaic_grid(tile_files)
+    vrt_filename = os.path.join(mosaic_dir, f"{date_of_interest}.vrt")
+    write_vrt(vrt_filename, tile_files, grid)
+    written = [vrt_filename]
+    if materialized:
+        tif_filename = os.path.join(mosaic_dir, f"{date_of_interest}.tif")
+        materialize(tif_filename, tile_files, grid, compress)
+        written.append(tif_filename)
+    return written
@@ -0,0 +1,126 @@
+'''
+Direct pixel fetching with `ee.data.computePixels`.
+
+Instead of requesting a GeoTIFF download URL and downloading the file, the pixels of an image are computed on a
+fixed grid and returned as an NPY payload. The payload is decoded without intermediate copies: the NPY header is
+parsed and the pixel data is viewed in place with `np.frombuffer`, and each band is then copied once into a
+preallocated (bands, height, width) array that is written to the output.
+'''
+
+import ast
+import math
+import os
+
+import ee
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+
+from pipeline.band_schema import write_band_metadata
+
+# 375 m in degrees, the conversion Earth Engine uses for the `scale` of EPSG:4326 downloads
+PIXEL_SIZE = 375 / 111319.490793
+CRS = "EPSG:4326"
+
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def pixel_grid(coordinates, pixel_size=PIXEL_SIZE):
+    """Pixel grid covering the bounding box of GeoJSON polygon coordinates, in the format of computePixels."""
+    longitudes = [point[0] for ring in coordinates for point in ring]
+    latitudes = [point[1] for ring in coordinates for point in ring]
+    west, north = min(longitudes), max(latitudes)
+    return {
+        'dimensions': {
+            'width': math.ceil((max(longitudes) - west) / pixel_size),
+            'height': math.ceil((north - min(latitudes)) / pixel_size),
+        },
+        'affineTransform': {
+            'scaleX': pixel_size, 'shearX': 0, 'translateX': west,
+            'shearY': 0, 'scaleY': -pixel_size, 'translateY': north,
+        },
+        'crsCode': CRS,
+    }
+
+
+def grid_transform(grid):
+    """Rasterio transform of a computePixels grid."""
+    affine = grid['affineTransform']
+    return Affine(affine['scaleX'], affine['shearX'], affine['translateX'],
+                  affine['shearY'], affine['scaleY'], affine['translateY'])
+
+
+def compute_pixels(image, grid):
+    """Compute the pixels of an Earth Engine image on a grid and return the NPY payload (blocking)."""
+    return ee.data.computePixels({
+        'expression': image,
+        'fileFormat': 'NPY',
+        'grid': grid,
+    })
+
+
+def view_npy(payload):
+    """View the array in NPY bytes without copying the pixel data.
+
+    Returns:
+        np.ndarray: Read-only array backed by `payload`.
+    """
+    if payload[:6] != NPY_MAGIC:
+        raise ValueError("Payload is not in NPY format")
+    major_version = payload[6]
+    if major_version == 1:
+        header_length = int.from_bytes(payload[8:10], "little")
+        header_start = 10
+    else:
+        header_length = int.from_bytes(payload[8:12], "little")
+        header_start = 12
+    header = ast.literal_eval(payload[header_start:header_start + header_length].decode("latin1"))
+    if header["fortran_order"]:
+        raise ValueError("Fortran ordered NPY payloads are not supported")
+    dtype = np.dtype(header["descr"])
+    shape = header["shape"]
+    count = math.prod(shape)
+    data = np.frombuffer(payload, dtype=dtype, count=count, offset=header_start + header_length)
+    return data.reshape(shape)
+
+
+def decode_pixels(payload, out=None):
+    """Decode a computePixels NPY payload into a (bands, height, width) array.
+
+    Earth Engine returns a (height, width) array with one field per band; each band is copied once into `out`,
+    which is allocated if it is not given.
+    """
+    pixels = view_npy(payload)
+    if pixels.dtype.names is None:
+        # plain (height, width, bands) array
+        bands = [pixels[..., index] for index in range(pixels.shape[-1])]
+    else:
+        bands = [pixels[name] for name in pixels.dtype.names]
+    if out is None:
+        out = np.empty((len(bands),) + bands[0].shape, dtype=np.result_type(*bands))
+    for index, band in enumerate(bands):
+        out[index] = band
+    return out
+
+
+def write_geotiff(filename, data, grid, bands=None):
+    """Write a (bands, height, width) array on a computePixels grid to a GeoTIFF.
+
+    The file is written to a temporary file that is renamed once complete. If `bands` is given, the band schema
+    is written into the file.
+    """
+    temp_filename = filename + ".part"
+    profile = {
+        "driver": "GTiff", "count": data.shape[0], "height": data.shape[1], "width": data.shape[2],
+        "dtype": data.dtype, "crs": grid['crsCode'], "transform": grid_transform(grid),
+    }
+    try:
+        with rasterio.open(temp_filename, 'w', **profile) as dataset:
+            dataset.write(data)
+            if bands is not None:
+                write_band_metadata(dataset, bands)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
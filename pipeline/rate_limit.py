@@ -0,0 +1,106 @@
+'''
+Adaptive concurrency control and retry helpers for the Earth Engine and download requests.
+
+`AdaptiveLimiter` is an AIMD (additive increase, multiplicative decrease) limiter: every successful request
+grows the number of requests allowed in flight by roughly one per window of requests, and a throttling
+response (HTTP 429/503, Earth Engine quota errors) halves it. Failed requests are retried with exponential
+backoff and full jitter.
+'''
+
+import asyncio
+import random
+import time
+
+import aiohttp
+import ee
+from rasterio.errors import RasterioIOError
+
+# HTTP status codes that signal that we are sending requests too fast
+THROTTLING_STATUS = {429, 503}
+# HTTP status codes worth retrying
+RETRIABLE_STATUS = {429, 500, 502, 503, 504}
+# Earth Engine reports throttling and transient server problems only in the error message
+EE_THROTTLING_MESSAGES = ("too many", "quota", "rate limit", "429")
+EE_RETRIABLE_MESSAGES = EE_THROTTLING_MESSAGES + (
+    "internal error", "timed out", "deadline", "service unavailable", "503")
+
+
+def is_throttling_error(error):
+    """Check whether the error means that the server wants us to slow down."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in THROTTLING_STATUS
+    if isinstance(error, ee.EEException):
+        message = str(error).lower()
+        return any(pattern in message for pattern in EE_THROTTLING_MESSAGES)
+    return False
+
+
+def is_retriable_error(error):
+    """Check whether a request that failed with this error may succeed when tried again."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRIABLE_STATUS
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, RasterioIOError)):
+        # network problems and truncated or corrupt downloads
+        return True
+    if isinstance(error, ee.EEException):
+        message = str(error).lower()
+        return any(pattern in message for pattern in EE_RETRIABLE_MESSAGES)
+    return False
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter for the given (zero-based) retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    def __init__(self, max_limit, initial_limit=None, min_limit=1, decrease_factor=0.5, cooldown=1.0):
+        """Limit the number of requests in flight, adapting the limit to the responses (AIMD).
+
+        The limiter is an async context manager around one request.
+
+        Args:
+            max_limit (int): Upper bound of concurrent requests.
+            initial_limit (int): Starting limit, defaults to half of `max_limit`.
+            min_limit (int): Lower bound of concurrent requests.
+            decrease_factor (float): Factor applied to the limit on throttling.
+            cooldown (float): Minimum number of seconds between two decreases, so that a burst of throttled
+                responses to requests sent at the same time only counts once.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit or max(min_limit, max_limit // 2))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.throttled = 0
+        self._last_decrease = float("-inf")
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if exc is None:
+            self._increase()
+        elif is_throttling_error(exc):
+            self._decrease()
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+        return False
+
+    def _increase(self):
+        # +1/limit per success adds about one slot per window of `limit` successful requests
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self):
+        self.throttled += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
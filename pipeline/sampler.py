@@ -0,0 +1,178 @@
+'''
+Patch sampler for training data loaders.
+
+Serves fixed-size spatiotemporal patches around active fire from the cube without loading whole tiles:
+
+1. Fire pixels are drawn uniformly from the memory-mapped `FireIndex`, among the days with `num_days` days of
+   history in the cube; the patch is placed around the pixel with a random offset of up to `jitter` pixels, and
+   covers the `num_days` days ending on the day of the fire pixel.
+2. A patch is read with a windowed read of the cube, which only decompresses the chunks it overlaps. The same
+   window of the static layers and of the land cover of the year of the last day is joined to every time step,
+   with the bands in the order of `FULL_BANDS` (see `patch_bands`). Patches that extend beyond a tile are padded
+   with NaN (or the fill value of the daily array if they are not decoded).
+3. Batches are read by a pool of worker processes, each with its own open cube, and `prefetch` batches are kept in
+   flight so that the next batch is ready when the training step asks for it.
+'''
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+
+from pipeline.cube import LANDCOVER_ARRAY, STATIC_ARRAY, TileCube
+from pipeline.fire_index import FireIndex
+from pipeline.layers import ANNUAL_BANDS, FULL_BANDS
+
+# location of a patch: sub-region, cube day of the last time step and upper left pixel
+LOCATION_DTYPE = np.dtype([("region", "int32"), ("day", "int32"), ("row", "int32"), ("col", "int32")])
+
+# cube and patch parameters of a worker process
+_worker = {}
+
+
+def _full_band_order(band):
+    return FULL_BANDS.index(band) if band in FULL_BANDS else len(FULL_BANDS)
+
+
+def _daily_band_names(cube, bands):
+    return list(cube.bands) if bands is None else [
+        cube.bands[band] if isinstance(band, int) else band for band in bands]
+
+
+def patch_bands(cube, bands=None):
+    """Names of the bands of a patch: the daily `bands` (all by default) joined with the static and land cover
+    bands of the cube, in the order of `FULL_BANDS`."""
+    joined = _daily_band_names(cube, bands) + cube.static_bands + (ANNUAL_BANDS if cube.landcover_years else [])
+    return sorted(joined, key=_full_band_order)
+
+
+def _landcover_year(cube, day):
+    """Year of the land cover joined to a patch ending on a cube day, the closest year in the cube."""
+    years = cube.landcover_years
+    return min(max((cube.start_date + timedelta(days=day)).year, years[0]), years[-1])
+
+
+def read_patch(cube, location, patch_size, num_days, bands=None, decoded=True):
+    """Read the (time, band, y, x) patch at a location, padded where it extends beyond the tile.
+
+    The bands are those of `patch_bands`; the static and land cover bands are the same at every time step.
+    """
+    region, day, row, col = (int(value) for value in location)
+    height, width = cube.tile_shape(region)
+    names = patch_bands(cube, bands)
+    dtype = "float32" if decoded else cube.daily.dtype
+    fill = np.nan if decoded else cube.daily.fill_value
+    patch = np.full((num_days, len(names), patch_size, patch_size), fill, dtype=dtype)
+
+    first_day = day - num_days + 1
+    read_first_day = max(first_day, 0)
+    top, left = max(row, 0), max(col, 0)
+    bottom, right = min(row + patch_size, height), min(col + patch_size, width)
+    if bottom <= top or right <= left or day < 0:
+        return patch
+    window = (top, left, bottom - top, right - left)
+    steps = slice(read_first_day - first_day, None)
+    rows, cols = slice(top - row, bottom - row), slice(left - col, right - col)
+    start_date = (cube.start_date + timedelta(days=read_first_day)).strftime('%Y-%m-%d')
+    end_date = (cube.start_date + timedelta(days=day)).strftime('%Y-%m-%d')
+    data = cube.read(region, start_date, end_date, bands, decoded, window=window)
+    for name, band_data in zip(_daily_band_names(cube, bands), data.swapaxes(0, 1)):
+        patch[steps, names.index(name), rows, cols] = band_data
+
+    layers = []
+    if cube.static_bands:
+        layers.append((cube.static_bands, cube.read_static(region, decoded, window), cube.group[STATIC_ARRAY]))
+    if cube.landcover_years:
+        landcover = cube.read_landcover(region, _landcover_year(cube, day), decoded, window)
+        layers.append((ANNUAL_BANDS, landcover[None], cube.group[LANDCOVER_ARRAY]))
+    for layer_bands, layer_data, array in layers:
+        if not decoded:
+            # the layers may be stored with another data type and fill value than the daily bands
+            layer_data = np.where(layer_data == array.fill_value, fill, layer_data)
+        for name, band_data in zip(layer_bands, layer_data):
+            patch[steps, names.index(name), rows, cols] = band_data
+    return patch
+
+
+def _open_cube(cube_path, patch_size, num_days, bands, decoded):
+    _worker.update(cube=TileCube(cube_path), patch_size=patch_size, num_days=num_days, bands=bands, decoded=decoded)
+
+
+def _read_batch(locations):
+    """Read the patches of a batch of locations. Runs in a worker process."""
+    return np.stack([
+        read_patch(_worker["cube"], location, _worker["patch_size"], _worker["num_days"], _worker["bands"],
+                   _worker["decoded"])
+        for location in locations
+    ])
+
+
+class PatchSampler:
+    def __init__(self, cube_path, index_dir, patch_size=64, num_days=5, bands=None, decoded=True, jitter=None,
+                 batch_size=16, workers=4, prefetch=4, seed=None):
+        """Sample patches of `num_days` days and `patch_size` pixels around the fire pixels of an index.
+
+        Args:
+            bands (list): Band names or indices to read, defaults to all bands of the cube.
+            decoded (bool): Return float32 physical values with missing pixels as NaN.
+            jitter (int): Maximum offset of the fire pixel from the center of the patch, defaults to a quarter of
+                the patch size.
+            prefetch (int): Number of batches read ahead by the worker processes.
+        """
+        self.cube_path = cube_path
+        self.index = FireIndex(index_dir)
+        self.patch_size = patch_size
+        self.num_days = num_days
+        self.bands = bands
+        self.decoded = decoded
+        self.jitter = patch_size // 4 if jitter is None else jitter
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch
+        self.rng = np.random.default_rng(seed)
+        # the cube may have grown at the start since the index was built
+        self.day_offset = (self.index.start_date - TileCube(cube_path).start_date).days
+        self.tiles = self.index.tiles[self.index.tiles["day"] + self.day_offset >= num_days - 1]
+        self.cumulative_counts = np.cumsum(self.tiles["count"], dtype=np.int64)
+        if len(self.tiles) == 0:
+            raise ValueError(f"The fire index {index_dir} contains no fire pixels with {num_days} days of history")
+
+    def sample_locations(self, count):
+        """Draw `count` patch locations around uniformly chosen fire pixels."""
+        draws = self.rng.integers(0, self.cumulative_counts[-1], count)
+        tiles = np.searchsorted(self.cumulative_counts, draws, side="right")
+        first_draws = self.cumulative_counts[tiles] - self.tiles["count"][tiles]
+        rows, cols = self.index.pixel_coordinates(self.tiles["start"][tiles] + draws - first_draws)
+        offsets = self.rng.integers(-self.jitter, self.jitter + 1, size=(2, count))
+        locations = np.empty(count, dtype=LOCATION_DTYPE)
+        locations["region"] = self.tiles["region"][tiles]
+        locations["day"] = self.tiles["day"][tiles] + self.day_offset
+        locations["row"] = rows - self.patch_size // 2 + offsets[0]
+        locations["col"] = cols - self.patch_size // 2 + offsets[1]
+        return locations
+
+    def batches(self, num_batches=None):
+        """Yield (patches, locations) batches, indefinitely if `num_batches` is None.
+
+        `patches` has the shape (batch, time, band, y, x).
+        """
+        initargs = (self.cube_path, self.patch_size, self.num_days, self.bands, self.decoded)
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_open_cube, initargs=initargs)
+        pending = deque()
+        submitted = 0
+        try:
+            while True:
+                while len(pending) < self.prefetch and (num_batches is None or submitted < num_batches):
+                    locations = self.sample_locations(self.batch_size)
+                    pending.append((executor.submit(_read_batch, locations), locations))
+                    submitted += 1
+                if not pending:
+                    return
+                future, locations = pending.popleft()
+                yield future.result(), locations
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __iter__(self):
+        return self.batches()
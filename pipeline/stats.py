@@ -0,0 +1,278 @@
+'''
+Mergeable per-band statistics of the extracted tiles.
+
+Normalization constants are computed in one pass over all tiles, in parallel and with bounded memory:
+
+1. `BandStatistics` keeps the count, the number of missing (nodata or NaN) pixels, the minimum and maximum, the mean
+   and the sum of squared deviations (merged with the parallel algorithm of Chan et al.) and a `QuantileSketch`
+   for the percentiles. Land cover additionally keeps the histogram of its classes.
+2. The statistics of a batch of files are computed in a worker process and merged into the total. Bands stored as
+   scaled integers (see pipeline/band_schema.py) are first counted per stored value, so the work per pixel is a
+   single `bincount`.
+3. The merged state is saved to a JSON sidecar together with the files it covers, so new days can be added
+   without reading the old tiles again.
+
+Every daily tile contributes its daily bands; the static and land cover layers contribute once per sub-region
+(and year), as they are stored once.
+'''
+
+import json
+import math
+import os
+from collections import Counter
+
+import numpy as np
+import rasterio
+
+from pipeline.layers import ANNUAL_BANDS, DAILY_BANDS, FULL_BANDS, STATIC_BANDS
+
+# relative accuracy of the percentiles
+SKETCH_ACCURACY = 0.001
+# absolute values below this are counted as zero by the sketch
+SKETCH_MIN_VALUE = 1e-9
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+CLASS_BANDS = ["Landcover class"]
+
+
+class QuantileSketch:
+    """Relative-error quantile sketch (DDSketch): values are counted in logarithmic buckets.
+
+    Every quantile is returned within `accuracy` relative error, the number of buckets only grows with the
+    logarithm of the value range, and two sketches are merged by adding their bucket counts.
+    """
+
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zeros = 0
+
+    def _keys(self, values):
+        return np.ceil(np.log(values) / math.log(self.gamma)).astype(np.int64)
+
+    def _add(self, buckets, values, counts):
+        keys = self._keys(values)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=counts, minlength=len(unique))
+        for key, total in zip(unique.tolist(), totals.tolist()):
+            buckets[key] += int(total)
+
+    def update(self, values, counts):
+        """Add `counts[i]` occurrences of `values[i]`."""
+        small = np.abs(values) < SKETCH_MIN_VALUE
+        self.zeros += int(counts[small].sum())
+        positive, negative = (values > 0) & ~small, (values < 0) & ~small
+        self._add(self.positive, values[positive], counts[positive])
+        self._add(self.negative, -values[negative], counts[negative])
+
+    def merge(self, other):
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantiles(self, fractions):
+        """Values at the given fractions (0 to 1) of the sorted values, None for an empty sketch."""
+        buckets = [(-self._value(key), count) for key, count in sorted(self.negative.items(), reverse=True)]
+        buckets.append((0.0, self.zeros))
+        buckets.extend((self._value(key), count) for key, count in sorted(self.positive.items()))
+        total = sum(count for _, count in buckets)
+        if total == 0:
+            return [None for _ in fractions]
+        values = np.array([value for value, _ in buckets])
+        cumulative = np.cumsum([count for _, count in buckets])
+        ranks = np.asarray(fractions) * (total - 1)
+        return values[np.searchsorted(cumulative, ranks, side="right")].tolist()
+
+    def to_dict(self):
+        return {
+            "accuracy": self.accuracy, "zeros": self.zeros,
+            "positive": {str(key): count for key, count in self.positive.items()},
+            "negative": {str(key): count for key, count in self.negative.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["accuracy"])
+        sketch.zeros = state["zeros"]
+        sketch.positive = Counter({int(key): count for key, count in state["positive"].items()})
+        sketch.negative = Counter({int(key): count for key, count in state["negative"].items()})
+        return sketch
+
+
+class BandStatistics:
+    """Mergeable statistics of the values of one band."""
+
+    def __init__(self, classes=False):
+        self.count = 0
+        self.missing = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = QuantileSketch()
+        self.classes = Counter() if classes else None
+
+    def _merge_moments(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, values, counts, missing=0):
+        """Add `counts[i]` valid occurrences of `values[i]` and `missing` missing pixels."""
+        self.missing += int(missing)
+        count = int(counts.sum())
+        if count == 0:
+            return
+        mean = float(np.dot(values, counts) / count)
+        m2 = float(np.dot((values - mean) ** 2, counts))
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self._merge_moments(count, mean, m2)
+        self.sketch.update(values, counts)
+        if self.classes is not None:
+            for value, class_count in zip(values.tolist(), counts.tolist()):
+                self.classes[int(value)] += int(class_count)
+
+    def merge(self, other):
+        self.missing += other.missing
+        if other.count == 0:
+            return
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.sketch.merge(other.sketch)
+        if self.classes is not None:
+            self.classes.update(other.classes)
+
+    def summary(self, percentiles=PERCENTILES):
+        """Normalization constants of the band."""
+        summary = {"count": self.count, "missing": self.missing}
+        if self.count:
+            quantiles = self.sketch.quantiles([percentile / 100 for percentile in percentiles])
+            summary.update({
+                "mean": self.mean,
+                "std": math.sqrt(self.m2 / self.count),
+                "min": self.minimum,
+                "max": self.maximum,
+                # the sketch is approximate, so keep its values within the exact range
+                "percentiles": {f"{percentile:g}": min(max(value, self.minimum), self.maximum)
+                                for percentile, value in zip(percentiles, quantiles)},
+            })
+        if self.classes is not None:
+            summary["classes"] = {str(value): count for value, count in sorted(self.classes.items())}
+        return summary
+
+    def to_dict(self):
+        return {
+            "count": self.count, "missing": self.missing, "mean": self.mean, "m2": self.m2,
+            "min": self.minimum if self.count else None, "max": self.maximum if self.count else None,
+            "sketch": self.sketch.to_dict(),
+            "classes": None if self.classes is None else {str(key): count for key, count in self.classes.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        statistics = cls(classes=state["classes"] is not None)
+        statistics.count, statistics.missing = state["count"], state["missing"]
+        statistics.mean, statistics.m2 = state["mean"], state["m2"]
+        if statistics.count:
+            statistics.minimum, statistics.maximum = state["min"], state["max"]
+        statistics.sketch = QuantileSketch.from_dict(state["sketch"])
+        if statistics.classes is not None:
+            statistics.classes = Counter({int(key): count for key, count in state["classes"].items()})
+        return statistics
+
+
+def new_statistics():
+    """Empty statistics of every FirePred band."""
+    return {band: BandStatistics(classes=band in CLASS_BANDS) for band in FULL_BANDS}
+
+
+def file_bands(dataset):
+    """FirePred band names of a dataset, from its band descriptions or its number of bands."""
+    if all(dataset.descriptions):
+        return list(dataset.descriptions)
+    for bands in (FULL_BANDS, DAILY_BANDS, STATIC_BANDS, ANNUAL_BANDS):
+        if dataset.count == len(bands):
+            return bands
+    raise ValueError(f"Cannot identify the bands of {dataset.name} with {dataset.count} bands")
+
+
+def _band_values(data, nodata, scale, offset):
+    """Distinct valid values of a band with their counts, and the number of missing pixels."""
+    data = data.ravel()
+    if data.dtype.kind in "iu" and data.dtype.itemsize <= 2:
+        # count every stored integer once, then decode only the distinct values
+        info = np.iinfo(data.dtype)
+        counts = np.bincount((data.astype(np.int64) - info.min), minlength=info.max - info.min + 1)
+        stored = np.arange(info.min, info.max + 1)
+        missing = 0
+        if nodata is not None and info.min <= nodata <= info.max:
+            missing = int(counts[int(nodata) - info.min])
+            counts[int(nodata) - info.min] = 0
+        present = counts > 0
+        return stored[present] * scale + offset, counts[present], missing
+
+    values = data.astype(np.float64) * scale + offset
+    valid = ~np.isnan(values)
+    if nodata is not None and not math.isnan(nodata):
+        valid &= data != nodata
+    return values[valid], np.ones(int(valid.sum()), dtype=np.int64), data.size - int(valid.sum())
+
+
+def statistics_of_files(filenames):
+    """Statistics of a batch of GeoTIFFs, one band at a time. Runs in a worker process."""
+    statistics = new_statistics()
+    for filename in filenames:
+        with rasterio.open(filename) as dataset:
+            for index, band in enumerate(file_bands(dataset), start=1):
+                values, counts, missing = _band_values(dataset.read(index), dataset.nodata,
+                                                       dataset.scales[index - 1], dataset.offsets[index - 1])
+                statistics[band].update(values, counts, missing)
+    return statistics
+
+
+def merge_statistics(total, statistics):
+    for band, band_statistics in statistics.items():
+        total[band].merge(band_statistics)
+    return total
+
+
+def file_signature(filename):
+    """Size and modification time of a file, to detect tiles that were rewritten since they were counted."""
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_sidecar(path):
+    """Load the statistics and the covered files of a sidecar, or empty ones if it does not exist.
+
+    Returns:
+        tuple: ({band: BandStatistics}, {relative filename: signature})
+    """
+    if not os.path.exists(path):
+        return new_statistics(), {}
+    with open(path, 'r') as f:
+        sidecar = json.load(f)
+    statistics = new_statistics()
+    statistics.update({band: BandStatistics.from_dict(state) for band, state in sidecar["state"].items()})
+    return statistics, sidecar["files"]
+
+
+def write_sidecar(path, statistics, files, percentiles=PERCENTILES):
+    """Write the normalization constants for the loaders and the mergeable state for incremental updates."""
+    sidecar = {
+        "bands": {band: statistics[band].summary(percentiles) for band in FULL_BANDS},
+        "files": files,
+        "state": {band: band_statistics.to_dict() for band, band_statistics in statistics.items()},
+    }
+    temp_filename = path + ".part"
+    with open(temp_filename, 'w') as f:
+        json.dump(sidecar, f)
+    os.replace(temp_filename, path)
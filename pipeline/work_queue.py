@@ -0,0 +1,166 @@
+'''
+Shared lease-based work queue for sharded extraction.
+
+Several extraction processes, on one machine or on several, take their jobs from one shared queue instead of
+generating them, so that no job is fetched twice and none is missed:
+
+1. The jobs of a run are enqueued as (key, payload) tasks. Enqueuing is idempotent: tasks that are already in the
+   queue are kept, only failed ones are requeued.
+2. A worker leases a batch of pending tasks for `lease_seconds`. The batch is taken in one write transaction, so
+   two workers never hold the same task.
+3. While it works, the worker renews its leases; a finished task is marked done or failed.
+4. The leases of a crashed worker expire and its tasks are leased by the other workers. A task whose lease was
+   taken `max_attempts` times without finishing is marked failed, so a task that crashes its workers does not
+   stop the run.
+
+`SQLiteWorkQueue` keeps the queue in a SQLite database, whose file locks serialize the transactions of the
+processes. The database uses a rollback journal rather than WAL, which needs shared memory between the processes
+and so does not work on a network filesystem; workers on several machines need the database on a filesystem with
+working locks, or another store: `WORK_QUEUES` maps the scheme of a queue location
+(`sqlite:///path/queue.sqlite`, or just a path) to a class with the methods of `SQLiteWorkQueue`. Lease expiry
+compares wall clock times, so the clocks of the machines must be synchronized.
+'''
+
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# number of times a task is leased before it is given up
+MAX_ATTEMPTS = 3
+
+
+class SQLiteWorkQueue:
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        """Open (or create) the queue database at `path`."""
+        self.path = path
+        self.max_attempts = max_attempts
+        # transactions are started explicitly, so that a lease takes the write lock before it reads; the connection
+        # is used from one thread at a time, but not necessarily from the thread that opened it
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        # WAL needs shared memory on one host, a rollback journal also works on a shared filesystem
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS tasks (
+                position INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, position)")
+
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def enqueue(self, tasks):
+        """Add (key, payload) tasks in order. New tasks and failed ones are pending afterwards.
+
+        Returns:
+            int: Number of tasks added or requeued.
+        """
+        now = time.time()
+        with self._transaction():
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT INTO tasks (key, payload, state, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, payload = excluded.payload, "
+                "attempts = 0, error = NULL, updated_at = excluded.updated_at WHERE tasks.state = ?",
+                ((key, payload, PENDING, now, FAILED) for key, payload in tasks),
+            )
+            return self.connection.total_changes - before
+
+    def lease(self, worker, count, lease_seconds):
+        """Lease up to `count` pending tasks, or tasks whose lease expired, to `worker`.
+
+        Returns:
+            list: (key, payload) of the leased tasks, in the order they were enqueued.
+        """
+        now = time.time()
+        with self._transaction():
+            self.connection.execute(
+                "UPDATE tasks SET state = ?, worker = NULL, error = ?, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, f"lease expired {self.max_attempts} times", now, LEASED, now, self.max_attempts),
+            )
+            rows = self.connection.execute(
+                "SELECT position, key, payload FROM tasks WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY position LIMIT ?",
+                (PENDING, LEASED, now, count),
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE position = ?",
+                [(LEASED, worker, now + lease_seconds, now, position) for position, _, _ in rows],
+            )
+        return [(key, payload) for _, key, payload in rows]
+
+    def renew(self, worker, lease_seconds):
+        """Extend every lease held by `worker`."""
+        now = time.time()
+        with self._transaction():
+            self.connection.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE state = ? AND worker = ?",
+                (now + lease_seconds, now, LEASED, worker),
+            )
+
+    def _finish(self, key, worker, state, error=None):
+        with self._transaction():
+            self.connection.execute(
+                "UPDATE tasks SET state = ?, error = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE key = ? AND state = ? AND worker = ?",
+                (state, error, time.time(), key, LEASED, worker),
+            )
+
+    def complete(self, key, worker):
+        """Mark a task leased by `worker` as done."""
+        self._finish(key, worker, DONE)
+
+    def fail(self, key, worker, error):
+        """Mark a task leased by `worker` as failed with the given error message."""
+        self._finish(key, worker, FAILED, str(error))
+
+    def remaining(self, exclude_worker=None):
+        """Number of tasks that are pending or leased, not counting the leases of `exclude_worker`."""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM tasks WHERE state = ? OR (state = ? AND worker IS NOT ?)",
+            (PENDING, LEASED, exclude_worker)).fetchone()[0]
+
+    def counts(self):
+        """Return the number of tasks per state."""
+        return dict(self.connection.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def close(self):
+        self.connection.close()
+
+
+# work queue implementations by the scheme of their location
+WORK_QUEUES = {
+    "sqlite": SQLiteWorkQueue,
+}
+
+
+def open_work_queue(location, max_attempts=MAX_ATTEMPTS):
+    """Open the work queue at `scheme://location`; a location without a scheme is a SQLite database path."""
+    scheme, separator, path = location.partition("://")
+    if not separator:
+        scheme, path = "sqlite", location
+    if scheme not in WORK_QUEUES:
+        raise ValueError(f"Unknown work queue scheme {scheme}, expected one of {sorted(WORK_QUEUES)}")
+    return WORK_QUEUES[scheme](path, max_attempts=max_attempts)
@@ -1,98 +1,236 @@
 '''
 GeoTIFF Image Processor and Visualizer
 
-This script processes the multi-channel GeoTIFF image file and performs the following tasks:
-
-1. Reads and validates the image to ensure it contains 22 channels.
-2. Extracts and prints metadata such as image dimensions, bounds, CRS, and transform.
-3. Reads each channel and maps it to a predefined list of channel names.
-4. Prints the shape and data type of each channel.
-5. Counts the number of active fire pixels in the "VIIRS band M11" channel.
-6. Creates an RGB composite image using "VIIRS band M11" (R), "VIIRS band I2" (G), and "VIIRS band I1" (B).
-7. Displays the RGB composite image with geographic coordinates.
+This script creates a quick-look of one or many multi-channel GeoTIFF images (or a VRT mosaic) and performs the
+following tasks:
+
+1. Collects the images from the given files and directories and prints the extent, CRS and resolution.
+2. Reads only the requested bands (by default "VIIRS band M11", "VIIRS band I2" and "VIIRS band I1"), decimated
+   to fit the display size. GDAL uses the overviews of the files if they have any. Static and land cover bands
+   that a daily image does not contain are read from the static layers of its sub-region (see
+   pipeline/layers.py).
+3. Decodes bands stored as scaled integers to their physical values and mosaics the images onto one canvas.
+4. Prints the shape and data type of every displayed band and counts the active fire pixels in the
+   "VIIRS band M11" band of the images, block by block at full resolution.
+5. Normalizes every band with robust percentiles that are computed from histograms in streaming blocks.
+6. Displays the RGB composite image with geographic coordinates.
+
+Memory is bounded by the display size, not by the size of the rasters.
 
 Usage:
-    python script_name.py <path_to_geotiff_image>
+    python script_name.py <path_to_geotiff_image_or_directory> [...] [--bands <name> <name> <name>]
+                          [--max_size <pixels>] [--percentiles <low> <high>]
 '''
 
-import rasterio
-from rasterio.plot import show
+import argparse
+import glob
+import math
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
-import argparse
+import rasterio
+from rasterio.enums import Resampling
+from pipeline.layers import (ANNUAL_BANDS, DAILY_BANDS, FULL_BANDS, STATIC_BANDS, TILE_PATTERN, landcover_filename,
+                             parse_tile_filename, static_filename)
+
+RGB_BANDS = ["VIIRS band M11", "VIIRS band I2", "VIIRS band I1"]
+FIRE_BAND = "VIIRS band M11"
+# longest side of the quick-look in pixels
+MAX_DISPLAY_SIZE = 2048
 
 def parse_arguments():
     """Parse command-line arguments."""
-    parser = argparse.ArgumentParser(description="Process and visualize a multi-channel GeoTIFF image.")
-    parser.add_argument("image_filepath", help="Path to the GeoTIFF image file.")
+    parser = argparse.ArgumentParser(description="Process and visualize multi-channel GeoTIFF images.")
+    parser.add_argument("image_paths", nargs="+", help="GeoTIFF or VRT files, or directories containing them.")
+    parser.add_argument("--bands", nargs=3, default=RGB_BANDS, help="Names of the red, green and blue bands.")
+    parser.add_argument("--max_size", type=int, default=MAX_DISPLAY_SIZE,
+                        help="Longest side of the displayed image in pixels.")
+    parser.add_argument("--percentiles", nargs=2, type=float, default=[2, 98],
+                        help="Percentiles mapped to the darkest and brightest value of each band.")
     return parser.parse_args()
 
-def load_tiff_metadata(image_file):
-    """Load GeoTIFF metadata and channels."""
-    channel_names = [
-        "VIIRS band M11", "VIIRS band I2", "VIIRS band I1", "NDVI", "EVI2", 
-        "Total precipitation", "Wind speed", "Wind direction", 
-        "Minimum temperature", "Maximum temperature", "Energy release component", 
-        "Specific humidity", "Slope", "Aspect", "Elevation", 
-        "Palmer drought severity index", "Landcover class", 
-        "Forecast total precipitation", "Forecast wind speed", 
-        "Forecast wind direction", "Forecast temperature", 
-        "Forecast specific humidity"
-    ]
-
+def collect_images(paths):
+    """Expand directories into the GeoTIFF and VRT files they contain."""
+    image_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            image_files.extend(sorted(glob.glob(os.path.join(path, "*.tif")) + glob.glob(os.path.join(path, "*.vrt"))))
+        else:
+            image_files.append(path)
+    if not image_files:
+        raise ValueError(f"No images found in {paths}")
+    return image_files
+
+def image_bands(tif_image):
+    """Names of the bands of an image, from the band descriptions or the FirePred band order."""
+    if all(tif_image.descriptions):
+        return list(tif_image.descriptions)
+    if tif_image.count == len(FULL_BANDS):
+        return FULL_BANDS
+    if tif_image.count == len(DAILY_BANDS):
+        return DAILY_BANDS
+    raise ValueError(f"Cannot identify the bands of {tif_image.name} with {tif_image.count} channels")
+
+def band_sources(image_file, band_names):
+    """Find the file and (1-based) index of every band of an image.
+
+    Static and land cover bands that a daily image `<date>_<region>.tif` does not contain are taken from the
+    static layers of its sub-region in the `static` directory next to it.
+
+    Returns:
+        list: (filename, index) of every band in `band_names`.
+    """
     with rasterio.open(image_file) as tif_image:
-        assert tif_image.count == 22, f"Expected 22 channels, but found {tif_image.count}"
-        print(f"Image width: {tif_image.width}")
-        print(f"Image height: {tif_image.height}")
-        print(f"Image bounds: {tif_image.bounds}")
-        print(f"Image CRS: {tif_image.crs}")
-        print(f"Image transform: {tif_image.transform}")
-
-        channels_data = {}
-        for i in range(1, tif_image.count + 1):
-            channels_data[channel_names[i-1]] = tif_image.read(i)
-
-        return tif_image.crs, tif_image.transform, tif_image.bounds, channels_data
-
-def summarize_channels(channels_data):
-    """Print a summary of the channels."""
-    for name, data in channels_data.items():
-        print(f"{name}: Shape = {data.shape}, Data Type = {data.dtype}")
-        if name == "VIIRS band M11":
-            num_fire_pixels = np.count_nonzero(data)
-            print(f"Number of active fire pixels in {name}: {num_fire_pixels}")
-
-def create_rgb_image(channels_data):
-    """Create an RGB composite image from selected bands."""
-    red = channels_data["VIIRS band M11"]
-    green = channels_data["VIIRS band I2"]
-    blue = channels_data["VIIRS band I1"]
-
-    rgb_image = np.stack([red, green, blue], axis=-1)
-    rgb_image = (rgb_image - rgb_image.min()) / (rgb_image.max() - rgb_image.min())
-    return rgb_image
-
-def plot_rgb_image(rgb_image, transform):
+        names = image_bands(tif_image)
+    is_daily_tile = TILE_PATTERN.match(os.path.basename(image_file)) is not None
+    sources = []
+    for name in band_names:
+        if name in names:
+            sources.append((image_file, names.index(name) + 1))
+            continue
+        layer_file, layer_bands = None, []
+        if is_daily_tile and name in STATIC_BANDS + ANNUAL_BANDS:
+            date_of_interest, sub_region_number = parse_tile_filename(image_file)
+            output_dir = os.path.dirname(image_file)
+            if name in STATIC_BANDS:
+                layer_file, layer_bands = static_filename(output_dir, sub_region_number), STATIC_BANDS
+            else:
+                layer_file = landcover_filename(output_dir, date_of_interest[:4], sub_region_number)
+                layer_bands = ANNUAL_BANDS
+        if layer_file is None or not os.path.exists(layer_file):
+            raise ValueError(f"{image_file} has no band {name!r} and no static layer file with it; "
+                             f"its bands are {names}")
+        sources.append((layer_file, layer_bands.index(name) + 1))
+    return sources
+
+def load_tiff_metadata(image_files):
+    """Load the combined extent, CRS and finest resolution of the images, without reading any pixels."""
+    west, south, east, north = math.inf, math.inf, -math.inf, -math.inf
+    resolution = math.inf
+    crs = None
+    for image_file in image_files:
+        with rasterio.open(image_file) as tif_image:
+            west, south = min(west, tif_image.bounds.left), min(south, tif_image.bounds.bottom)
+            east, north = max(east, tif_image.bounds.right), max(north, tif_image.bounds.top)
+            resolution = min(resolution, tif_image.res[0])
+            crs = crs or tif_image.crs
+    print(f"Images: {len(image_files)}")
+    print(f"Image bounds: {(west, south, east, north)}")
+    print(f"Image CRS: {crs}")
+    print(f"Full resolution size: {round((east - west) / resolution)} x {round((north - south) / resolution)}")
+    return crs, (west, south, east, north), resolution
+
+def read_decimated(image_files, band_names, bounds, resolution, max_size):
+    """Read the requested bands of all images onto one canvas of at most `max_size` pixels per side.
+
+    Every image is read with a decimated read (from its overviews if available), decoded to float32 and placed
+    on the canvas, so only one decimated image and the canvas are in memory at any time. Missing pixels are NaN.
+    """
+    west, south, east, north = bounds
+    full_width, full_height = (east - west) / resolution, (north - south) / resolution
+    factor = max(1.0, full_width / max_size, full_height / max_size)
+    pixel_size = resolution * factor
+    canvas_width, canvas_height = max(1, round(full_width / factor)), max(1, round(full_height / factor))
+    canvas = np.full((len(band_names), canvas_height, canvas_width), np.nan, dtype="float32")
+
+    for image_file in image_files:
+        with rasterio.open(image_file) as tif_image:
+            col_off = round((tif_image.bounds.left - west) / pixel_size)
+            row_off = round((north - tif_image.bounds.top) / pixel_size)
+            out_width = min(max(1, round(tif_image.width * tif_image.res[0] / pixel_size)), canvas_width - col_off)
+            out_height = min(max(1, round(tif_image.height * tif_image.res[1] / pixel_size)),
+                             canvas_height - row_off)
+        if out_width <= 0 or out_height <= 0:
+            continue
+        for band, (source_file, index) in enumerate(band_sources(image_file, band_names)):
+            # the static layers are on the grid of the daily image, so they are read with the same shape
+            with rasterio.open(source_file) as tif_image:
+                data = tif_image.read(index, out_shape=(out_height, out_width), resampling=Resampling.nearest,
+                                      masked=True)
+                decoded = (data.astype("float32") * tif_image.scales[index - 1]
+                           + tif_image.offsets[index - 1]).filled(np.nan)
+            target = canvas[band, row_off:row_off + out_height, col_off:col_off + out_width]
+            np.copyto(target, decoded, where=~np.isnan(decoded))
+
+    transform = (pixel_size, 0, west, 0, -pixel_size, north)
+    return canvas, transform
+
+def count_fire_pixels(image_files):
+    """Count the active fire pixels (non-zero and not missing) of the fire band of the images, reading one block
+    at a time at full resolution. Images without the fire band are skipped."""
+    count = 0
+    for image_file in image_files:
+        with rasterio.open(image_file) as tif_image:
+            names = image_bands(tif_image)
+            if FIRE_BAND not in names:
+                continue
+            index = names.index(FIRE_BAND) + 1
+            for _, window in tif_image.block_windows(index):
+                block = tif_image.read(index, window=window, masked=True)
+                decoded = block.astype("float32") * tif_image.scales[index - 1] + tif_image.offsets[index - 1]
+                count += int(np.count_nonzero(decoded.filled(0)))
+    return count
+
+def summarize_channels(canvas, band_names, image_files):
+    """Print the shape and data type of every displayed band and the number of active fire pixels."""
+    for name, band in zip(band_names, canvas):
+        print(f"{name}: Shape = {band.shape}, Data Type = {band.dtype}")
+    print(f"Number of active fire pixels in {FIRE_BAND}: {count_fire_pixels(image_files)}")
+
+def streaming_percentiles(band, low, high, block_rows=256, bins=4096):
+    """Approximate percentiles of a band, ignoring NaN, from histograms accumulated over blocks of rows."""
+    value_min, value_max = math.inf, -math.inf
+    for row in range(0, band.shape[0], block_rows):
+        block = band[row:row + block_rows]
+        valid = block[~np.isnan(block)]
+        if valid.size:
+            value_min, value_max = min(value_min, valid.min()), max(value_max, valid.max())
+    if value_min == math.inf or value_min == value_max:
+        return value_min, value_max
+
+    histogram = np.zeros(bins, dtype="int64")
+    for row in range(0, band.shape[0], block_rows):
+        block = band[row:row + block_rows]
+        histogram += np.histogram(block[~np.isnan(block)], bins=bins, range=(value_min, value_max))[0]
+    cumulative = np.cumsum(histogram) / histogram.sum()
+    edges = np.linspace(value_min, value_max, bins + 1)
+    return (edges[np.searchsorted(cumulative, low / 100)],
+            edges[min(bins, np.searchsorted(cumulative, high / 100) + 1)])
+
+def create_rgb_image(canvas, percentiles):
+    """Create an RGB composite image by normalizing each band of the canvas in place."""
+    for band in canvas:
+        low, high = streaming_percentiles(band, *percentiles)
+        band -= low
+        band /= max(high - low, np.finfo("float32").eps)
+        np.clip(band, 0, 1, out=band)
+    return np.nan_to_num(np.moveaxis(canvas, 0, -1), copy=False)
+
+def plot_rgb_image(rgb_image, transform, band_names):
     """Plot the RGB composite image."""
     height, width = rgb_image.shape[:2]
-    x_coords = np.arange(width) * transform[0] + transform[2]
-    y_coords = np.arange(height) * transform[4] + transform[5]
+    west, north = transform[2], transform[5]
+    east, south = west + width * transform[0], north + height * transform[4]
 
     plt.figure(figsize=(10, 8))
-    plt.imshow(rgb_image, extent=(x_coords[0], x_coords[-1], y_coords[-1], y_coords[0]))
-    plt.title('RGB Composite (VIIRS band M11, I2, I1)')
-    plt.xlabel('Easting (m)')
-    plt.ylabel('Northing (m)')
-    plt.colorbar(label='Intensity')
+    plt.imshow(rgb_image, extent=(west, east, south, north))
+    plt.title(f"RGB Composite ({', '.join(band_names)})")
+    plt.xlabel('Longitude')
+    plt.ylabel('Latitude')
     plt.axis('on')
     plt.show()
 
 if __name__ == "__main__":
     args = parse_arguments()
 
-    # Load metadata and channels
-    crs, transform, bounds, channels_data = load_tiff_metadata(args.image_filepath)
+    # Load metadata of all images
+    image_files = collect_images(args.image_paths)
+    crs, bounds, resolution = load_tiff_metadata(image_files)
 
-    # Create and plot RGB image
-    rgb_image = create_rgb_image(channels_data)
-    plot_rgb_image(rgb_image, transform)
+    # Read the requested bands at display resolution, then create and plot the RGB image
+    canvas, transform = read_decimated(image_files, args.bands, bounds, resolution, args.max_size)
+    print(f"Display size: {canvas.shape[2]} x {canvas.shape[1]}")
+    summarize_channels(canvas, args.bands, image_files)
+    rgb_image = create_rgb_image(canvas, args.percentiles)
+    plot_rgb_image(rgb_image, transform, args.bands)